@@ -7,8 +7,33 @@ class Settings(BaseSettings):
     port: int = 8000
 
     redis_url: str = "redis://cart-redis:6379/0"
+    # comma-separated Redis URLs that carts are sharded over (consistent hashing); empty: redis_url only.
+    # Set redis_previous_nodes to the old list while adding a node, then run `python -m app.rebalance`.
+    redis_nodes: str = ""
+    redis_previous_nodes: str = ""
+    redis_vnodes: int = 160
     secret_key: str = "dev-secret-change-me"
 
+    cart_batch_max_ops: int = 100
+
+    # legacy order history (orders:{sub}); moved to order-service by app/scripts/migrate_orders.py
+    legacy_orders_max: int = 100
+    legacy_orders_page_size: int = 20
+    legacy_orders_encoding: str = "msgpack"
+    order_url: str = "http://order:8000"
+
+    # product snapshots for /cart/items: refreshed in the background after product_snapshot_ttl,
+    # dropped by Redis after product_snapshot_max_age
+    catalog_url: str = "http://catalog:8000"
+    catalog_timeout: float = 5.0
+    product_snapshot_ttl: float = 30.0
+    product_snapshot_max_age: int = 3600
+
+    # sliding idle expiry of cart:{sub}, refreshed on every write (0 disables)
+    cart_ttl_seconds: int = 14 * 24 * 3600
+    cart_stats_scan_count: int = 500
+    cart_stats_sample_size: int = 200
+
     class Config:
         env_file = ".env"
         env_file_encoding = "utf-8"
@@ -0,0 +1,96 @@
+from __future__ import annotations
+
+import base64
+import json
+from typing import Any, Dict
+
+from .config import settings
+
+try:  # msgpack is a declared dependency; without it new entries are written as JSON
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+# Legacy order history (order-service owns orders now; see app/scripts/migrate_orders.py).
+# keys: orders:{sub}        -> list of encoded orders, newest first, capped at LEGACY_ORDERS_MAX
+#       orders-pushed:{sub} -> number of orders ever pushed to the list (anchors cursors)
+#       order:{id}          -> encoded order
+# Entries are msgpack maps, or JSON objects when written by older versions (they start with "{").
+RETIRED_KEY = "legacy-orders:retired"
+
+
+def list_key(sub: str) -> str:
+    return f"orders:{sub}"
+
+
+def pushed_key(sub: str) -> str:
+    return f"orders-pushed:{sub}"
+
+
+def order_key(oid: str) -> str:
+    return f"order:{oid}"
+
+
+def encode(order: Dict[str, Any]) -> bytes:
+    if msgpack is not None and settings.legacy_orders_encoding == "msgpack":
+        return msgpack.packb(order, use_bin_type=True)
+    return json.dumps(order, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def decode(raw: bytes) -> Dict[str, Any]:
+    if raw[:1] == b"{":
+        return json.loads(raw)
+    if msgpack is None:
+        raise ValueError("msgpack-encoded order but msgpack is not installed")
+    return msgpack.unpackb(raw, raw=False)
+
+
+# The k-th order ever pushed sits at index pushed - k: head pushes and tail trims (LTRIM) do not move it,
+# so a cursor holding k stays valid. Lists written before the counter existed start it at LLEN.
+
+# KEYS: list, counter, order:{id}; ARGV: encoded order, cap (0: none).
+# Returns the entries trimmed off the tail.
+ADD_LUA = """
+if redis.call('EXISTS', KEYS[2]) == 0 then
+  redis.call('SET', KEYS[2], redis.call('LLEN', KEYS[1]))
+end
+redis.call('INCR', KEYS[2])
+redis.call('SET', KEYS[3], ARGV[1])
+redis.call('LPUSH', KEYS[1], ARGV[1])
+local cap = tonumber(ARGV[2])
+if cap > 0 then
+  local overflow = redis.call('LRANGE', KEYS[1], cap, -1)
+  redis.call('LTRIM', KEYS[1], 0, cap - 1)
+  return overflow
+end
+return {}
+"""
+
+# KEYS: list, counter; ARGV: mode ("offset" | "cursor"), offset or k, limit.
+# Returns {length, pushed, start index, entries}.
+PAGE_LUA = """
+local n = redis.call('LLEN', KEYS[1])
+local pushed = tonumber(redis.call('GET', KEYS[2]) or n)
+local start = tonumber(ARGV[2])
+if ARGV[1] == 'cursor' then
+  start = pushed - start
+end
+if start < 0 then
+  start = 0
+end
+local limit = tonumber(ARGV[3])
+return {n, pushed, start, redis.call('LRANGE', KEYS[1], start, start + limit - 1)}
+"""
+
+
+def encode_cursor(k: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps({"k": k}).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> int:
+    raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+    value = int(json.loads(raw)["k"])
+    if value < 1:
+        raise ValueError("cursor out of range")
+    return value
@@ -1,13 +1,18 @@
 from __future__ import annotations
 
-from typing import Dict
+from typing import Dict, List, Optional
 import json
+import random
+import time
 
-from fastapi import FastAPI, Depends, HTTPException, status
+import httpx
+from fastapi import FastAPI, Depends, HTTPException, Query, Response, status
+from fastapi.responses import JSONResponse
 from fastapi.security import OAuth2PasswordBearer
 from jose import jwt, JWTError
 from redis import asyncio as aioredis
 
+from . import legacy_orders, sharding, snapshots
 from .config import settings
 
 
@@ -23,17 +28,63 @@ def decode_token(token: str) -> dict:
         raise HTTPException(status_code=401, detail="Invalid token") from e
 
 
+def require_admin(payload: dict):
+    if payload.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Admin required")
+
+
 def get_cart_key(identity: str) -> str:
     return f"cart:{identity}"
 
 
+CART_PATTERN = "cart:*"
+
+
+def touch(pipe, key: str) -> None:
+    """Queue the sliding idle expiry of a cart next to the write that keeps it alive."""
+    if settings.cart_ttl_seconds > 0:
+        pipe.expire(key, settings.cart_ttl_seconds)
+
+
+# HINCRBY only if the resulting quantity stays within the cap (ARGV[3] < 0: no cap),
+# then slide the cart expiry (ARGV[4] seconds, 0: none).
+# Returns {1, new_qty} when applied, {0, current_qty} when rejected.
+ADD_CAPPED_LUA = """
+local current = tonumber(redis.call('HGET', KEYS[1], ARGV[1]) or '0')
+local qty = tonumber(ARGV[2])
+local cap = tonumber(ARGV[3])
+if cap >= 0 and current + qty > cap then
+  return {0, current}
+end
+local new_qty = redis.call('HINCRBY', KEYS[1], ARGV[1], qty)
+if tonumber(ARGV[4]) > 0 then
+  redis.call('EXPIRE', KEYS[1], ARGV[4])
+end
+return {1, new_qty}
+"""
+
+
 @app.on_event("startup")
 async def on_startup():
+    # carts are spread over REDIS_NODES; legacy orders stay on REDIS_URL
+    app.state.shards = sharding.from_settings()
     app.state.redis = aioredis.from_url(settings.redis_url, encoding="utf-8", decode_responses=True)
+    # EVALSHA with automatic SCRIPT LOAD on NOSCRIPT; called with client=<shard>
+    app.state.add_capped = app.state.redis.register_script(ADD_CAPPED_LUA)
+    app.state.cart_items = app.state.redis.register_script(snapshots.CART_ITEMS_LUA)
+    # legacy order entries are binary (msgpack), so they get a client without response decoding
+    app.state.orders_redis = aioredis.from_url(settings.redis_url)
+    app.state.orders_page = app.state.orders_redis.register_script(legacy_orders.PAGE_LUA)
+    app.state.orders_add = app.state.orders_redis.register_script(legacy_orders.ADD_LUA)
+    app.state.catalog = httpx.AsyncClient(base_url=settings.catalog_url, timeout=settings.catalog_timeout)
 
 
 @app.on_event("shutdown")
 async def on_shutdown():
+    await snapshots.refresher.stop()
+    await app.state.catalog.aclose()
+    await app.state.shards.close()
+    await app.state.orders_redis.close()
     r = app.state.redis
     if r:
         await r.close()
@@ -45,7 +96,9 @@ async def health():
         pong = await app.state.redis.ping()
     except Exception:
         pong = False
-    return {"status": "ok", "redis": bool(pong)}
+    shards = await app.state.shards.health()
+    healthy = bool(pong) and all(s["ok"] for s in shards.values())
+    return {"status": "ok" if healthy else "degraded", "redis": healthy, "shards": shards}
 
 
 @app.get("/cart")
@@ -55,11 +108,75 @@ async def get_cart(token: str = Depends(oauth2_scheme)):
     if not sub:
         raise HTTPException(status_code=401, detail="Invalid token subject")
     key = get_cart_key(sub)
-    items: Dict[str, str] = await app.state.redis.hgetall(key)
+    r = await app.state.shards.for_key(key)
+    items: Dict[str, str] = await r.hgetall(key)
     # Convert values to int
     return {pid: int(qty) for pid, qty in items.items()}
 
 
+@app.get("/cart/summary")
+async def cart_summary(token: str = Depends(oauth2_scheme)):
+    """Counts for the header badge, from a single HGETALL (no catalog calls)."""
+    payload = decode_token(token)
+    sub = payload.get("sub")
+    if not sub:
+        raise HTTPException(status_code=401, detail="Invalid token subject")
+    key = get_cart_key(sub)
+    r = await app.state.shards.for_key(key)
+    items: Dict[str, str] = await r.hgetall(key)
+    quantities = {pid: int(qty) for pid, qty in items.items()}
+    return {"lines": len(quantities), "items": sum(quantities.values()), "quantities": quantities}
+
+
+@app.get("/cart/items")
+async def cart_items(token: str = Depends(oauth2_scheme)):
+    """Cart lines with product snapshots (name, price, stock, is_active, first image) and the total.
+
+    Lines and snapshots come from one Redis round trip. Products never seen before are fetched
+    with one catalog batch call; stale snapshots are served as is and refreshed in the background.
+    If the catalog cannot be asked about lines with no snapshot, the answer is 503: a cart with
+    lines silently left out would show a wrong total.
+    """
+    payload = decode_token(token)
+    sub = payload.get("sub")
+    if not sub:
+        raise HTTPException(status_code=401, detail="Invalid token subject")
+    key = get_cart_key(sub)
+    # snapshots are kept next to the cart, on the same shard
+    r = await app.state.shards.for_key(key)
+    flat = await app.state.cart_items(keys=[key], args=[snapshots.SNAPSHOT_PREFIX], client=r)
+    lines = []
+    unknown: List[str] = []
+    stale: List[str] = []
+    now = time.time()
+    for pid, qty, raw in zip(flat[::3], flat[1::3], flat[2::3]):
+        snap = json.loads(raw) if raw else None
+        if snap is None:
+            unknown.append(pid)
+        elif snapshots.is_stale(snap, now):
+            stale.append(pid)
+        lines.append((pid, int(qty), snap))
+    if unknown:
+        try:
+            fetched = await snapshots.refresh(r, app.state.catalog, unknown)
+        except (httpx.HTTPError, ValueError):
+            raise HTTPException(status_code=503, detail="catalog unavailable")
+        lines = [(pid, qty, fetched.get(pid) if snap is None else snap) for pid, qty, snap in lines]
+    if stale:
+        snapshots.refresher.schedule(r, app.state.catalog, stale)
+    items = []
+    total = 0.0
+    for pid, qty, snap in lines:
+        # deleted products (tombstones) are left out
+        if snap is None or snap.get("missing"):
+            continue
+        product = {k: v for k, v in snap.items() if k != "fetched_at"}
+        price = float(product.get("price") or 0)
+        items.append({"product": product, "qty": qty, "subtotal": round(price * qty, 2)})
+        total += price * qty
+    return {"items": items, "total": round(total, 2)}
+
+
 @app.post("/cart/add")
 async def cart_add(body: dict, token: str = Depends(oauth2_scheme)):
     payload = decode_token(token)
@@ -70,9 +187,21 @@ async def cart_add(body: dict, token: str = Depends(oauth2_scheme)):
     qty = int(body.get("qty") or 0)
     if not pid or qty <= 0:
         raise HTTPException(status_code=422, detail="Invalid input")
+    max_qty = body.get("max_qty")
+    try:
+        cap = -1 if max_qty is None else max(int(max_qty), 0)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=422, detail="Invalid max_qty")
     key = get_cart_key(sub)
-    await app.state.redis.hincrby(key, pid, qty)
-    return {"ok": True}
+    r = await app.state.shards.for_key(key)
+    # check and increment run atomically in Redis, so concurrent adds cannot overshoot the cap
+    applied, current = await app.state.add_capped(keys=[key], args=[pid, qty, cap, settings.cart_ttl_seconds], client=r)
+    if not applied:
+        return JSONResponse(
+            status_code=409,
+            content={"detail": "Not enough stock", "qty": int(current), "max_qty": cap},
+        )
+    return {"ok": True, "qty": int(current)}
 
 
 @app.post("/cart/remove")
@@ -85,7 +214,11 @@ async def cart_remove(body: dict, token: str = Depends(oauth2_scheme)):
     if not pid:
         raise HTTPException(status_code=422, detail="Invalid input")
     key = get_cart_key(sub)
-    await app.state.redis.hdel(key, pid)
+    r = await app.state.shards.for_key(key)
+    async with r.pipeline(transaction=True) as pipe:
+        pipe.hdel(key, pid)
+        touch(pipe, key)
+        await pipe.execute()
     return {"ok": True}
 
 
@@ -103,13 +236,91 @@ async def cart_set(body: dict, token: str = Depends(oauth2_scheme)):
     except Exception:
         raise HTTPException(status_code=422, detail="Invalid qty")
     key = get_cart_key(sub)
-    if qty <= 0:
-        await app.state.redis.hdel(key, pid)
-    else:
-        await app.state.redis.hset(key, pid, qty)
+    r = await app.state.shards.for_key(key)
+    async with r.pipeline(transaction=True) as pipe:
+        if qty <= 0:
+            pipe.hdel(key, pid)
+        else:
+            pipe.hset(key, pid, qty)
+        touch(pipe, key)
+        await pipe.execute()
     return {"ok": True}
 
 
+def _parse_op(i: int, raw: dict) -> dict:
+    if not isinstance(raw, dict):
+        raise HTTPException(status_code=422, detail=f"ops[{i}]: object expected")
+    kind = raw.get("op")
+    pid = str(raw.get("product_id") or "").strip()
+    if kind not in ("add", "set", "remove") or not pid:
+        raise HTTPException(status_code=422, detail=f"ops[{i}]: invalid op")
+    op = {"op": kind, "product_id": pid}
+    try:
+        if kind in ("add", "set"):
+            op["qty"] = int(raw.get("qty"))
+        if kind == "add" and raw.get("max_qty") is not None:
+            op["max_qty"] = max(int(raw["max_qty"]), 0)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=422, detail=f"ops[{i}]: invalid qty")
+    if kind == "add" and op["qty"] <= 0:
+        raise HTTPException(status_code=422, detail=f"ops[{i}]: invalid qty")
+    return op
+
+
+@app.post("/cart/batch")
+async def cart_batch(body: dict, token: str = Depends(oauth2_scheme)):
+    """Apply an ordered list of add/set/remove ops in one MULTI/EXEC and return the final cart.
+
+    Body: {"ops": [{"op": "add", "product_id": "...", "qty": 1, "max_qty": 5}, {"op": "set", ...}, {"op": "remove", ...}]}
+    An add with max_qty goes through the capped-add script and may be rejected on its own;
+    the other ops are still applied.
+    """
+    payload = decode_token(token)
+    sub = payload.get("sub")
+    if not sub:
+        raise HTTPException(status_code=401, detail="Invalid token subject")
+    raw_ops = body.get("ops")
+    if not isinstance(raw_ops, list) or not raw_ops:
+        raise HTTPException(status_code=422, detail="ops must be a non-empty list")
+    if len(raw_ops) > settings.cart_batch_max_ops:
+        raise HTTPException(status_code=422, detail=f"At most {settings.cart_batch_max_ops} ops per batch")
+    ops = [_parse_op(i, raw) for i, raw in enumerate(raw_ops)]
+    key = get_cart_key(sub)
+    r = await app.state.shards.for_key(key)
+    async with r.pipeline(transaction=True) as pipe:
+        for op in ops:
+            pid = op["product_id"]
+            if op["op"] == "add":
+                if "max_qty" in op:
+                    await app.state.add_capped(
+                        keys=[key], args=[pid, op["qty"], op["max_qty"], settings.cart_ttl_seconds], client=pipe
+                    )
+                else:
+                    pipe.hincrby(key, pid, op["qty"])
+            elif op["op"] == "set" and op["qty"] > 0:
+                pipe.hset(key, pid, op["qty"])
+            else:
+                pipe.hdel(key, pid)
+        touch(pipe, key)
+        pipe.hgetall(key)
+        replies = await pipe.execute()
+    results = []
+    for op, reply in zip(ops, replies):
+        result = {"op": op["op"], "product_id": op["product_id"], "ok": True}
+        if op["op"] == "add":
+            if "max_qty" in op:
+                applied, qty = reply
+                result.update(ok=bool(applied), qty=int(qty))
+                if not applied:
+                    result["detail"] = "Not enough stock"
+            else:
+                result["qty"] = int(reply)
+        elif op["op"] == "set":
+            result["qty"] = max(op["qty"], 0)
+        results.append(result)
+    return {"results": results, "cart": {pid: int(qty) for pid, qty in replies[-1].items()}}
+
+
 @app.post("/cart/clear")
 async def cart_clear(token: str = Depends(oauth2_scheme)):
     payload = decode_token(token)
@@ -117,24 +328,183 @@ async def cart_clear(token: str = Depends(oauth2_scheme)):
     if not sub:
         raise HTTPException(status_code=401, detail="Invalid token subject")
     key = get_cart_key(sub)
+    r = await app.state.shards.for_key(key)
     # delete entire cart hash key
-    await app.state.redis.delete(key)
+    await r.delete(key)
     return {"ok": True}
 
 
-# Orders storage in Redis
-# keys: orders:{sub} -> list(JSON), order:{id} -> JSON
+# Cart size buckets (number of lines) reported by /admin/carts/stats
+SIZE_BUCKETS = ((1, "1"), (5, "2-5"), (10, "6-10"), (20, "11-20"), (None, "21+"))
+
+
+def _bucket(lines: int) -> str:
+    for upper, label in SIZE_BUCKETS:
+        if upper is None or lines <= upper:
+            return label
+    return SIZE_BUCKETS[-1][1]
+
+
+def _percentile(values: List[int], q: float) -> Optional[int]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def scan_carts(r):
+    """Yield batches of (key, lines, ttl) with SCAN, so Redis is never blocked by a full keyspace walk.
+
+    SCAN may return a key more than once while the keyspace is being resized; the figures are approximate.
+    """
+    cursor = 0
+    while True:
+        cursor, keys = await r.scan(cursor=cursor, match=CART_PATTERN, count=settings.cart_stats_scan_count)
+        if keys:
+            async with r.pipeline(transaction=False) as pipe:
+                for key in keys:
+                    pipe.hlen(key)
+                    pipe.ttl(key)
+                replies = await pipe.execute()
+            yield list(zip(keys, replies[::2], replies[1::2]))
+        if cursor == 0:
+            break
+
+
+@app.get("/admin/carts/stats")
+async def carts_stats(
+    sample: Optional[int] = Query(None, ge=1, le=5000),
+    token: str = Depends(oauth2_scheme),
+):
+    """Cart count, size distribution and memory per cart (MEMORY USAGE on a random sample of carts), over all shards."""
+    require_admin(decode_token(token))
+    shards = app.state.shards
+    sample_size = sample or settings.cart_stats_sample_size
+    rng = random.Random()
+    carts = lines_total = without_ttl = 0
+    sizes = {label: 0 for _, label in SIZE_BUCKETS}
+    sampled: List[tuple] = []
+    per_shard: Dict[str, dict] = {}
+    for url, r in shards.clients.items():
+        shard_carts = 0
+        async for batch in scan_carts(r):
+            for key, lines, ttl in batch:
+                if lines <= 0:
+                    continue  # expired between SCAN and HLEN
+                carts += 1
+                shard_carts += 1
+                lines_total += lines
+                sizes[_bucket(lines)] += 1
+                if ttl == -1:
+                    without_ttl += 1
+                # reservoir sampling: every cart has the same chance to be measured
+                if len(sampled) < sample_size:
+                    sampled.append((url, key))
+                else:
+                    j = rng.randrange(carts)
+                    if j < sample_size:
+                        sampled[j] = (url, key)
+        try:
+            info = await r.info("memory")
+        except Exception:
+            info = {}
+        per_shard[sharding.node_name(url)] = {
+            "carts": shard_carts,
+            "used_memory": info.get("used_memory"),
+            "maxmemory": info.get("maxmemory"),
+            "maxmemory_policy": info.get("maxmemory_policy"),
+        }
+    usage: List[int] = []
+    for url, r in shards.clients.items():
+        keys = [key for node, key in sampled if node == url]
+        if not keys:
+            continue
+        async with r.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.memory_usage(key)
+            # MEMORY may be disabled (e.g. on managed Redis): such replies are errors and are skipped
+            usage += [int(b) for b in await pipe.execute(raise_on_error=False) if isinstance(b, int)]
+    avg_bytes = sum(usage) / len(usage) if usage else None
+    return {
+        "carts": carts,
+        "lines": lines_total,
+        "avg_lines": round(lines_total / carts, 2) if carts else 0.0,
+        "size_distribution": sizes,
+        "without_ttl": without_ttl,
+        "ttl_seconds": settings.cart_ttl_seconds,
+        "memory": {
+            "sampled": len(usage),
+            "avg_bytes": round(avg_bytes, 1) if avg_bytes is not None else None,
+            "p50_bytes": _percentile(usage, 0.5),
+            "p95_bytes": _percentile(usage, 0.95),
+            "max_bytes": max(usage) if usage else None,
+            "estimated_total_bytes": int(avg_bytes * carts) if avg_bytes is not None else None,
+        },
+        "shards": per_shard,
+    }
+
+
+@app.post("/admin/carts/expire-idle")
+async def carts_expire_idle(token: str = Depends(oauth2_scheme)):
+    """Give carts written before the idle expiry existed (no TTL) the configured TTL."""
+    require_admin(decode_token(token))
+    if settings.cart_ttl_seconds <= 0:
+        raise HTTPException(status_code=409, detail="CART_TTL_SECONDS is disabled")
+    updated = 0
+    for r in app.state.shards.clients.values():
+        async for batch in scan_carts(r):
+            keys = [key for key, _, ttl in batch if ttl == -1]
+            if not keys:
+                continue
+            async with r.pipeline(transaction=False) as pipe:
+                for key in keys:
+                    pipe.expire(key, settings.cart_ttl_seconds, nx=True)
+                updated += sum(1 for ok in await pipe.execute() if ok)
+    return {"updated": updated, "ttl_seconds": settings.cart_ttl_seconds}
+
+
+# Legacy order history in Redis (msgpack/JSON entries, see legacy_orders.py)
+
+
+async def _legacy_store():
+    r = app.state.orders_redis
+    if await r.exists(legacy_orders.RETIRED_KEY):
+        # migrated to order-service by app/scripts/migrate_orders.py
+        raise HTTPException(status_code=410, detail="Legacy orders moved to order-service")
+    return r
 
 
 @app.get("/orders")
-async def list_orders(token: str = Depends(oauth2_scheme)):
+async def list_orders(
+    response: Response,
+    limit: int = Query(None, ge=1, le=200),
+    offset: int = Query(0, ge=0),
+    cursor: Optional[str] = Query(None),
+    token: str = Depends(oauth2_scheme),
+):
+    """Newest first. Page with offset, or with the X-Next-Cursor value of the previous page
+    (stable while new orders are added)."""
     payload = decode_token(token)
     sub = payload.get("sub")
     if not sub:
         raise HTTPException(status_code=401, detail="Invalid token subject")
-    key = f"orders:{sub}"
-    items = await app.state.redis.lrange(key, 0, -1)
-    return [json.loads(x) for x in items]
+    limit = limit or settings.legacy_orders_page_size
+    mode, position = "offset", offset
+    if cursor:
+        try:
+            mode, position = "cursor", legacy_orders.decode_cursor(cursor)
+        except (ValueError, TypeError, KeyError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    r = await _legacy_store()
+    total, pushed, start, items = await app.state.orders_page(
+        keys=[legacy_orders.list_key(sub), legacy_orders.pushed_key(sub)], args=[mode, position, limit], client=r
+    )
+    end = int(start) + len(items)
+    response.headers["X-Total-Count"] = str(total)
+    if end < int(total):
+        # k of the next entry: where the next page starts however many orders are added meanwhile
+        response.headers["X-Next-Cursor"] = legacy_orders.encode_cursor(int(pushed) - end)
+    return [legacy_orders.decode(x) for x in items]
 
 
 @app.get("/orders/{oid}")
@@ -143,10 +513,11 @@ async def get_order(oid: str, token: str = Depends(oauth2_scheme)):
     sub = payload.get("sub")
     if not sub:
         raise HTTPException(status_code=401, detail="Invalid token subject")
-    raw = await app.state.redis.get(f"order:{oid}")
+    r = await _legacy_store()
+    raw = await r.get(legacy_orders.order_key(oid))
     if not raw:
         raise HTTPException(status_code=404, detail="Order not found")
-    data = json.loads(raw)
+    data = legacy_orders.decode(raw)
     if data.get("user") != sub:
         raise HTTPException(status_code=403, detail="Forbidden")
     return data
@@ -163,7 +534,14 @@ async def add_order(body: dict, token: str = Depends(oauth2_scheme)):
     oid = order.get("id")
     if not oid:
         raise HTTPException(status_code=422, detail="Order id required")
-    raw = json.dumps(order, ensure_ascii=False)
-    await app.state.redis.set(f"order:{oid}", raw)
-    await app.state.redis.lpush(f"orders:{sub}", raw)
+    r = await _legacy_store()
+    overflow = await app.state.orders_add(
+        keys=[legacy_orders.list_key(sub), legacy_orders.pushed_key(sub), legacy_orders.order_key(oid)],
+        args=[legacy_orders.encode(order), max(settings.legacy_orders_max, 0)],
+        client=r,
+    )
+    # orders trimmed off the list lose their order:{id} copy as well
+    dropped = {str(legacy_orders.decode(x).get("id")) for x in overflow} - {str(oid)}
+    if dropped:
+        await r.delete(*[legacy_orders.order_key(i) for i in dropped])
     return {"ok": True, "id": oid}
@@ -0,0 +1,32 @@
+"""Move carts to the nodes the current REDIS_NODES ring assigns them to.
+
+Run after adding (or removing) a Redis node, once every replica uses the new node list:
+
+    python -m app.rebalance [--dry-run]
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+
+from .sharding import from_settings, rebalance
+
+
+async def _run(dry_run: bool) -> dict:
+    shards = from_settings()
+    try:
+        return await rebalance(shards, dry_run=dry_run)
+    finally:
+        await shards.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dry-run", action="store_true", help="only count misplaced carts")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(_run(args.dry_run)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
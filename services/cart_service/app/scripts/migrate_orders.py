@@ -0,0 +1,140 @@
+"""One-shot move of the legacy order history from cart-service Redis into order-service.
+
+    python -m app.scripts.migrate_orders [--dry-run] [--batch-size 200]
+
+Writes to the legacy /orders endpoints are stopped first (legacy-orders:retired, they answer 410
+from then on). Orders are read from order:{id} keys and orders:{sub} lists (deduplicated by id),
+imported through order-service POST /admin/orders/import and deleted from Redis once order-service
+has them. The import skips orders it already has, so an interrupted run can simply be repeated.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List
+
+import httpx
+from jose import jwt
+from redis import asyncio as aioredis
+
+from .. import legacy_orders
+from ..config import settings
+
+
+def mint_admin_token() -> str:
+    expire = datetime.now(timezone.utc) + timedelta(minutes=5)
+    payload = {"sub": "cart-service", "role": "admin", "exp": expire}
+    return jwt.encode(payload, settings.secret_key, algorithm="HS256")
+
+
+class Migration:
+    def __init__(self, r, order: httpx.AsyncClient, batch_size: int, dry_run: bool) -> None:
+        self.r = r
+        self.order = order
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self.seen: set = set()
+        self.report: Dict[str, Any] = {"orders": 0, "imported": 0, "skipped": 0, "invalid": [], "deleted_keys": 0}
+
+    async def _import(self, docs: List[Dict[str, Any]]) -> None:
+        self.report["orders"] += len(docs)
+        if self.dry_run or not docs:
+            return
+        resp = await self.order.post(
+            "/admin/orders/import",
+            json={"orders": docs},
+            headers={"Authorization": f"Bearer {mint_admin_token()}"},
+        )
+        if resp.status_code != 200:
+            raise SystemExit(f"order-service import failed ({resp.status_code}): {resp.text}")
+        data = resp.json()
+        self.report["imported"] += data.get("imported", 0)
+        self.report["skipped"] += data.get("skipped", 0)
+
+    async def _delete(self, keys: List[str]) -> None:
+        if keys and not self.dry_run:
+            self.report["deleted_keys"] += await self.r.delete(*keys)
+
+    def _take(self, raw: bytes, key: str, user: str | None = None) -> Dict[str, Any] | None:
+        try:
+            doc = legacy_orders.decode(raw)
+        except ValueError:
+            self.report["invalid"].append(key)
+            return None
+        if not isinstance(doc, dict) or not doc.get("id"):
+            self.report["invalid"].append(key)
+            return None
+        if user and not doc.get("user"):
+            doc["user"] = user
+        if not doc.get("user"):
+            self.report["invalid"].append(key)
+            return None
+        oid = str(doc["id"])
+        if oid in self.seen:
+            return None
+        self.seen.add(oid)
+        return doc
+
+    async def orders_by_id(self) -> None:
+        keys: List[str] = []
+        docs: List[Dict[str, Any]] = []
+        async for key in self.r.scan_iter(match="order:*", count=500):
+            key = key.decode()
+            raw = await self.r.get(key)
+            if raw is None:
+                continue
+            doc = self._take(raw, key)
+            if key in self.report["invalid"]:
+                continue
+            keys.append(key)
+            if doc is not None:
+                docs.append(doc)
+            if len(docs) >= self.batch_size:
+                await self._import(docs)
+                await self._delete(keys)
+                keys, docs = [], []
+        await self._import(docs)
+        await self._delete(keys)
+
+    async def order_lists(self) -> None:
+        async for key in self.r.scan_iter(match="orders:*", count=500):
+            key = key.decode()
+            sub = key[len("orders:"):]
+            docs = [doc for raw in await self.r.lrange(key, 0, -1) if (doc := self._take(raw, key, sub)) is not None]
+            for start in range(0, len(docs), self.batch_size):
+                await self._import(docs[start:start + self.batch_size])
+            if key not in self.report["invalid"]:
+                await self._delete([key, legacy_orders.pushed_key(sub)])
+
+    async def run(self) -> Dict[str, Any]:
+        if not self.dry_run:
+            await self.r.set(legacy_orders.RETIRED_KEY, json.dumps({"at": time.time()}))
+        await self.orders_by_id()
+        await self.order_lists()
+        self.report["retired"] = not self.dry_run
+        return self.report
+
+
+async def _run(batch_size: int, dry_run: bool) -> Dict[str, Any]:
+    r = aioredis.from_url(settings.redis_url)
+    try:
+        async with httpx.AsyncClient(base_url=settings.order_url, timeout=30.0) as order:
+            return await Migration(r, order, batch_size, dry_run).run()
+    finally:
+        await r.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dry-run", action="store_true", help="only count what would be moved")
+    parser.add_argument("--batch-size", type=int, default=200, help="orders per import request (max 500)")
+    args = parser.parse_args()
+    report = asyncio.run(_run(min(max(args.batch_size, 1), 500), args.dry_run))
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
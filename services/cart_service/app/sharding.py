@@ -0,0 +1,179 @@
+from __future__ import annotations
+
+import asyncio
+import bisect
+import hashlib
+import json
+import logging
+import time
+from typing import Any, Dict, Iterable, List, Optional
+from urllib.parse import urlsplit
+
+from redis import asyncio as aioredis
+from redis.exceptions import WatchError
+
+from .config import settings
+
+
+logger = logging.getLogger("cart.sharding")
+
+MOVE_ATTEMPTS = 5
+
+# Merge a cart copy into its new node: KEYS[1] cart key, ARGV[1] source PTTL (<= 0: none),
+# ARGV[2] fields read from the source now, ARGV[3] fields copied by an earlier attempt (JSON objects).
+# A field is written if the destination does not have it or still holds our earlier copy (a write
+# made on the new node after the switch wins); a field we copied earlier and the source has since
+# dropped is removed the same way.
+MERGE_LUA = """
+local fields = cjson.decode(ARGV[2])
+local copied = cjson.decode(ARGV[3])
+for field, value in pairs(fields) do
+  local current = redis.call('HGET', KEYS[1], field)
+  if not current or current == copied[field] then
+    redis.call('HSET', KEYS[1], field, value)
+  end
+end
+for field, value in pairs(copied) do
+  if fields[field] == nil and redis.call('HGET', KEYS[1], field) == value then
+    redis.call('HDEL', KEYS[1], field)
+  end
+end
+if tonumber(ARGV[1]) > 0 then
+  redis.call('PEXPIRE', KEYS[1], ARGV[1])
+end
+return 1
+"""
+
+
+def parse_nodes(raw: str) -> List[str]:
+    """Comma-separated Redis URLs -> list, order kept, duplicates dropped."""
+    return list(dict.fromkeys(u.strip() for u in (raw or "").split(",") if u.strip()))
+
+
+def node_name(url: str) -> str:
+    """host:port/db of a Redis URL (no credentials), used in /health and admin reports."""
+    parts = urlsplit(url)
+    return f"{parts.hostname}:{parts.port or 6379}{parts.path or '/0'}"
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """Consistent hashing with virtual nodes: adding a node moves only ~1/N of the keys."""
+
+    def __init__(self, nodes: Iterable[str], vnodes: int = 160) -> None:
+        self.nodes = list(nodes)
+        if not self.nodes:
+            raise ValueError("at least one Redis node is required")
+        points = sorted((_hash(f"{node}#{i}"), node) for node in self.nodes for i in range(vnodes))
+        self._hashes = [h for h, _ in points]
+        self._owners = [node for _, node in points]
+
+    def node_for(self, key: str) -> str:
+        i = bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._owners[i]
+
+
+class ShardedRedis:
+    """Routes cart:{sub} keys to one of several Redis nodes.
+
+    While a node list change is rolled out (REDIS_PREVIOUS_NODES set), a cart whose owner changed
+    is moved to its new node on first access; `rebalance` moves the rest.
+    """
+
+    def __init__(self, nodes: List[str], previous: Optional[List[str]] = None, vnodes: int = 160) -> None:
+        self.ring = HashRing(nodes, vnodes)
+        self.previous = HashRing(previous, vnodes) if previous and previous != nodes else None
+        self.clients: Dict[str, aioredis.Redis] = {}
+        for url in dict.fromkeys(nodes + (previous or [])):
+            self.clients[url] = aioredis.from_url(url, encoding="utf-8", decode_responses=True)
+        self.moved = 0
+
+    @property
+    def nodes(self) -> List[str]:
+        return self.ring.nodes
+
+    def client(self, key: str) -> aioredis.Redis:
+        return self.clients[self.ring.node_for(key)]
+
+    async def for_key(self, key: str) -> aioredis.Redis:
+        """Client owning `key`, after pulling the key over from its previous owner if needed."""
+        node = self.ring.node_for(key)
+        if self.previous is not None:
+            old = self.previous.node_for(key)
+            if old != node:
+                await self.move(key, self.clients[old], self.clients[node])
+        return self.clients[node]
+
+    async def move(self, key: str, src: aioredis.Redis, dst: aioredis.Redis) -> bool:
+        """Copy a cart hash to its new node and delete the old copy.
+
+        Fields already present on the destination win (they were written after the switch). The
+        source key is WATCHed and deleted only if it did not change since it was read: a write that
+        reached the old node meanwhile (e.g. from a replica still on the previous ring) makes the
+        move start over with the new contents instead of being lost.
+        """
+        merge = dst.register_script(MERGE_LUA)
+        copied: Dict[str, str] = {}
+        for _ in range(MOVE_ATTEMPTS):
+            async with src.pipeline(transaction=True) as pipe:
+                try:
+                    await pipe.watch(key)
+                    fields = await pipe.hgetall(key)
+                    pttl = await pipe.pttl(key)
+                    if not fields:
+                        # nothing to move, or another request moved it between our attempts
+                        return False
+                    await merge(keys=[key], args=[pttl or 0, json.dumps(fields), json.dumps(copied)])
+                    copied = fields
+                    pipe.multi()
+                    pipe.delete(key)
+                    await pipe.execute()
+                except WatchError:
+                    continue
+            self.moved += 1
+            return True
+        logger.warning("cart %s changed during %d move attempts; left on its previous node", key, MOVE_ATTEMPTS)
+        return False
+
+    async def health(self, timeout: float = 1.0) -> Dict[str, Dict[str, Any]]:
+        async def ping(url: str) -> Dict[str, Any]:
+            started = time.perf_counter()
+            try:
+                ok = bool(await asyncio.wait_for(self.clients[url].ping(), timeout))
+            except Exception as e:
+                return {"ok": False, "error": str(e) or type(e).__name__}
+            return {"ok": ok, "latency_ms": round((time.perf_counter() - started) * 1000, 2)}
+
+        results = await asyncio.gather(*(ping(url) for url in self.nodes))
+        return {node_name(url): result for url, result in zip(self.nodes, results)}
+
+    async def close(self) -> None:
+        for client in self.clients.values():
+            await client.close()
+
+
+def from_settings() -> ShardedRedis:
+    nodes = parse_nodes(settings.redis_nodes) or [settings.redis_url]
+    previous = parse_nodes(settings.redis_previous_nodes) or None
+    return ShardedRedis(nodes, previous, settings.redis_vnodes)
+
+
+async def rebalance(shards: ShardedRedis, pattern: str = "cart:*", dry_run: bool = False) -> Dict[str, Any]:
+    """Walk every known node with SCAN and move carts that the current ring assigns elsewhere."""
+    report: Dict[str, Any] = {"scanned": 0, "misplaced": 0, "moved": 0, "by_node": {}}
+    for url, client in shards.clients.items():
+        misplaced = 0
+        async for key in client.scan_iter(match=pattern, count=settings.cart_stats_scan_count):
+            report["scanned"] += 1
+            owner = shards.ring.node_for(key)
+            if owner == url:
+                continue
+            misplaced += 1
+            if not dry_run and await shards.move(key, client, shards.clients[owner]):
+                report["moved"] += 1
+        report["misplaced"] += misplaced
+        report["by_node"][node_name(url)] = misplaced
+    return report
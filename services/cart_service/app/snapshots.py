@@ -0,0 +1,114 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import time
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+import httpx
+
+from .config import settings
+
+
+logger = logging.getLogger("cart.snapshots")
+
+# product:{id} -> compact JSON copy of the catalog product, so cart reads need no catalog call
+SNAPSHOT_PREFIX = "product:"
+# catalog /products/batch accepts at most this many ids
+BATCH_LIMIT = 500
+
+# Cart lines and their product snapshots in one round trip:
+# returns a flat list pid1, qty1, snapshot1, pid2, ... (snapshot is nil when not stored).
+CART_ITEMS_LUA = """
+local cart = redis.call('HGETALL', KEYS[1])
+local out = {}
+for i = 1, #cart, 2 do
+  out[#out + 1] = cart[i]
+  out[#out + 1] = cart[i + 1]
+  out[#out + 1] = redis.call('GET', ARGV[1] .. cart[i]) or false
+end
+return out
+"""
+
+
+def snapshot_key(pid: str) -> str:
+    return f"{SNAPSHOT_PREFIX}{pid}"
+
+
+def compact(product: Dict[str, Any]) -> Dict[str, Any]:
+    images = product.get("images") or []
+    return {
+        "id": str(product.get("id")),
+        "sku": product.get("sku"),
+        "name": product.get("name"),
+        "price": product.get("price"),
+        "stock": product.get("stock"),
+        "is_active": product.get("is_active", True),
+        "images": images[:1],
+    }
+
+
+def is_stale(snap: Dict[str, Any], now: Optional[float] = None) -> bool:
+    return (now or time.time()) - float(snap.get("fetched_at", 0)) >= settings.product_snapshot_ttl
+
+
+async def refresh(r, catalog: httpx.AsyncClient, ids: Iterable[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+    """Fetch products from the catalog and store their snapshots.
+
+    Returns pid -> snapshot, or None for products the catalog no longer has (stored as tombstones,
+    so deleted products are not looked up again on every read).
+    """
+    ids = list(dict.fromkeys(str(i) for i in ids))
+    fetched: Dict[str, Optional[Dict[str, Any]]] = {}
+    now = time.time()
+    for start in range(0, len(ids), BATCH_LIMIT):
+        chunk = ids[start:start + BATCH_LIMIT]
+        resp = await catalog.post("/products/batch", json={"ids": chunk})
+        resp.raise_for_status()
+        data = resp.json()
+        for product in data.get("items", []):
+            fetched[str(product.get("id"))] = {**compact(product), "fetched_at": now}
+        for pid in data.get("missing", []):
+            fetched[str(pid)] = None
+    if fetched:
+        async with r.pipeline(transaction=False) as pipe:
+            for pid, snap in fetched.items():
+                value = snap if snap is not None else {"id": pid, "missing": True, "fetched_at": now}
+                pipe.set(snapshot_key(pid), json.dumps(value, separators=(",", ":")), ex=settings.product_snapshot_max_age)
+            await pipe.execute()
+    return fetched
+
+
+class BackgroundRefresher:
+    """Refreshes stale snapshots off the request path; each id is refreshed at most once at a time."""
+
+    def __init__(self) -> None:
+        self._inflight: Set[str] = set()
+        self._tasks: Set[asyncio.Task] = set()
+
+    def schedule(self, r, catalog: httpx.AsyncClient, ids: Iterable[str]) -> None:
+        todo = [pid for pid in ids if pid not in self._inflight]
+        if not todo:
+            return
+        self._inflight.update(todo)
+        task = asyncio.create_task(self._run(r, catalog, todo))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, r, catalog: httpx.AsyncClient, ids: List[str]) -> None:
+        try:
+            await refresh(r, catalog, ids)
+        except Exception as e:
+            # the stale copy stays until its max age; the next read tries again
+            logger.warning("product snapshot refresh failed: %s", e)
+        finally:
+            self._inflight.difference_update(ids)
+
+    async def stop(self) -> None:
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+refresher = BackgroundRefresher()
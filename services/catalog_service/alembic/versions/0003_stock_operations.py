@@ -0,0 +1,27 @@
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+revision = "0003_stock_operations"
+down_revision = "0002_product_meta"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "stock_operations",
+        sa.Column("token", sa.String(length=128), primary_key=True),
+        sa.Column("kind", sa.String(length=16), nullable=False),
+        sa.Column("result", postgresql.JSONB(astext_type=sa.Text()), nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.text("CURRENT_TIMESTAMP"), nullable=False),
+    )
+    op.create_index("ix_stock_operations_created_at", "stock_operations", ["created_at"], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index("ix_stock_operations_created_at", table_name="stock_operations")
+    op.drop_table("stock_operations")
@@ -0,0 +1,22 @@
+from __future__ import annotations
+
+from alembic import op
+
+
+revision = "0004_product_listing_indexes"
+down_revision = "0003_stock_operations"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # (sort column, id) indexes back the keyset pagination of GET /products/ in both directions
+    op.create_index("ix_products_created_at_id", "products", ["created_at", "id"])
+    op.create_index("ix_products_price_id", "products", ["price", "id"])
+    op.create_index("ix_products_name_id", "products", ["name", "id"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_products_name_id", table_name="products")
+    op.drop_index("ix_products_price_id", table_name="products")
+    op.drop_index("ix_products_created_at_id", table_name="products")
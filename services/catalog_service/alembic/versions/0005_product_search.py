@@ -0,0 +1,56 @@
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0005_product_search"
+down_revision = "0004_product_listing_indexes"
+branch_labels = None
+depends_on = None
+
+
+# must match app.search.DOCUMENT exactly for the planner to use the index
+DOCUMENT = (
+    "(setweight(to_tsvector('russian'::regconfig, coalesce(name, '')), 'A')"
+    " || setweight(to_tsvector('russian'::regconfig, coalesce(description, '')), 'B'))"
+)
+
+
+def upgrade() -> None:
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction; the table stays writable meanwhile
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_products_search",
+            "products",
+            [sa.text(DOCUMENT)],
+            postgresql_using="gin",
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+        op.create_index(
+            "ix_products_name_trgm",
+            "products",
+            ["name"],
+            postgresql_using="gin",
+            postgresql_ops={"name": "gin_trgm_ops"},
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+        op.create_index(
+            "ix_products_sku_trgm",
+            "products",
+            ["sku"],
+            postgresql_using="gin",
+            postgresql_ops={"sku": "gin_trgm_ops"},
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index("ix_products_sku_trgm", table_name="products", postgresql_concurrently=True, if_exists=True)
+        op.drop_index("ix_products_name_trgm", table_name="products", postgresql_concurrently=True, if_exists=True)
+        op.drop_index("ix_products_search", table_name="products", postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,37 @@
+from __future__ import annotations
+
+from alembic import op
+
+
+revision = "0006_product_attribute_indexes"
+down_revision = "0005_product_search"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        # attr.<key>=... / .in filters are JSONB containment (@>) checks
+        op.create_index(
+            "ix_products_attributes",
+            "products",
+            ["attributes"],
+            postgresql_using="gin",
+            postgresql_ops={"attributes": "jsonb_path_ops"},
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+        # narrows attribute range filters and facets to one template's products
+        op.create_index(
+            "ix_products_template_id",
+            "products",
+            ["template_id"],
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index("ix_products_template_id", table_name="products", postgresql_concurrently=True, if_exists=True)
+        op.drop_index("ix_products_attributes", table_name="products", postgresql_concurrently=True, if_exists=True)
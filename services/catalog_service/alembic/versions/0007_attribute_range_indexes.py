@@ -0,0 +1,74 @@
+from __future__ import annotations
+
+import hashlib
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0007_attribute_range_indexes"
+down_revision = "0006_product_attribute_indexes"
+branch_labels = None
+depends_on = None
+
+
+# must match app.attributes (NUMBER_FUNCTION, NUMERIC_TYPES, range_index_name/range_index_ddl):
+# attr.<key>.min/.max compare product_attribute_number(attributes, '<key>'), and every numeric key
+# declared in a template gets a partial expression index on it. Keys declared later are indexed
+# by the catalog when their template is saved.
+NUMERIC_TYPES = {"number", "integer", "float", "int"}
+NUMBER_PATTERN = r"^\s*[-+]?(\d+(\.\d*)?|\.\d+)([eE][-+]?\d{1,3})?\s*$"
+
+
+def _index_name(key: str) -> str:
+    return f"ix_products_attr_num_{hashlib.sha1(key.encode()).hexdigest()[:12]}"
+
+
+def _numeric_keys(conn) -> list[str]:
+    keys: dict[str, None] = {}
+    for (schema,) in conn.execute(sa.text("SELECT schema FROM product_templates")):
+        for key, spec in (schema or {}).items():
+            kind = spec.get("type") if isinstance(spec, dict) else spec
+            if str(kind or "string").lower() in NUMERIC_TYPES:
+                keys[str(key)] = None
+    return list(keys)
+
+
+def upgrade() -> None:
+    # a JSON number, or a string holding one (admins often save numbers as strings); NULL otherwise
+    op.execute(
+        f"""
+        CREATE OR REPLACE FUNCTION product_attribute_number(attrs jsonb, key text) RETURNS numeric
+        LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+            SELECT CASE
+                WHEN jsonb_typeof(attrs -> key) = 'number' THEN (attrs ->> key)::numeric
+                WHEN jsonb_typeof(attrs -> key) = 'string' AND (attrs ->> key) ~ '{NUMBER_PATTERN}'
+                    THEN (attrs ->> key)::numeric
+            END
+        $$
+        """
+    )
+    keys = _numeric_keys(op.get_bind())
+    with op.get_context().autocommit_block():
+        for key in keys:
+            quoted = "'" + key.replace("'", "''") + "'"
+            expr = f"product_attribute_number(attributes, {quoted})"
+            op.execute(
+                f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {_index_name(key)} ON products ({expr}) WHERE {expr} IS NOT NULL"
+            )
+
+
+def downgrade() -> None:
+    op.execute(
+        """
+        DO $$
+        DECLARE ix text;
+        BEGIN
+            FOR ix IN SELECT indexname FROM pg_indexes WHERE tablename = 'products' AND indexname LIKE 'ix\\_products\\_attr\\_num\\_%'
+            LOOP
+                EXECUTE format('DROP INDEX %I', ix);
+            END LOOP;
+        END $$
+        """
+    )
+    op.execute("DROP FUNCTION IF EXISTS product_attribute_number(jsonb, text)")
@@ -0,0 +1,188 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import uuid
+from decimal import Decimal, InvalidOperation
+from typing import Any, Dict, List, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import Numeric, Text, and_, cast, column, func, literal, or_, select, true
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models
+from .db import engine
+
+
+logger = logging.getLogger("catalog.attributes")
+
+
+# Query syntax for attribute filters (keys must be declared in a template schema):
+#   attr.<key>=<value>           equality
+#   attr.<key>.in=<v1>,<v2>      any of the listed values
+#   attr.<key>.min=<n>, .max=<n> numeric range (inclusive)
+PREFIX = "attr."
+NUMERIC_TYPES = {"number", "integer", "float", "int"}
+# product_attribute_number(attributes, key) (0007_attribute_range_indexes): the value as numeric if it
+# is a JSON number or a numeric string, else NULL. Every numeric key declared in a template gets a
+# partial btree expression index on it, which serves the .min/.max range filters.
+NUMBER_FUNCTION = "product_attribute_number"
+
+
+def _type_of(spec: Any) -> str:
+    # schema values are either a type name ("string") or an object with a "type" field
+    if isinstance(spec, dict):
+        spec = spec.get("type")
+    return str(spec or "string").lower()
+
+
+async def declared_keys(session: AsyncSession, template_id: Optional[uuid.UUID]) -> Dict[str, str]:
+    """Attribute key -> type, from one template or from all of them."""
+    stmt = select(models.ProductTemplate.schema)
+    if template_id is not None:
+        stmt = stmt.where(models.ProductTemplate.id == template_id)
+    keys: Dict[str, str] = {}
+    for schema in (await session.execute(stmt)).scalars().all():
+        for key, spec in (schema or {}).items():
+            keys.setdefault(str(key), _type_of(spec))
+    return keys
+
+
+def has_filters(params) -> bool:
+    return any(k.startswith(PREFIX) for k in params.keys())
+
+
+def _number(key: str, raw: str) -> Decimal:
+    try:
+        value = Decimal(raw.strip())
+    except InvalidOperation:
+        value = None
+    if value is None or not value.is_finite():
+        raise HTTPException(status_code=400, detail=f"attribute {key!r} expects a number")
+    return value
+
+
+def _scalar(kind: str, raw: str) -> List[Any]:
+    """JSON values that an attribute stored as `kind` may equal; admins often save numbers as strings."""
+    if kind in NUMERIC_TYPES:
+        try:
+            num = float(raw)
+        except ValueError:
+            return [raw]
+        return [int(num) if num.is_integer() else num, raw]
+    if kind == "boolean" and raw.lower() in ("true", "false"):
+        return [raw.lower() == "true", raw]
+    return [raw]
+
+
+def _jsonb(value: Any):
+    # bound as text and cast in SQL, so the statement can also be rendered with literal binds
+    return cast(literal(json.dumps(value), Text), JSONB)
+
+
+def _equals(key: str, kind: str, raw: str):
+    # containment (@>) is served by the GIN jsonb_path_ops index on attributes
+    return or_(*[models.Product.attributes.op("@>")(_jsonb({key: v})) for v in _scalar(kind, raw)])
+
+
+def number(key: str):
+    # the key is rendered inline: the planner matches the index expression only against a constant
+    return getattr(func, NUMBER_FUNCTION)(models.Product.attributes, literal(key, Text, literal_execute=True))
+
+
+def _range(key: str, low: Optional[Decimal], high: Optional[Decimal]):
+    # non-numeric values are NULL and simply do not match; bounds stay numeric so the index applies
+    value = number(key)
+    parts = []
+    if low is not None:
+        parts.append(value >= literal(low, Numeric))
+    if high is not None:
+        parts.append(value <= literal(high, Numeric))
+    return and_(*parts)
+
+
+def range_index_name(key: str) -> str:
+    # keys are free text: the name is derived from a hash (must match 0007_attribute_range_indexes)
+    return f"ix_products_attr_num_{hashlib.sha1(key.encode()).hexdigest()[:12]}"
+
+
+def range_index_ddl(key: str) -> str:
+    quoted = "'" + key.replace("'", "''") + "'"
+    expr = f"{NUMBER_FUNCTION}(attributes, {quoted})"
+    return (
+        f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {range_index_name(key)} "
+        f"ON products ({expr}) WHERE {expr} IS NOT NULL"
+    )
+
+
+def numeric_keys(schema: Optional[Dict[str, Any]]) -> List[str]:
+    return [str(key) for key, spec in (schema or {}).items() if _type_of(spec) in NUMERIC_TYPES]
+
+
+async def ensure_range_indexes(schema: Optional[Dict[str, Any]]) -> None:
+    """Index the numeric keys of a template schema (run after the template is saved, in the background)."""
+    keys = numeric_keys(schema)
+    if not keys:
+        return
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction; products stay writable meanwhile
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        for key in keys:
+            try:
+                await conn.exec_driver_sql(range_index_ddl(key))
+            except Exception as e:
+                logger.warning("could not index attribute %r: %s", key, e)
+
+
+def conditions(params, keys: Dict[str, str]) -> list:
+    """SQL conditions for every attr.* query parameter."""
+    ranges: Dict[str, Dict[str, Optional[Decimal]]] = {}
+    conds = []
+    for name, raw in params.items():
+        if not name.startswith(PREFIX):
+            continue
+        key, op = name[len(PREFIX):], "eq"
+        if key not in keys:
+            base, _, suffix = key.rpartition(".")
+            if suffix in ("in", "min", "max") and base in keys:
+                key, op = base, suffix
+            else:
+                raise HTTPException(status_code=400, detail=f"Unknown attribute {key!r}")
+        kind = keys[key]
+        if op == "eq":
+            conds.append(_equals(key, kind, raw))
+        elif op == "in":
+            values = [v.strip() for v in raw.split(",") if v.strip()]
+            if values:
+                conds.append(or_(*[_equals(key, kind, v) for v in values]))
+        else:
+            ranges.setdefault(key, {"min": None, "max": None})[op] = _number(key, raw)
+    for key, bounds in ranges.items():
+        conds.append(_range(key, bounds["min"], bounds["max"]))
+    return conds
+
+
+def facets_statement(conds: list, keys: List[str], per_key: int):
+    """Value counts per attribute key over the filtered products, top `per_key` values each."""
+    kv = func.jsonb_each(models.Product.attributes).table_valued(column("key", Text), column("value", JSONB)).lateral("kv")
+    counts = (
+        select(kv.c.key, kv.c.value, func.count().label("count"))
+        .select_from(models.Product)
+        .join(kv, true())
+        .where(
+            and_(*conds) if conds else true(),
+            kv.c.key.in_(keys),
+            func.jsonb_typeof(kv.c.value).in_(["string", "number", "boolean"]),
+        )
+        .group_by(kv.c.key, kv.c.value)
+        .subquery()
+    )
+    pos = func.row_number().over(partition_by=counts.c.key, order_by=[counts.c.count.desc(), counts.c.value]).label("pos")
+    ranked = select(counts.c.key, counts.c.value, counts.c.count, pos).subquery()
+    return (
+        select(ranked.c.key, ranked.c.value, ranked.c.count)
+        .where(ranked.c.pos <= per_key)
+        .order_by(ranked.c.key, ranked.c.pos)
+    )
@@ -0,0 +1,198 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from redis import asyncio as aioredis
+
+from .config import settings
+from .schemas import ProductOut
+
+
+logger = logging.getLogger("catalog.cache")
+
+
+class ProductCache:
+    """In-process LRU + TTL cache of single-product reads (GET /products/{id}, /products/sku/{sku}).
+
+    Entries are keyed by product id; SKU lookups go through a sku -> id index.
+    Writes invalidate locally and publish the ids on a Redis channel so that
+    every other replica drops them too. While the subscription is down (and
+    Redis is configured) the cache is bypassed, since misses are cheaper than
+    serving data another replica has already changed.
+    """
+
+    def __init__(self, ttl: float, max_entries: int, enabled: bool = True) -> None:
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self._entries: "OrderedDict[uuid.UUID, Tuple[float, ProductOut]]" = OrderedDict()
+        self._by_sku: Dict[str, uuid.UUID] = {}
+        # bumped on every invalidation: a read that started earlier must not store its result
+        self.generation = 0
+        self.instance_id = uuid.uuid4().hex
+        self.subscribed = False
+        self._redis: Optional[aioredis.Redis] = None
+        self._listener: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.remote_invalidations = 0
+
+    @property
+    def active(self) -> bool:
+        return self.enabled and (self.subscribed or not settings.redis_url)
+
+    # --- reads -----------------------------------------------------------
+
+    def get(self, product_id: uuid.UUID) -> Optional[ProductOut]:
+        if not self.active:
+            return None
+        item = self._entries.get(product_id)
+        if item is None or time.monotonic() - item[0] >= self.ttl:
+            if item is not None:
+                self._drop(product_id)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(product_id)
+        self.hits += 1
+        return item[1]
+
+    def get_by_sku(self, sku: str) -> Optional[ProductOut]:
+        pid = self._by_sku.get(sku) if self.active else None
+        if pid is None:
+            if self.active:
+                self.misses += 1
+            return None
+        product = self.get(pid)
+        return product if product is not None and product.sku == sku else None
+
+    def put(self, product: ProductOut, generation: int) -> None:
+        if not self.active or generation != self.generation:
+            return
+        self._drop(product.id)
+        self._entries[product.id] = (time.monotonic(), product)
+        self._by_sku[product.sku] = product.id
+        while len(self._entries) > self.max_entries:
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _drop(self, product_id: uuid.UUID) -> None:
+        item = self._entries.pop(product_id, None)
+        if item is not None and self._by_sku.get(item[1].sku) == product_id:
+            del self._by_sku[item[1].sku]
+
+    # --- invalidation ----------------------------------------------------
+
+    def invalidate_local(self, ids: Optional[Iterable[uuid.UUID]] = None) -> None:
+        """Drop the given products (all of them when ids is None)."""
+        self.generation += 1
+        self.invalidations += 1
+        if ids is None:
+            self._entries.clear()
+            self._by_sku.clear()
+            return
+        for pid in ids:
+            self._drop(pid)
+
+    async def invalidate(self, ids: Iterable[uuid.UUID]) -> None:
+        """Drop products here and on every other replica."""
+        ids = list(ids)
+        self.invalidate_local(ids)
+        if self._redis is None:
+            return
+        message = json.dumps({"origin": self.instance_id, "ids": [str(i) for i in ids]})
+        try:
+            await self._redis.publish(settings.product_cache_channel, message)
+        except Exception as e:
+            # other replicas may now serve stale data until their TTL expires
+            logger.warning("cache invalidation publish failed: %s", e)
+
+    def _on_message(self, raw: Any) -> None:
+        try:
+            data = json.loads(raw)
+            if data.get("origin") == self.instance_id:
+                return
+            ids = [uuid.UUID(i) for i in data.get("ids", [])]
+        except (ValueError, TypeError, AttributeError):
+            logger.warning("ignoring malformed invalidation message: %r", raw)
+            return
+        self.remote_invalidations += 1
+        self.invalidate_local(ids)
+
+    # --- lifecycle -------------------------------------------------------
+
+    async def start(self) -> None:
+        if not settings.redis_url or self._listener is not None:
+            return
+        self._redis = aioredis.from_url(settings.redis_url, decode_responses=True)
+        self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+        if self._redis is not None:
+            await self._redis.aclose()
+            self._redis = None
+        self.subscribed = False
+
+    async def _listen(self) -> None:
+        delay = 0.5
+        while True:
+            pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(settings.product_cache_channel)
+                # anything cached before (re)subscribing may have missed an invalidation
+                self.invalidate_local()
+                self.subscribed = True
+                delay = 0.5
+                async for message in pubsub.listen():
+                    if message.get("type") == "message":
+                        self._on_message(message.get("data"))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("cache invalidation subscriber disconnected: %s", e)
+            finally:
+                self.subscribed = False
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 10.0)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "active": self.active,
+            "subscribed": self.subscribed,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "remote_invalidations": self.remote_invalidations,
+        }
+
+
+product_cache = ProductCache(
+    ttl=settings.product_cache_ttl,
+    max_entries=settings.product_cache_max_entries,
+    enabled=settings.product_cache_enabled,
+)
@@ -10,6 +10,20 @@ class Settings(BaseSettings):
     database_url: str
     secret_key: str = "dev-secret-change-me"
 
+    # product listing pages (GET /products/?limit=...)
+    page_size_default: int = 50
+    page_size_max: int = 200
+
+    # single-product read cache; invalidations are broadcast over Redis pub/sub
+    redis_url: str | None = None
+    product_cache_enabled: bool = True
+    product_cache_ttl: float = 30.0
+    product_cache_max_entries: int = 10000
+    product_cache_channel: str = "catalog:product-invalidations"
+
+    # stock reserve/release tokens are replayable for this long, then purged (keep above any caller's retries)
+    stock_operations_retention_hours: int = 720
+
     class Config:
         env_file = ".env"
         env_file_encoding = "utf-8"
@@ -1,11 +1,14 @@
 from __future__ import annotations
 
+import asyncio
+
 from fastapi import FastAPI
 
+from .cache import product_cache
 from .config import settings
 from .db import health_check
 from .errors import add_exception_handlers, setup_logging
-from .routers import products, templates
+from .routers import products, stock, templates
 
 
 setup_logging()
@@ -13,11 +16,29 @@ app = FastAPI(title=settings.app_name)
 add_exception_handlers(app)
 
 
+@app.on_event("startup")
+async def on_startup():
+    await product_cache.start()
+    app.state.stock_purger = asyncio.create_task(stock.purge_loop())
+
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    app.state.stock_purger.cancel()
+    await product_cache.stop()
+
+
 @app.get("/health")
 async def health():
     db_ok = await health_check()
     return {"status": "ok", "db": db_ok}
 
 
+@app.get("/health/cache")
+async def health_cache():
+    return product_cache.stats()
+
+
 app.include_router(products.router)
 app.include_router(templates.router)
+app.include_router(stock.router)
@@ -91,3 +91,16 @@ class ProductTemplate(Base):
     )
 
     products: Mapped[list[Product]] = relationship(back_populates="template")
+
+
+class StockOperation(Base):
+    """Applied stock reserve/release batches, keyed by the caller's idempotency token."""
+
+    __tablename__ = "stock_operations"
+
+    token: Mapped[str] = mapped_column(String(128), primary_key=True)
+    kind: Mapped[str] = mapped_column(String(16), nullable=False)
+    result: Mapped[dict] = mapped_column(JSONB, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=text("CURRENT_TIMESTAMP"), nullable=False
+    )
@@ -0,0 +1,95 @@
+from __future__ import annotations
+
+import base64
+import json
+import uuid
+from datetime import datetime
+from decimal import Decimal
+from typing import Any, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import tuple_
+
+from . import models
+
+
+# sort name -> column; each has a matching (column, id) index (0004_product_listing_indexes)
+SORT_COLUMNS = {
+    "created_at": models.Product.created_at,
+    "price": models.Product.price,
+    "name": models.Product.name,
+}
+# "relevance" orders search results by rank (always best first)
+SORT_PATTERN = "^(-?(created_at|price|name)|relevance)$"
+
+
+def parse_sort(sort: str) -> Tuple[str, bool]:
+    """'-price' -> ('price', True)."""
+    if sort == "relevance":
+        return sort, True
+    desc = sort.startswith("-")
+    return sort.lstrip("-"), desc
+
+
+def sort_key(sort: str, rank=None):
+    key, _ = parse_sort(sort)
+    if key == "relevance":
+        if rank is None:
+            raise HTTPException(status_code=400, detail="sort=relevance requires q")
+        return rank
+    return SORT_COLUMNS[key]
+
+
+def _dump(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def _load(key: str, raw: Any) -> Any:
+    if key == "created_at":
+        return datetime.fromisoformat(raw)
+    if key == "price":
+        return Decimal(raw)
+    if key == "relevance":
+        return float(raw)
+    return str(raw)
+
+
+def encode_cursor(sort: str, value: Any, pid: uuid.UUID) -> str:
+    """Opaque position of the last row of a page: its sort value and id."""
+    raw = json.dumps([sort, _dump(value), str(pid)], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, sort: str) -> Tuple[Any, uuid.UUID]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        cursor_sort, value, pid = json.loads(raw)
+        if cursor_sort != sort:
+            raise ValueError("cursor was issued for another sort")
+        key, _ = parse_sort(sort)
+        return _load(key, value), uuid.UUID(pid)
+    except (ValueError, TypeError, ArithmeticError) as e:
+        raise HTTPException(status_code=400, detail="Invalid cursor") from e
+
+
+def order_by(sort: str, rank=None):
+    _, desc = parse_sort(sort)
+    col = sort_key(sort, rank)
+    # id breaks ties so the order is total and pages never overlap or skip rows
+    if desc:
+        return [col.desc(), models.Product.id.desc()]
+    return [col.asc(), models.Product.id.asc()]
+
+
+def after(sort: str, cursor: Optional[str], rank=None):
+    """Keyset condition: rows strictly after the cursor position, in sort order."""
+    if not cursor:
+        return None
+    value, pid = decode_cursor(cursor, sort)
+    _, desc = parse_sort(sort)
+    row = tuple_(sort_key(sort, rank), models.Product.id)
+    return row < tuple_(value, pid) if desc else row > tuple_(value, pid)
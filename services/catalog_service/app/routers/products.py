@@ -1,69 +1,221 @@
 from __future__ import annotations
 
+import json
 import uuid
-from typing import List, Optional
+from dataclasses import dataclass
+from typing import Dict, List, Literal, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, and_, or_
+from sqlalchemy import select, and_, or_, func, text
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm import selectinload
+from sqlalchemy.orm import selectinload, joinedload
 
+from ..cache import product_cache
+from ..config import settings
 from ..db import get_session
-from .. import models, schemas
+from .. import attributes, models, pagination, schemas, search
 from ..authz import get_current_admin
 
 
 router = APIRouter(prefix="/products", tags=["products"])
 
 
-@router.get("/", response_model=List[schemas.ProductOut])
-async def list_products(
+@dataclass
+class Listing:
+    q: Optional[str]
+    conds: list
+    # declared attribute keys -> type; loaded only when attr.* filters are used
+    keys: Optional[Dict[str, str]] = None
+
+
+async def listing_filters(
+    request: Request,
     q: Optional[str] = None,
     min_price: Optional[float] = None,
     max_price: Optional[float] = None,
     is_active: Optional[bool] = None,
+    template_id: Optional[uuid.UUID] = None,
     session: AsyncSession = Depends(get_session),
-):
-    stmt = select(models.Product)
+) -> Listing:
+    """Filters shared by the listing and its facets (see app/attributes.py for attr.* syntax)."""
+    q = (q or "").strip() or None
     conds = []
     if q:
-        like = f"%{q}%"
-        conds.append(or_(models.Product.name.ilike(like), models.Product.sku.ilike(like)))
+        conds.append(search.matches(q))
     if min_price is not None:
         conds.append(models.Product.price >= min_price)
     if max_price is not None:
         conds.append(models.Product.price <= max_price)
     if is_active is not None:
         conds.append(models.Product.is_active == is_active)
+    if template_id is not None:
+        conds.append(models.Product.template_id == template_id)
+    keys = None
+    if attributes.has_filters(request.query_params):
+        keys = await attributes.declared_keys(session, template_id)
+        conds += attributes.conditions(request.query_params, keys)
+    return Listing(q=q, conds=conds, keys=keys)
+
+
+@router.get("/", response_model=List[schemas.ProductOut])
+async def list_products(
+    response: Response,
+    listing: Listing = Depends(listing_filters),
+    sort: Optional[str] = Query(default=None, pattern=pagination.SORT_PATTERN),
+    limit: int = Query(default=settings.page_size_default, ge=1, le=settings.page_size_max),
+    cursor: Optional[str] = None,
+    total: Literal["none", "estimate", "exact"] = "none",
+    session: AsyncSession = Depends(get_session),
+):
+    """One page in `sort` order; the next page is requested with the `X-Next-Cursor` value.
+
+    With `q` the default order is by search relevance, otherwise newest first.
+    """
+    q, conds = listing.q, listing.conds
+    sort = sort or ("relevance" if q else "-created_at")
+    rank = search.rank(q) if q else None
+    stmt = select(models.Product)
     if conds:
         stmt = stmt.where(and_(*conds))
+    if total == "exact":
+        count = await session.scalar(select(func.count()).select_from(stmt.subquery()))
+        response.headers["X-Total-Count"] = str(count)
+    elif total == "estimate":
+        response.headers["X-Total-Count"] = str(await _estimate_rows(session, stmt))
+        response.headers["X-Total-Count-Estimated"] = "true"
+    keyset = pagination.after(sort, cursor, rank)
+    if keyset is not None:
+        stmt = stmt.where(keyset)
+    sort_value = pagination.sort_key(sort, rank)
+    # one extra row tells whether there is a next page without counting
+    stmt = stmt.add_columns(sort_value).order_by(*pagination.order_by(sort, rank)).limit(limit + 1)
     result = await session.execute(stmt.options(selectinload(models.Product.images)))
-    items = list(result.scalars().unique().all())
-    out = [
-        schemas.ProductOut(
-            id=p.id,
-            sku=p.sku,
-            name=p.name,
-            price=p.price,
-            stock=p.stock,
-            is_active=p.is_active,
-            description=getattr(p, "description", None),
-            attributes=getattr(p, "attributes", None),
-            template_id=getattr(p, "template_id", None),
-            images=[img.url for img in (p.images or [])],
-        )
-        for p in items
-    ]
+    rows = list(result.unique().all())
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last, value = rows[-1]
+        response.headers["X-Next-Cursor"] = pagination.encode_cursor(sort, value, last.id)
+    return [_product_out(p) for p, _ in rows]
+
+
+@router.get("/facets")
+async def product_facets(
+    listing: Listing = Depends(listing_filters),
+    template_id: Optional[uuid.UUID] = None,
+    keys: Optional[str] = Query(default=None, description="comma-separated attribute keys; all declared keys by default"),
+    per_key: int = Query(default=20, ge=1, le=100),
+    session: AsyncSession = Depends(get_session),
+):
+    """Value counts per attribute over the products matching the same filters as the listing."""
+    declared = listing.keys if listing.keys is not None else await attributes.declared_keys(session, template_id)
+    wanted = [k for k in (keys.split(",") if keys else declared) if k in declared]
+    out: Dict[str, list] = {k: [] for k in wanted}
+    if wanted:
+        res = await session.execute(attributes.facets_statement(listing.conds, wanted, per_key))
+        for key, value, count in res.all():
+            out[key].append({"value": value, "count": int(count)})
     return out
 
 
+async def _estimate_rows(session: AsyncSession, stmt) -> int:
+    """Planner row estimate for the filtered listing (no table scan)."""
+    if stmt.whereclause is None:
+        reltuples = await session.scalar(
+            text("SELECT reltuples::bigint FROM pg_class WHERE oid = 'products'::regclass")
+        )
+        return max(int(reltuples or 0), 0)
+    conn = await session.connection()
+    sql = str(stmt.compile(dialect=conn.dialect, compile_kwargs={"literal_binds": True}))
+    raw = (await conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {sql}")).scalar()
+    plan = json.loads(raw) if isinstance(raw, str) else raw
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+def _product_out(p: models.Product) -> schemas.ProductOut:
+    return schemas.ProductOut(
+        id=p.id,
+        sku=p.sku,
+        name=p.name,
+        price=p.price,
+        stock=p.stock,
+        is_active=p.is_active,
+        description=getattr(p, "description", None),
+        attributes=getattr(p, "attributes", None),
+        template_id=getattr(p, "template_id", None),
+        images=[img.url for img in (p.images or [])],
+    )
+
+
+@router.get("/summary")
+async def products_summary(
+    low_stock_threshold: int = 3,
+    limit: int = Query(default=10, ge=0, le=100),
+    session: AsyncSession = Depends(get_session),
+):
+    """Counts and low-stock list for dashboards, without loading the catalog."""
+    total, active = (
+        await session.execute(
+            select(func.count(models.Product.id), func.count(models.Product.id).filter(models.Product.is_active.is_(True)))
+        )
+    ).one()
+    res = await session.execute(
+        select(models.Product.id, models.Product.sku, models.Product.name, models.Product.stock)
+        .where(models.Product.stock <= low_stock_threshold)
+        .order_by(models.Product.stock.asc(), models.Product.name.asc())
+        .limit(limit)
+    )
+    return {
+        "total": int(total),
+        "active": int(active),
+        "low_stock": [{"id": str(pid), "sku": sku, "name": name, "stock": stock} for pid, sku, name, stock in res.all()],
+    }
+
+
+@router.post("/batch", response_model=schemas.ProductBatchOut)
+async def get_products_batch(payload: schemas.ProductBatchRequest, session: AsyncSession = Depends(get_session)):
+    """Multi-get by id and/or SKU list: products and images in a single query."""
+    ids: list[uuid.UUID] = []
+    missing: list[str] = []
+    for raw in dict.fromkeys(payload.ids):
+        try:
+            ids.append(uuid.UUID(str(raw)))
+        except ValueError:
+            missing.append(str(raw))
+    skus = list(dict.fromkeys(payload.skus))
+    conds = []
+    if ids:
+        conds.append(models.Product.id.in_(ids))
+    if skus:
+        conds.append(models.Product.sku.in_(skus))
+    items: list[models.Product] = []
+    if conds:
+        # joinedload keeps it to one round trip (LEFT JOIN product_images)
+        res = await session.execute(
+            select(models.Product).options(joinedload(models.Product.images)).where(or_(*conds))
+        )
+        items = list(res.unique().scalars().all())
+    found_ids = {p.id for p in items}
+    found_skus = {p.sku for p in items}
+    missing += [str(i) for i in ids if i not in found_ids]
+    missing += [s for s in skus if s not in found_skus]
+    return schemas.ProductBatchOut(
+        items=[_product_out(p) for p in items],
+        missing=missing,
+        inactive=[str(p.id) for p in items if not p.is_active],
+    )
+
+
 @router.get("/{product_id}", response_model=schemas.ProductOut)
 async def get_product(product_id: uuid.UUID, session: AsyncSession = Depends(get_session)):
+    cached = product_cache.get(product_id)
+    if cached is not None:
+        return cached
+    generation = product_cache.generation
     product = await session.get(models.Product, product_id, options=[selectinload(models.Product.images)])
     if not product:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
-    return schemas.ProductOut(
+    out = schemas.ProductOut(
         id=product.id,
         sku=product.sku,
         name=product.name,
@@ -75,15 +227,21 @@ async def get_product(product_id: uuid.UUID, session: AsyncSession = Depends(get
         template_id=getattr(product, "template_id", None),
         images=[pi.url for pi in product.images],
     )
+    product_cache.put(out, generation)
+    return out
 
 
 @router.get("/sku/{sku}", response_model=schemas.ProductOut)
 async def get_product_by_sku(sku: str, session: AsyncSession = Depends(get_session)):
+    cached = product_cache.get_by_sku(sku)
+    if cached is not None:
+        return cached
+    generation = product_cache.generation
     res = await session.execute(select(models.Product).options(selectinload(models.Product.images)).where(models.Product.sku == sku))
     p = res.scalar_one_or_none()
     if not p:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
-    return schemas.ProductOut(
+    out = schemas.ProductOut(
         id=p.id,
         sku=p.sku,
         name=p.name,
@@ -95,6 +253,8 @@ async def get_product_by_sku(sku: str, session: AsyncSession = Depends(get_sessi
         template_id=getattr(p, "template_id", None),
         images=[pi.url for pi in p.images],
     )
+    product_cache.put(out, generation)
+    return out
 
 
 @router.post("/", response_model=schemas.ProductOut, status_code=status.HTTP_201_CREATED, dependencies=[Depends(get_current_admin)])
@@ -113,6 +273,7 @@ async def create_product(payload: schemas.ProductCreate, session: AsyncSession =
     except IntegrityError:
         await session.rollback()
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="SKU must be unique")
+    await product_cache.invalidate([product.id])
     # load image URLs explicitly to avoid any lazy load in async context
     res = await session.execute(
         select(models.ProductImage.url).where(models.ProductImage.product_id == product.id)
@@ -164,6 +325,7 @@ async def update_product(
         await session.rollback()
         # Unify message with create handler for better UX
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="SKU must be unique")
+    await product_cache.invalidate([product_id])
     # load image URLs explicitly
     res = await session.execute(
         select(models.ProductImage.url).where(models.ProductImage.product_id == product.id)
@@ -190,4 +352,5 @@ async def delete_product(product_id: uuid.UUID, session: AsyncSession = Depends(
         return
     await session.delete(product)
     await session.commit()
+    await product_cache.invalidate([product_id])
     return
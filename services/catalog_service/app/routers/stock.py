@@ -0,0 +1,281 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional
+
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import JSONResponse
+from sqlalchemy import Integer, column, delete, func, select, update, values
+from sqlalchemy.dialects.postgresql import UUID, insert as pg_insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..cache import product_cache
+from ..config import settings
+from ..db import AsyncSessionLocal, get_session
+from .. import models, schemas
+from ..authz import get_current_admin
+
+
+logger = logging.getLogger("catalog.stock")
+router = APIRouter(prefix="/stock", tags=["stock"], dependencies=[Depends(get_current_admin)])
+
+
+def _merge_lines(items: list[schemas.StockLine]) -> Dict[uuid.UUID, int]:
+    lines: Dict[uuid.UUID, int] = {}
+    for it in items:
+        lines[it.product_id] = lines.get(it.product_id, 0) + it.qty
+    return lines
+
+
+async def _replay(session: AsyncSession, token: str, kind: str):
+    op = await session.get(models.StockOperation, token)
+    if op is None:
+        return None
+    if op.kind != kind:
+        raise HTTPException(status_code=409, detail=f"Token already used for {op.kind}")
+    return {**op.result, "replayed": True}
+
+
+async def _lock(session: AsyncSession, ids: list[uuid.UUID]):
+    # rows are locked in id order so concurrent multi-line baskets cannot deadlock
+    res = await session.execute(
+        select(models.Product.id, models.Product.stock, models.Product.is_active)
+        .where(models.Product.id.in_(ids))
+        .order_by(models.Product.id)
+        .with_for_update()
+    )
+    return {pid: (stock, active) for pid, stock, active in res.all()}
+
+
+def _delta_values(lines: Dict[uuid.UUID, int]):
+    return values(column("id", UUID(as_uuid=True)), column("qty", Integer), name="delta").data(
+        [(pid, qty) for pid, qty in sorted(lines.items())]
+    )
+
+
+async def _record(session: AsyncSession, token: str, kind: str, result: dict, changed: list[uuid.UUID]):
+    session.add(models.StockOperation(token=token, kind=kind, result=result))
+    try:
+        await session.commit()
+    except IntegrityError:
+        # the same token was applied concurrently; ours is rolled back, theirs is replayed
+        await session.rollback()
+        return await _replay(session, token, kind)
+    await product_cache.invalidate(changed)
+    return {**result, "replayed": False}
+
+
+@router.post("/reserve")
+async def reserve_stock(payload: schemas.StockBatchRequest, session: AsyncSession = Depends(get_session)):
+    """All-or-nothing decrement of a whole basket (stock >= qty for every line)."""
+    replay = await _replay(session, payload.token, "reserve")
+    if replay is not None:
+        return replay
+    lines = _merge_lines(payload.items)
+    current = await _lock(session, list(lines))
+    failures = []
+    for pid, qty in lines.items():
+        if pid not in current:
+            failures.append({"product_id": str(pid), "qty": qty, "reason": "not_found"})
+            continue
+        stock, active = current[pid]
+        if not active:
+            failures.append({"product_id": str(pid), "qty": qty, "reason": "inactive"})
+        elif stock < qty:
+            failures.append({"product_id": str(pid), "qty": qty, "reason": "insufficient_stock", "available": stock})
+    if failures:
+        await session.rollback()
+        return JSONResponse(status_code=409, content={"detail": "Reservation failed", "failures": failures})
+
+    delta = _delta_values(lines)
+    res = await session.execute(
+        update(models.Product)
+        .where(
+            models.Product.id == delta.c.id,
+            models.Product.is_active.is_(True),
+            models.Product.stock >= delta.c.qty,
+        )
+        .values(stock=models.Product.stock - delta.c.qty, updated_at=func.now())
+        .returning(models.Product.id, models.Product.stock)
+        .execution_options(synchronize_session=False)
+    )
+    updated = {pid: stock for pid, stock in res.all()}
+    if len(updated) != len(lines):
+        # cannot happen while the rows are locked; never leave a partial reservation
+        await session.rollback()
+        raise HTTPException(status_code=409, detail="Reservation failed")
+    result = {
+        "token": payload.token,
+        "kind": "reserve",
+        "items": [{"product_id": str(pid), "qty": qty, "stock": updated[pid]} for pid, qty in lines.items()],
+    }
+    return await _record(session, payload.token, "reserve", result, list(updated))
+
+
+async def _reserved_lines(session: AsyncSession, token: str) -> Optional[Dict[uuid.UUID, int]]:
+    """Lines taken by a reserve, or None if it was never applied.
+
+    An unknown token is claimed as a voided reserve, so a late request with it replays a no-op.
+    """
+    res = await session.execute(
+        pg_insert(models.StockOperation)
+        .values(token=token, kind="reserve", result={"token": token, "kind": "reserve", "items": [], "voided": True})
+        .on_conflict_do_nothing(index_elements=[models.StockOperation.token])
+        .returning(models.StockOperation.token)
+    )
+    if res.scalar_one_or_none() is not None:
+        return None
+    # applied before, or by a concurrent request whose commit the insert waited for
+    reserved = await session.get(models.StockOperation, token)
+    if reserved.kind != "reserve":
+        raise HTTPException(status_code=409, detail=f"Token already used for {reserved.kind}")
+    if reserved.result.get("voided"):
+        return None
+    lines: Dict[uuid.UUID, int] = {}
+    for it in reserved.result.get("items", []):
+        pid = uuid.UUID(it["product_id"])
+        lines[pid] = lines.get(pid, 0) + int(it["qty"])
+    return lines
+
+
+@router.post("/release")
+async def release_stock(payload: schemas.StockReleaseRequest, session: AsyncSession = Depends(get_session)):
+    """Give reserved stock back (e.g. on order cancel). Deleted products are reported as missing.
+
+    With `reserve_token`, the lines recorded by that reserve are given back, and nothing if it was
+    never applied: a caller that does not know whether its reserve went through can release safely.
+    """
+    replay = await _replay(session, payload.token, "release")
+    if replay is not None:
+        return replay
+    if payload.reserve_token:
+        lines = await _reserved_lines(session, payload.reserve_token)
+        if lines is None:
+            result = {"token": payload.token, "kind": "release", "items": [], "missing": [], "voided": True}
+            return await _record(session, payload.token, "release", result, [])
+    elif payload.items:
+        lines = _merge_lines(payload.items)
+    else:
+        raise HTTPException(status_code=422, detail="items or reserve_token is required")
+    current = await _lock(session, list(lines))
+    present = {pid: qty for pid, qty in lines.items() if pid in current}
+    updated: Dict[uuid.UUID, int] = {}
+    if present:
+        delta = _delta_values(present)
+        res = await session.execute(
+            update(models.Product)
+            .where(models.Product.id == delta.c.id)
+            .values(stock=models.Product.stock + delta.c.qty, updated_at=func.now())
+            .returning(models.Product.id, models.Product.stock)
+            .execution_options(synchronize_session=False)
+        )
+        updated = {pid: stock for pid, stock in res.all()}
+    result = {
+        "token": payload.token,
+        "kind": "release",
+        "items": [{"product_id": str(pid), "qty": qty, "stock": updated[pid]} for pid, qty in present.items()],
+        "missing": [str(pid) for pid in lines if pid not in current],
+    }
+    return await _record(session, payload.token, "release", result, list(updated))
+
+
+@router.post("/release/batch")
+async def release_stock_batch(payload: schemas.StockReleaseBatch, session: AsyncSession = Depends(get_session)):
+    """Several releases in one transaction and one UPDATE (used by the order-service outbox relay).
+
+    Every token is applied at most once, as with POST /stock/release: tokens applied before come back
+    with `replayed: true`, tokens already used for a reserve come back with an `error`.
+    Results are in request order.
+    """
+    ops: Dict[str, schemas.StockBatchRequest] = {}
+    for op in payload.operations:
+        ops.setdefault(op.token, op)
+    results: Dict[str, dict] = {}
+    res = await session.execute(select(models.StockOperation).where(models.StockOperation.token.in_(list(ops))))
+    for done in res.scalars():
+        if done.kind != "release":
+            results[done.token] = {"token": done.token, "error": f"Token already used for {done.kind}"}
+        else:
+            results[done.token] = {**done.result, "replayed": True}
+    new = [token for token in ops if token not in results]
+    changed: list[uuid.UUID] = []
+    if new:
+        # claim the tokens first: a concurrent request with the same token waits for our commit and skips it
+        res = await session.execute(
+            pg_insert(models.StockOperation)
+            .values([{"token": token, "kind": "release", "result": {}} for token in new])
+            .on_conflict_do_nothing(index_elements=[models.StockOperation.token])
+            .returning(models.StockOperation.token)
+        )
+        claimed = [token for token in new if token in set(res.scalars().all())]
+        per_op = {token: _merge_lines(ops[token].items) for token in claimed}
+        lines: Dict[uuid.UUID, int] = {}
+        for op_lines in per_op.values():
+            for pid, qty in op_lines.items():
+                lines[pid] = lines.get(pid, 0) + qty
+        current = await _lock(session, list(lines))
+        present = {pid: qty for pid, qty in lines.items() if pid in current}
+        updated: Dict[uuid.UUID, int] = {}
+        if present:
+            delta = _delta_values(present)
+            res = await session.execute(
+                update(models.Product)
+                .where(models.Product.id == delta.c.id)
+                .values(stock=models.Product.stock + delta.c.qty, updated_at=func.now())
+                .returning(models.Product.id, models.Product.stock)
+                .execution_options(synchronize_session=False)
+            )
+            updated = {pid: stock for pid, stock in res.all()}
+        for token, op_lines in per_op.items():
+            results[token] = {
+                "token": token,
+                "kind": "release",
+                "items": [
+                    {"product_id": str(pid), "qty": qty, "stock": updated[pid]}
+                    for pid, qty in op_lines.items()
+                    if pid in updated
+                ],
+                "missing": [str(pid) for pid in op_lines if pid not in current],
+            }
+        if claimed:
+            await session.execute(
+                update(models.StockOperation),
+                [{"token": token, "result": results[token]} for token in claimed],
+            )
+        await session.commit()
+        changed = list(updated)
+        for token in claimed:
+            results[token] = {**results[token], "replayed": False}
+        # claimed by a concurrent request meanwhile: it is applied once, report its result
+        lost = [token for token in new if token not in results]
+        if lost:
+            res = await session.execute(select(models.StockOperation).where(models.StockOperation.token.in_(lost)))
+            for done in res.scalars():
+                results[done.token] = {**done.result, "replayed": True}
+    if changed:
+        await product_cache.invalidate(changed)
+    return {"results": [results[token] for token in ops]}
+
+
+async def purge_operations() -> int:
+    """Drop recorded operations past the retention window; their tokens are no longer replayed."""
+    cutoff = datetime.now(timezone.utc) - timedelta(hours=settings.stock_operations_retention_hours)
+    async with AsyncSessionLocal() as session:
+        res = await session.execute(delete(models.StockOperation).where(models.StockOperation.created_at < cutoff))
+        await session.commit()
+        return res.rowcount or 0
+
+
+async def purge_loop(interval: float = 3600.0) -> None:
+    while True:
+        try:
+            removed = await purge_operations()
+            if removed:
+                logger.info("purged %s stock operations", removed)
+        except Exception as e:
+            logger.warning("stock operation purge failed: %s", e)
+        await asyncio.sleep(interval)
@@ -3,12 +3,12 @@ from __future__ import annotations
 import uuid
 from typing import List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, status
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 
 from ..db import get_session
-from .. import models
+from .. import attributes, models
 from ..authz import get_current_admin
 
 
@@ -26,7 +26,7 @@ async def list_templates(session: AsyncSession = Depends(get_session)):
 
 
 @router.post("/", response_model=dict, status_code=status.HTTP_201_CREATED, dependencies=[Depends(get_current_admin)])
-async def create_template(payload: dict, session: AsyncSession = Depends(get_session)):
+async def create_template(payload: dict, background: BackgroundTasks, session: AsyncSession = Depends(get_session)):
     name = str(payload.get("name") or "").strip()
     schema = payload.get("schema") or {}
     if not name:
@@ -35,6 +35,8 @@ async def create_template(payload: dict, session: AsyncSession = Depends(get_ses
     session.add(tpl)
     await session.commit()
     await session.refresh(tpl)
+    # range filters on the numeric keys need their expression indexes
+    background.add_task(attributes.ensure_range_indexes, tpl.schema)
     return {"id": tpl.id, "name": tpl.name, "schema": tpl.schema}
 
 
@@ -47,7 +49,9 @@ async def get_template(tid: uuid.UUID, session: AsyncSession = Depends(get_sessi
 
 
 @router.patch("/{tid}", response_model=dict, dependencies=[Depends(get_current_admin)])
-async def update_template(tid: uuid.UUID, payload: dict, session: AsyncSession = Depends(get_session)):
+async def update_template(
+    tid: uuid.UUID, payload: dict, background: BackgroundTasks, session: AsyncSession = Depends(get_session)
+):
     t = await session.get(models.ProductTemplate, tid)
     if not t:
         raise HTTPException(status_code=404, detail="Template not found")
@@ -61,6 +65,8 @@ async def update_template(tid: uuid.UUID, payload: dict, session: AsyncSession =
     session.add(t)
     await session.commit()
     await session.refresh(t)
+    if "schema" in payload:
+        background.add_task(attributes.ensure_range_indexes, t.schema)
     return {"id": t.id, "name": t.name, "schema": t.schema}
 
 
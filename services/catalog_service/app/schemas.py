@@ -40,3 +40,40 @@ class ProductOut(ProductBase):
 
     class Config:
         from_attributes = True
+
+
+class ProductBatchRequest(BaseModel):
+    ids: list[str] = Field(default_factory=list, max_length=500)
+    skus: list[str] = Field(default_factory=list, max_length=500)
+
+
+class ProductBatchOut(BaseModel):
+    items: list[ProductOut] = []
+    # requested ids/skus that do not exist (or are not valid UUIDs)
+    missing: list[str] = []
+    # ids of returned items with is_active = false
+    inactive: list[str] = []
+
+
+class StockLine(BaseModel):
+    product_id: uuid.UUID
+    qty: int = Field(gt=0)
+
+
+class StockBatchRequest(BaseModel):
+    # idempotency token: a retry with the same token returns the first result
+    token: str = Field(min_length=1, max_length=128)
+    items: list[StockLine] = Field(min_length=1, max_length=500)
+
+
+class StockReleaseRequest(StockBatchRequest):
+    # the reserve this release undoes: its recorded lines are given back (items may then be empty);
+    # if it was never applied, nothing changes and the token is voided, so a reserve request still in
+    # flight cannot apply it later
+    reserve_token: Optional[str] = Field(default=None, min_length=1, max_length=128)
+    items: list[StockLine] = Field(default_factory=list, max_length=500)
+
+
+class StockReleaseBatch(BaseModel):
+    # several releases, each applied at most once per token (see POST /stock/release/batch)
+    operations: list[StockBatchRequest] = Field(min_length=1, max_length=200)
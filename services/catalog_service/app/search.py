@@ -0,0 +1,43 @@
+from __future__ import annotations
+
+from sqlalchemy import Float, cast, func, literal, literal_column, or_
+from sqlalchemy.dialects.postgresql import TSVECTOR
+
+from . import models
+
+
+# The document expression must stay identical to the index definition in
+# alembic/versions/0005_product_search.py, otherwise Postgres will not use the indexes.
+SEARCH_CONFIG = literal_column("'russian'::regconfig")
+DOCUMENT = literal_column(
+    "(setweight(to_tsvector('russian'::regconfig, coalesce(products.name, '')), 'A')"
+    " || setweight(to_tsvector('russian'::regconfig, coalesce(products.description, '')), 'B'))",
+    type_=TSVECTOR,
+)
+
+
+def tsquery(q: str):
+    # websearch syntax: quoted phrases, "or", -exclusion; never raises on user input
+    return func.websearch_to_tsquery(SEARCH_CONFIG, q)
+
+
+def matches(q: str):
+    """Full-text match on name/description, substring or fuzzy (pg_trgm) match on name/SKU."""
+    like = f"%{q}%"
+    return or_(
+        DOCUMENT.op("@@")(tsquery(q)),
+        models.Product.name.ilike(like),
+        models.Product.sku.ilike(like),
+        # word similarity: a typo-tolerant match of q against any part of the name/SKU
+        models.Product.name.op("%>")(q),
+        models.Product.sku.op("%>")(q),
+    )
+
+
+def rank(q: str):
+    """Text rank plus the best trigram similarity, so exact SKU hits and typos both surface."""
+    similarity = func.greatest(
+        func.word_similarity(literal(q), models.Product.name),
+        func.similarity(literal(q), models.Product.sku),
+    )
+    return cast(func.ts_rank_cd(DOCUMENT, tsquery(q)) + similarity, Float)
@@ -0,0 +1,208 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Optional
+from urllib.parse import urlencode
+
+import httpx
+
+from .config import settings
+
+
+@dataclass
+class CachedResponse:
+    status_code: int
+    content: bytes
+    media_type: str = "application/json"
+    headers: Dict[str, str] = field(default_factory=dict)
+    stored_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def size(self) -> int:
+        return len(self.content)
+
+    def json(self) -> Any:
+        return json.loads(self.content)
+
+
+def cache_key(path: str, params: Optional[Dict[str, Any]] = None) -> str:
+    """Canonical key: path + query params sorted by name, so param order does not matter."""
+    items = sorted((str(k), str(v)) for k, v in (params or {}).items())
+    return f"{path}?{urlencode(items)}" if items else path
+
+
+class ResponseCache:
+    """In-process TTL cache for public upstream GETs.
+
+    - fresh for `ttl` seconds, then served stale for up to `stale_ttl` more while a
+      background task revalidates it;
+    - concurrent misses for one key share a single upstream call;
+    - bounded by total body bytes (LRU eviction);
+    - only 200 responses are stored.
+    """
+
+    def __init__(self, ttl: float, stale_ttl: float, max_bytes: int, enabled: bool = True) -> None:
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self._entries: "OrderedDict[str, CachedResponse]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._bytes = 0
+        # bumped on invalidation so that fetches started before it are not stored
+        self._generation = 0
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    async def fetch(self, key: str, loader: Callable[[], Awaitable[httpx.Response]]) -> CachedResponse:
+        if not self.enabled:
+            return _to_cached(await loader())
+        entry = self._entries.get(key)
+        if entry is not None:
+            age = time.monotonic() - entry.stored_at
+            if age < self.ttl:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return entry
+            if age < self.ttl + self.stale_ttl:
+                self.stale_hits += 1
+                self._entries.move_to_end(key)
+                if key not in self._inflight:
+                    self._start_load(key, loader)
+                return entry
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = self._start_load(key, loader)
+        # shielded: a client disconnect must not cancel the load other waiters share
+        return await asyncio.shield(task)
+
+    def _start_load(self, key: str, loader: Callable[[], Awaitable[httpx.Response]]) -> asyncio.Task:
+        task = asyncio.create_task(self._load(key, loader, self._generation))
+        self._inflight[key] = task
+
+        def _done(t: asyncio.Task) -> None:
+            if self._inflight.get(key) is t:
+                del self._inflight[key]
+            # a failed load nobody awaited (e.g. background revalidation) stays quiet;
+            # the stale copy keeps being served until it expires
+            if not t.cancelled():
+                t.exception()
+
+        task.add_done_callback(_done)
+        return task
+
+    async def _load(self, key: str, loader: Callable[[], Awaitable[httpx.Response]], generation: int) -> CachedResponse:
+        resp = _to_cached(await loader())
+        if resp.status_code == 200 and generation == self._generation:
+            self._store(key, resp)
+        return resp
+
+    def _store(self, key: str, resp: CachedResponse) -> None:
+        if resp.size + len(key) > self.max_bytes // 4:
+            return
+        self._drop(key)
+        self._entries[key] = resp
+        self._bytes += resp.size + len(key)
+        while self._bytes > self.max_bytes and self._entries:
+            old_key = next(iter(self._entries))
+            self._drop(old_key)
+            self.evictions += 1
+
+    def _drop(self, key: str) -> None:
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= old.size + len(key)
+
+    def invalidate(self, prefix: str = "") -> None:
+        self._generation += 1
+        self.invalidations += 1
+        for key in [k for k in self._entries if k.startswith(prefix)]:
+            self._drop(key)
+        # loads started before the write must not be joined by new requests either
+        for key in [k for k in self._inflight if k.startswith(prefix)]:
+            del self._inflight[key]
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.stale_hits + self.misses + self.coalesced
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "hit_ratio": round((self.hits + self.stale_hits + self.coalesced) / lookups, 4) if lookups else 0.0,
+        }
+
+
+# upstream headers that are part of the cached representation (listing pagination)
+KEPT_HEADERS = ("x-next-cursor", "x-total-count", "x-total-count-estimated")
+
+
+class PriceCache:
+    """product id -> price, fed by every batch product read; used for cart badge totals."""
+
+    def __init__(self, ttl: float, max_entries: int) -> None:
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # None marks a product the catalog reported missing, so it is not re-fetched every time
+        self._prices: "OrderedDict[str, tuple[float, Optional[float]]]" = OrderedDict()
+
+    def get_many(self, ids) -> "tuple[Dict[str, Optional[float]], list[str]]":
+        known: Dict[str, Optional[float]] = {}
+        missing: list[str] = []
+        now = time.monotonic()
+        for pid in ids:
+            item = self._prices.get(pid)
+            if item is not None and now - item[0] < self.ttl:
+                known[pid] = item[1]
+            else:
+                missing.append(pid)
+        return known, missing
+
+    def update(self, products, missing=()) -> None:
+        now = time.monotonic()
+        entries = [(str(pid), None) for pid in missing]
+        for p in products:
+            try:
+                entries.append((str(p["id"]), float(p.get("price", 0))))
+            except (KeyError, TypeError, ValueError):
+                continue
+        for pid, price in entries:
+            self._prices.pop(pid, None)
+            self._prices[pid] = (now, price)
+        while len(self._prices) > self.max_entries:
+            self._prices.popitem(last=False)
+
+    def invalidate(self) -> None:
+        self._prices.clear()
+
+
+def _to_cached(r: httpx.Response) -> CachedResponse:
+    media_type = r.headers.get("content-type", "application/json")
+    headers = {k: r.headers[k] for k in KEPT_HEADERS if k in r.headers}
+    return CachedResponse(status_code=r.status_code, content=r.content, media_type=media_type, headers=headers)
+
+
+catalog_cache = ResponseCache(
+    ttl=settings.cache_ttl,
+    stale_ttl=settings.cache_stale_ttl,
+    max_bytes=settings.cache_max_bytes,
+    enabled=settings.cache_enabled,
+)
+price_cache = PriceCache(ttl=settings.price_cache_ttl, max_entries=settings.price_cache_max_entries)
@@ -1,3 +1,5 @@
+from typing import Dict
+
 from pydantic_settings import BaseSettings
 
 
@@ -12,6 +14,31 @@ class Settings(BaseSettings):
     order_url: str = "http://order:8000"
     secret_key: str = "dev-secret-change-me"  # for optional JWT decode
 
+    # Upstream HTTP pools (one long-lived client per backend, see app/upstream.py)
+    http_max_connections: int = 100
+    http_max_keepalive_connections: int = 20
+    http_keepalive_expiry: float = 30.0
+    http2: bool = False
+    http_timeout: float = 5.0
+    # per-upstream overrides, e.g. {"order": {"timeout": 10, "max_connections": 50}}
+    upstream_overrides: Dict[str, Dict[str, float]] = {"order": {"timeout": 10.0}}
+    # per-route timeouts for slow calls
+    checkout_timeout: float = 15.0
+    # longest long poll of a queued checkout (GET /api/order/checkout/jobs/{id}?wait=)
+    checkout_long_poll_max: float = 25.0
+    admin_stats_timeout: float = 15.0
+
+    # Response cache for public catalog reads (see app/cache.py)
+    cache_enabled: bool = True
+    cache_ttl: float = 10.0
+    cache_stale_ttl: float = 30.0
+    cache_max_bytes: int = 32 * 1024 * 1024
+    # product prices kept for cart totals in /api/cart/summary
+    price_cache_ttl: float = 60.0
+    price_cache_max_entries: int = 10000
+    # products per storefront page (catalog keyset pagination)
+    catalog_page_size: int = 24
+
     class Config:
         env_file = ".env"
         env_file_encoding = "utf-8"
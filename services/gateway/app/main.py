@@ -1,7 +1,10 @@
 from __future__ import annotations
 
+import asyncio
 import json
+from contextlib import asynccontextmanager
 from typing import Optional, Dict, Any
+from urllib.parse import urlencode
 
 import httpx
 from fastapi import FastAPI, Request, Response, Depends
@@ -13,9 +16,22 @@ from datetime import datetime, timedelta, timezone
 import uuid
 
 from .config import settings
+from .upstream import upstreams
+from .cache import catalog_cache, cache_key, price_cache
+from .proxy import proxy
 
 
-app = FastAPI(title=settings.app_name)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # one pooled client per backend for the lifetime of the app
+    upstreams.start()
+    try:
+        yield
+    finally:
+        await upstreams.close()
+
+
+app = FastAPI(title=settings.app_name, lifespan=lifespan)
 app.mount("/static", StaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
 
@@ -70,39 +86,61 @@ async def health():
     return {"status": "ok"}
 
 
+@app.get("/health/pools")
+async def health_pools():
+    # upstream connection pool usage, for sizing HTTP_MAX_* per gateway replica
+    return upstreams.stats()
+
+
+@app.get("/health/cache")
+async def health_cache():
+    return catalog_cache.stats()
+
+
 @app.get("/", response_class=HTMLResponse)
 async def home(request: Request):
     products = []
+    next_url = None
     try:
-        async with httpx.AsyncClient(timeout=5.0) as client:
-            # forward search/filter query params to catalog-service
-            query_params = dict(request.query_params)
-            user = get_user_payload(get_token_from_cookie(request))
-            if "is_active" not in query_params and not (user and user.get("role") == "admin"):
-                query_params["is_active"] = "true"
-            url = f"{settings.catalog_url}/products/"
-            if query_params:
-                from urllib.parse import urlencode
-                url = f"{url}?{urlencode(query_params)}"
-            r = await client.get(url)
-            if r.status_code == 200:
-                products = r.json()
+        # forward search/filter query params to catalog-service; only the requested page is loaded
+        query_params = dict(request.query_params)
+        user = get_user_payload(get_token_from_cookie(request))
+        if "is_active" not in query_params and not (user and user.get("role") == "admin"):
+            query_params["is_active"] = "true"
+        query_params.setdefault("limit", str(settings.catalog_page_size))
+        r = await catalog_cache.fetch(
+            cache_key("/products/", query_params),
+            lambda: upstreams.catalog.get("/products/", params=query_params),
+        )
+        if r.status_code == 200:
+            products = r.json()
+            if r.headers.get("x-next-cursor"):
+                next_url = "/?" + urlencode({**request.query_params, "cursor": r.headers["x-next-cursor"]})
     except httpx.RequestError:
         # каталог ещё не готов или недоступен — показываем пустой список
         products = []
+    first_url = None
+    if "cursor" in request.query_params:
+        filters = {k: v for k, v in request.query_params.items() if k != "cursor"}
+        first_url = "/?" + urlencode(filters) if filters else "/"
     user = get_user_payload(get_token_from_cookie(request))
-    return templates.TemplateResponse("index.html", {"request": request, "products": products, "user": user})
+    return templates.TemplateResponse(
+        "index.html",
+        {"request": request, "products": products, "user": user, "next_url": next_url, "first_url": first_url},
+    )
 
 
 @app.get("/product/{pid}", response_class=HTMLResponse)
 async def product_page(pid: str, request: Request):
     user = get_user_payload(get_token_from_cookie(request))
     try:
-        async with httpx.AsyncClient(timeout=5.0) as client:
-            r = await client.get(f"{settings.catalog_url}/products/{pid}")
-            if r.status_code != 200:
-                return templates.TemplateResponse("product.html", {"request": request, "user": user, "product": None})
-            product = r.json()
+        r = await catalog_cache.fetch(
+            cache_key(f"/products/{pid}"),
+            lambda: upstreams.catalog.get(f"/products/{pid}"),
+        )
+        if r.status_code != 200:
+            return templates.TemplateResponse("product.html", {"request": request, "user": user, "product": None})
+        product = r.json()
     except httpx.RequestError:
         product = None
     return templates.TemplateResponse("product.html", {"request": request, "user": user, "product": product})
@@ -124,8 +162,7 @@ async def register_page(request: Request):
 async def login(request: Request, response: Response):
     form = await request.form()
     data = {"username": form.get("username"), "password": form.get("password")}  # OAuth2 form
-    async with httpx.AsyncClient() as client:
-        r = await client.post(f"{settings.auth_url}/auth/login", data=data, headers={"Content-Type": "application/x-www-form-urlencoded"})
+    r = await upstreams.auth.post("/auth/login", data=data, headers={"Content-Type": "application/x-www-form-urlencoded"})
     if r.status_code != 200:
         return JSONResponse(status_code=401, content={"detail": "Invalid credentials"})
     token = r.json().get("access_token")
@@ -144,8 +181,7 @@ async def logout(response: Response):
 @app.post("/auth/register")
 async def register(request: Request):
     payload = await request.json()
-    async with httpx.AsyncClient() as client:
-        r = await client.post(f"{settings.auth_url}/auth/register", json=payload)
+    r = await upstreams.auth.post("/auth/register", json=payload)
     if r.status_code != 200:
         try:
             return JSONResponse(status_code=r.status_code, content=r.json())
@@ -153,12 +189,11 @@ async def register(request: Request):
             return JSONResponse(status_code=r.status_code, content={"detail": r.text})
     # auto-login
     login_form = {"username": payload.get("email"), "password": payload.get("password")}
-    async with httpx.AsyncClient() as client:
-        lr = await client.post(
-            f"{settings.auth_url}/auth/login",
-            data=login_form,
-            headers={"Content-Type": "application/x-www-form-urlencoded"},
-        )
+    lr = await upstreams.auth.post(
+        "/auth/login",
+        data=login_form,
+        headers={"Content-Type": "application/x-www-form-urlencoded"},
+    )
     if lr.status_code == 200:
         token = lr.json().get("access_token")
         resp = JSONResponse({"ok": True})
@@ -203,17 +238,34 @@ async def admin_templates_page(request: Request, token: Optional[str] = Depends(
 @app.get("/api/products")
 async def api_list_products(request: Request):
     try:
-        async with httpx.AsyncClient(timeout=5.0) as client:
-            incoming = dict(request.query_params)
-            token = get_token_from_cookie(request)
-            if "is_active" not in incoming and not is_admin(token):
-                incoming["is_active"] = "true"
-            url = f"{settings.catalog_url}/products/"
-            if incoming:
-                from urllib.parse import urlencode
-                url = f"{url}?{urlencode(incoming)}"
-            r = await client.get(url)
-            return JSONResponse(r.json(), status_code=r.status_code)
+        incoming = dict(request.query_params)
+        token = get_token_from_cookie(request)
+        if "is_active" not in incoming and not is_admin(token):
+            incoming["is_active"] = "true"
+        r = await catalog_cache.fetch(
+            cache_key("/products/", incoming),
+            lambda: upstreams.catalog.get("/products/", params=incoming),
+        )
+        headers = dict(r.headers)
+        if "x-next-cursor" in headers:
+            next_url = request.url.include_query_params(cursor=headers["x-next-cursor"])
+            headers["link"] = f'<{next_url}>; rel="next"'
+        return Response(content=r.content, status_code=r.status_code, media_type=r.media_type, headers=headers)
+    except httpx.RequestError:
+        return JSONResponse(status_code=503, content={"detail": "catalog unavailable"})
+
+
+@app.get("/api/products/facets")
+async def api_product_facets(request: Request):
+    try:
+        incoming = dict(request.query_params)
+        if "is_active" not in incoming and not is_admin(get_token_from_cookie(request)):
+            incoming["is_active"] = "true"
+        r = await catalog_cache.fetch(
+            cache_key("/products/facets", incoming),
+            lambda: upstreams.catalog.get("/products/facets", params=incoming),
+        )
+        return Response(content=r.content, status_code=r.status_code, media_type=r.media_type)
     except httpx.RequestError:
         return JSONResponse(status_code=503, content={"detail": "catalog unavailable"})
 
@@ -221,9 +273,11 @@ async def api_list_products(request: Request):
 @app.get("/api/products/{pid}")
 async def api_get_product(pid: str):
     try:
-        async with httpx.AsyncClient(timeout=5.0) as client:
-            r = await client.get(f"{settings.catalog_url}/products/{pid}")
-            return JSONResponse(r.json(), status_code=r.status_code)
+        r = await catalog_cache.fetch(
+            cache_key(f"/products/{pid}"),
+            lambda: upstreams.catalog.get(f"/products/{pid}"),
+        )
+        return Response(content=r.content, status_code=r.status_code, media_type=r.media_type)
     except httpx.RequestError:
         return JSONResponse(status_code=503, content={"detail": "catalog unavailable"})
 
@@ -231,9 +285,11 @@ async def api_get_product(pid: str):
 @app.get("/api/products/sku/{sku}")
 async def api_get_product_by_sku(sku: str):
     try:
-        async with httpx.AsyncClient(timeout=5.0) as client:
-            r = await client.get(f"{settings.catalog_url}/products/sku/{sku}")
-            return JSONResponse(r.json(), status_code=r.status_code)
+        r = await catalog_cache.fetch(
+            cache_key(f"/products/sku/{sku}"),
+            lambda: upstreams.catalog.get(f"/products/sku/{sku}"),
+        )
+        return Response(content=r.content, status_code=r.status_code, media_type=r.media_type)
     except httpx.RequestError:
         return JSONResponse(status_code=503, content={"detail": "catalog unavailable"})
 
@@ -241,86 +297,88 @@ async def api_get_product_by_sku(sku: str):
 # Templates proxy (admin protected for write operations)
 @app.get("/api/templates")
 async def api_list_templates():
-    try:
-        async with httpx.AsyncClient(timeout=5.0) as client:
-            r = await client.get(f"{settings.catalog_url}/templates/")
-            return JSONResponse(r.json(), status_code=r.status_code)
-    except httpx.RequestError:
-        return JSONResponse(status_code=503, content={"detail": "catalog unavailable"})
+    return await proxy(upstreams.catalog, "GET", "/templates/", unavailable="catalog unavailable")
 
 
 @app.post("/api/templates")
 async def api_create_template(request: Request, token: Optional[str] = Depends(get_token_from_cookie)):
     if not is_admin(token):
         return JSONResponse(status_code=403, content={"detail": "Admin required"})
-    payload = await request.json()
-    async with httpx.AsyncClient(timeout=5.0) as client:
-        r = await client.post(
-            f"{settings.catalog_url}/templates/",
-            json=payload,
-            headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json"},
-        )
-        try:
-            return JSONResponse(status_code=r.status_code, content=r.json())
-        except Exception:
-            return JSONResponse(status_code=r.status_code, content={"detail": r.text})
+    return await proxy(
+        upstreams.catalog,
+        "POST",
+        "/templates/",
+        content=await request.body(),
+        headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json"},
+        unavailable="catalog unavailable",
+    )
 
 
 @app.patch("/api/templates/{tid}")
 async def api_update_template(tid: str, request: Request, token: Optional[str] = Depends(get_token_from_cookie)):
     if not is_admin(token):
         return JSONResponse(status_code=403, content={"detail": "Admin required"})
-    payload = await request.json()
-    async with httpx.AsyncClient(timeout=5.0) as client:
-        r = await client.patch(
-            f"{settings.catalog_url}/templates/{tid}",
-            json=payload,
-            headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json"},
-        )
-        try:
-            return JSONResponse(status_code=r.status_code, content=r.json())
-        except Exception:
-            return JSONResponse(status_code=r.status_code, content={"detail": r.text})
+    return await proxy(
+        upstreams.catalog,
+        "PATCH",
+        f"/templates/{tid}",
+        content=await request.body(),
+        headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json"},
+        unavailable="catalog unavailable",
+    )
 
 
 @app.delete("/api/templates/{tid}")
 async def api_delete_template(tid: str, token: Optional[str] = Depends(get_token_from_cookie)):
     if not is_admin(token):
         return JSONResponse(status_code=403, content={"detail": "Admin required"})
-    async with httpx.AsyncClient(timeout=5.0) as client:
-        r = await client.delete(
-            f"{settings.catalog_url}/templates/{tid}",
-            headers={"Authorization": f"Bearer {token}"},
-        )
-        return Response(status_code=r.status_code)
+    return await proxy(
+        upstreams.catalog,
+        "DELETE",
+        f"/templates/{tid}",
+        headers={"Authorization": f"Bearer {token}"},
+        unavailable="catalog unavailable",
+    )
 
 
 @app.post("/api/products")
 async def api_create_product(request: Request, token: Optional[str] = Depends(get_token_from_cookie)):
     if not is_admin(token):
         return JSONResponse(status_code=403, content={"detail": "Admin required"})
-    payload = await request.json()
     headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
     try:
-        async with httpx.AsyncClient(timeout=5.0) as client:
-            r = await client.post(f"{settings.catalog_url}/products/", json=payload, headers=headers)
-            return JSONResponse(r.json(), status_code=r.status_code)
-    except httpx.RequestError:
-        return JSONResponse(status_code=503, content={"detail": "catalog unavailable"})
+        return await proxy(
+            upstreams.catalog,
+            "POST",
+            "/products/",
+            content=await request.body(),
+            headers=headers,
+            unavailable="catalog unavailable",
+        )
+    finally:
+        # write-through: drop cached listings/cards whatever the outcome (a timed out write may still land)
+        catalog_cache.invalidate()
+        price_cache.invalidate()
 
 
 @app.patch("/api/products/{pid}")
 async def api_update_product(pid: str, request: Request, token: Optional[str] = Depends(get_token_from_cookie)):
     if not is_admin(token):
         return JSONResponse(status_code=403, content={"detail": "Admin required"})
-    payload = await request.json()
     headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
     try:
-        async with httpx.AsyncClient(timeout=5.0) as client:
-            r = await client.patch(f"{settings.catalog_url}/products/{pid}", json=payload, headers=headers)
-            return JSONResponse(r.json(), status_code=r.status_code)
-    except httpx.RequestError:
-        return JSONResponse(status_code=503, content={"detail": "catalog unavailable"})
+        return await proxy(
+            upstreams.catalog,
+            "PATCH",
+            f"/products/{pid}",
+            content=await request.body(),
+            headers=headers,
+            unavailable="catalog unavailable",
+        )
+    finally:
+        # write-through: drop cached listings/cards whatever the outcome (a timed out write may still land)
+        catalog_cache.invalidate()
+        price_cache.invalidate()
 
 
 @app.delete("/api/products/{pid}")
@@ -329,11 +387,14 @@ async def api_delete_product(pid: str, token: Optional[str] = Depends(get_token_
         return JSONResponse(status_code=403, content={"detail": "Admin required"})
     headers = {"Authorization": f"Bearer {token}"}
     try:
-        async with httpx.AsyncClient(timeout=5.0) as client:
-            r = await client.delete(f"{settings.catalog_url}/products/{pid}", headers=headers)
-            return Response(status_code=r.status_code)
+        r = await upstreams.catalog.delete(f"/products/{pid}", headers=headers)
+        return Response(status_code=r.status_code)
     except httpx.RequestError:
         return JSONResponse(status_code=503, content={"detail": "catalog unavailable"})
+    finally:
+        # write-through: drop cached listings/cards whatever the outcome (a timed out write may still land)
+        catalog_cache.invalidate()
+        price_cache.invalidate()
 
 
 # Cart helpers and endpoints (in-memory per user)
@@ -342,6 +403,52 @@ def _require_user_email(token: Optional[str]) -> Optional[str]:
     return payload.get("sub") if payload else None
 
 
+class CatalogUnavailable(Exception):
+    """The catalog could not answer a product lookup (as opposed to products that do not exist)."""
+
+
+async def fetch_products(ids) -> Dict[str, Dict[str, Any]]:
+    # one catalog round trip for the whole cart; ids reported missing are left out
+    ids = [str(pid) for pid in ids]
+    if not ids:
+        return {}
+    try:
+        r = await upstreams.catalog.post("/products/batch", json={"ids": ids})
+    except httpx.RequestError as e:
+        raise CatalogUnavailable(str(e)) from e
+    # unknown ids still get 200 (listed in "missing"): any other status is a failed lookup
+    if r.status_code != 200:
+        raise CatalogUnavailable(f"catalog answered {r.status_code}")
+    data = r.json()
+    items = data.get("items", [])
+    price_cache.update(items, data.get("missing", []))
+    return {str(p.get("id")): p for p in items}
+
+
+async def fetch_product(pid: str) -> Optional[Dict[str, Any]]:
+    # one product for a cart change; None when the catalog does not have it
+    try:
+        r = await upstreams.catalog.get(f"/products/{pid}")
+    except httpx.RequestError as e:
+        raise CatalogUnavailable(str(e)) from e
+    if r.status_code >= 500:
+        raise CatalogUnavailable(f"catalog answered {r.status_code}")
+    # 404, or 422 for an id that is not a UUID
+    return r.json() if r.status_code == 200 else None
+
+
+def cart_view(cart_map: Dict[str, int], products: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    items = []
+    total = 0.0
+    for pid, qty in cart_map.items():
+        p = products.get(pid)
+        if p is not None:
+            price = float(p.get("price", 0))
+            items.append({"product": p, "qty": qty, "subtotal": round(price * qty, 2)})
+            total += price * qty
+    return {"items": items, "total": round(total, 2)}
+
+
 @app.get("/cart", response_class=HTMLResponse)
 async def cart_page(request: Request, token: Optional[str] = Depends(get_token_from_cookie)):
     if not token:
@@ -349,15 +456,9 @@ async def cart_page(request: Request, token: Optional[str] = Depends(get_token_f
     items = []
     user = get_user_payload(token)
     try:
-        async with httpx.AsyncClient(timeout=5.0) as client:
-            cr = await client.get(f"{settings.cart_url}/cart", headers={"Authorization": f"Bearer {token}"})
-            if cr.status_code == 200:
-                cart_map: Dict[str, int] = cr.json()
-                for pid, qty in cart_map.items():
-                    pr = await client.get(f"{settings.catalog_url}/products/{pid}")
-                    if pr.status_code == 200:
-                        p = pr.json()
-                        items.append({"product": p, "qty": qty})
+        cr = await upstreams.cart.get("/cart/items", headers={"Authorization": f"Bearer {token}"})
+        if cr.status_code == 200:
+            items = cr.json().get("items", [])
     except httpx.RequestError:
         pass
     return templates.TemplateResponse("cart.html", {"request": request, "items": items, "user": user})
@@ -378,12 +479,11 @@ async def change_password(request: Request):
     if not token:
         return JSONResponse(status_code=401, content={"detail": "Login required"})
     payload = await request.json()
-    async with httpx.AsyncClient() as client:
-        r = await client.post(
-            f"{settings.auth_url}/auth/change_password",
-            json=payload,
-            headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json"},
-        )
+    r = await upstreams.auth.post(
+        "/auth/change_password",
+        json=payload,
+        headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json"},
+    )
     if r.status_code != 200:
         try:
             return JSONResponse(status_code=r.status_code, content=r.json())
@@ -414,24 +514,40 @@ async def order_detail_page(oid: str, request: Request):
 async def api_get_cart(token: Optional[str] = Depends(get_token_from_cookie)):
     if not token:
         return JSONResponse(status_code=401, content={"detail": "Login required"})
-    items = []
-    total = 0.0
+    # cart-service answers from its product snapshots; the catalog is not called here
     try:
-        async with httpx.AsyncClient(timeout=5.0) as client:
-            cr = await client.get(f"{settings.cart_url}/cart", headers={"Authorization": f"Bearer {token}"})
-            if cr.status_code != 200:
-                return JSONResponse(status_code=cr.status_code, content=cr.json())
-            cart_map: Dict[str, int] = cr.json()
-            for pid, qty in cart_map.items():
-                pr = await client.get(f"{settings.catalog_url}/products/{pid}")
-                if pr.status_code == 200:
-                    p = pr.json()
-                    price = float(p.get("price", 0))
-                    items.append({"product": p, "qty": qty, "subtotal": round(price * qty, 2)})
-                    total += price * qty
+        cr = await upstreams.cart.get("/cart/items", headers={"Authorization": f"Bearer {token}"})
+        if cr.status_code != 200:
+            return JSONResponse(status_code=cr.status_code, content=cr.json())
+        data = cr.json()
     except httpx.RequestError:
         return JSONResponse(status_code=503, content={"detail": "cart unavailable"})
-    return {"items": items, "total": round(total, 2)}
+    return {"items": data.get("items", []), "total": data.get("total", 0.0)}
+
+
+@app.get("/api/cart/summary")
+async def api_cart_summary(token: Optional[str] = Depends(get_token_from_cookie)):
+    """Header badge data: counts straight from the cart, total from cached prices."""
+    if not token:
+        return JSONResponse(status_code=401, content={"detail": "Login required"})
+    try:
+        cr = await upstreams.cart.get("/cart/summary", headers={"Authorization": f"Bearer {token}"})
+        if cr.status_code != 200:
+            return JSONResponse(status_code=cr.status_code, content=cr.json())
+        data = cr.json()
+        quantities: Dict[str, int] = data.get("quantities", {})
+    except httpx.RequestError:
+        return JSONResponse(status_code=503, content={"detail": "cart unavailable"})
+    prices, missing = price_cache.get_many(quantities)
+    if missing:
+        # one batch call for prices not seen recently; it refills the price cache
+        try:
+            products = await fetch_products(missing)
+        except CatalogUnavailable:
+            return JSONResponse(status_code=503, content={"detail": "catalog unavailable"})
+        prices.update({pid: float(p.get("price", 0)) for pid, p in products.items()})
+    total = sum(prices[pid] * qty for pid, qty in quantities.items() if prices.get(pid) is not None)
+    return {"lines": data.get("lines", 0), "items": data.get("items", 0), "total": round(total, 2)}
 
 
 @app.post("/api/cart/add")
@@ -441,62 +557,107 @@ async def api_cart_add(request: Request, token: Optional[str] = Depends(get_toke
     payload = await request.json()
     pid = str(payload.get("product_id"))
     # validate product exists and stock availability
-    async with httpx.AsyncClient(timeout=5.0) as client:
-        pr = await client.get(f"{settings.catalog_url}/products/{pid}")
-        if pr.status_code != 200:
-            return JSONResponse(status_code=404, content={"detail": "Product not found"})
-        product = pr.json()
-        if not product.get("is_active", True):
-            return JSONResponse(status_code=409, content={"detail": "Product not available"})
-        # compute resulting qty = current in cart + incoming qty
+    try:
+        product = await fetch_product(pid)
+    except CatalogUnavailable:
+        return JSONResponse(status_code=503, content={"detail": "catalog unavailable"})
+    if product is None:
+        return JSONResponse(status_code=404, content={"detail": "Product not found"})
+    if not product.get("is_active", True):
+        return JSONResponse(status_code=409, content={"detail": "Product not available"})
+    # compute resulting qty = current in cart + incoming qty
+    try:
+        qty_add = int(payload.get("qty", 1))
+    except Exception:
+        return JSONResponse(status_code=422, content={"detail": "Invalid qty"})
+    if qty_add <= 0:
+        return JSONResponse(status_code=422, content={"detail": "Invalid qty"})
+    try:
+        stock = int(product.get("stock", 0))
+    except Exception:
+        stock = 0
+    # cart-service checks current qty + qty_add against the stock cap atomically
+    cr = await upstreams.cart.post(
+        "/cart/add",
+        json={"product_id": pid, "qty": qty_add, "max_qty": stock},
+        headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json"},
+    )
+    if cr.status_code != 200:
         try:
-            qty_add = int(payload.get("qty", 1))
+            return JSONResponse(status_code=cr.status_code, content=cr.json())
         except Exception:
-            return JSONResponse(status_code=422, content={"detail": "Invalid qty"})
-        if qty_add <= 0:
-            return JSONResponse(status_code=422, content={"detail": "Invalid qty"})
-        cr0 = await client.get(f"{settings.cart_url}/cart", headers={"Authorization": f"Bearer {token}"})
-        current_qty = 0
-        if cr0.status_code == 200:
-            cart_map = cr0.json()
-            current_qty = int(cart_map.get(pid, 0))
-        target_qty = current_qty + qty_add
+            return JSONResponse(status_code=cr.status_code, content={"detail": cr.text})
+    return JSONResponse({"ok": True, "qty": cr.json().get("qty")})
+
+
+# forwarded both ways for checkout and cancel: the key lets order-service replay a retried request
+IDEMPOTENCY_REQUEST_HEADER = "Idempotency-Key"
+IDEMPOTENCY_RESPONSE_HEADERS = ("Idempotent-Replayed", "Retry-After")
+
+
+def order_headers(request: Request, token: str) -> Dict[str, str]:
+    headers = {"Authorization": f"Bearer {token}"}
+    key = request.headers.get(IDEMPOTENCY_REQUEST_HEADER)
+    if key:
+        headers[IDEMPOTENCY_REQUEST_HEADER] = key
+    return headers
+
+
+@app.post("/api/order/checkout")
+async def api_order_checkout(request: Request, token: Optional[str] = Depends(get_token_from_cookie)):
+    if not token:
+        return JSONResponse(status_code=401, content={"detail": "Login required"})
+    headers = order_headers(request, token)
+    if request.headers.get("prefer"):
+        # "Prefer: respond-async": order-service may queue the checkout and answer 202 with a job handle
+        headers["Prefer"] = request.headers["prefer"]
+    try:
+        r = await upstreams.order.post(
+            "/orders/checkout",
+            headers=headers,
+            timeout=settings.checkout_timeout,
+        )
         try:
-            stock = int(product.get("stock", 0))
+            content = r.json()
         except Exception:
-            stock = 0
-        if target_qty > stock:
-            return JSONResponse(status_code=409, content={"detail": "Not enough stock"})
-        cr = await client.post(
-            f"{settings.cart_url}/cart/add",
-            json=payload,
-            headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json"},
-        )
-        if cr.status_code != 200:
-            try:
-                return JSONResponse(status_code=cr.status_code, content=cr.json())
-            except Exception:
-                return JSONResponse(status_code=cr.status_code, content={"detail": cr.text})
-    return JSONResponse({"ok": True})
+            content = {"detail": r.text}
+        headers = {h: r.headers[h] for h in IDEMPOTENCY_RESPONSE_HEADERS if h in r.headers}
+        if r.status_code == 202 and isinstance(content, dict) and content.get("id"):
+            content["status_url"] = f"/api/order/checkout/jobs/{content['id']}"
+            headers["Location"] = content["status_url"]
+        return JSONResponse(status_code=r.status_code, content=content, headers=headers)
+    except httpx.TimeoutException:
+        # the order may still be placed: a retry with the same Idempotency-Key returns it instead of a duplicate
+        return JSONResponse(status_code=504, content={"detail": "order-service timed out"})
+    except httpx.RequestError:
+        return JSONResponse(status_code=503, content={"detail": "order-service unavailable"})
 
 
-@app.post("/api/order/checkout")
-async def api_order_checkout(token: Optional[str] = Depends(get_token_from_cookie)):
+@app.get("/api/order/checkout/jobs/{job_id}")
+async def api_order_checkout_job(job_id: str, request: Request, token: Optional[str] = Depends(get_token_from_cookie)):
+    """State of a queued checkout; `wait` (seconds) long-polls until the job is finished."""
     if not token:
         return JSONResponse(status_code=401, content={"detail": "Login required"})
     try:
-        async with httpx.AsyncClient(timeout=15.0) as client:
-            r = await client.post(
-                f"{settings.order_url}/orders/checkout",
-                headers={"Authorization": f"Bearer {token}"},
-            )
-            try:
-                content = r.json()
-            except Exception:
-                content = {"detail": r.text}
-            return JSONResponse(status_code=r.status_code, content=content)
+        wait = min(max(float(request.query_params.get("wait", 0)), 0.0), settings.checkout_long_poll_max)
+    except ValueError:
+        return JSONResponse(status_code=422, content={"detail": "wait must be a number"})
+    try:
+        r = await upstreams.order.get(
+            f"/orders/checkout/jobs/{job_id}",
+            params={"wait": wait},
+            headers={"Authorization": f"Bearer {token}"},
+            timeout=wait + settings.http_timeout,
+        )
     except httpx.RequestError:
         return JSONResponse(status_code=503, content={"detail": "order-service unavailable"})
+    try:
+        content = r.json()
+    except Exception:
+        return JSONResponse(status_code=r.status_code, content={"detail": r.text})
+    if isinstance(content, dict) and content.get("status_url"):
+        content["status_url"] = f"/api/order/checkout/jobs/{job_id}"
+    return JSONResponse(status_code=r.status_code, content=content)
 
 
 @app.post("/api/cart/remove")
@@ -506,17 +667,16 @@ async def api_cart_remove(request: Request, token: Optional[str] = Depends(get_t
     payload = await request.json()
     if not payload.get("product_id"):
         return JSONResponse(status_code=422, content={"detail": "Invalid input"})
-    async with httpx.AsyncClient(timeout=5.0) as client:
-        cr = await client.post(
-            f"{settings.cart_url}/cart/remove",
-            json=payload,
-            headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json"},
-        )
-        if cr.status_code != 200:
-            try:
-                return JSONResponse(status_code=cr.status_code, content=cr.json())
-            except Exception:
-                return JSONResponse(status_code=cr.status_code, content={"detail": cr.text})
+    cr = await upstreams.cart.post(
+        "/cart/remove",
+        json=payload,
+        headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json"},
+    )
+    if cr.status_code != 200:
+        try:
+            return JSONResponse(status_code=cr.status_code, content=cr.json())
+        except Exception:
+            return JSONResponse(status_code=cr.status_code, content={"detail": cr.text})
     return JSONResponse({"ok": True})
 
 
@@ -528,29 +688,91 @@ async def api_cart_set(request: Request, token: Optional[str] = Depends(get_toke
     if not payload.get("product_id"):
         return JSONResponse(status_code=422, content={"detail": "Invalid input"})
     # validate product exists and stock availability
-    async with httpx.AsyncClient(timeout=5.0) as client:
-        pr = await client.get(f"{settings.catalog_url}/products/{payload.get('product_id')}")
-        if pr.status_code != 200:
-            return JSONResponse(status_code=404, content={"detail": "Product not found"})
-        product = pr.json()
+    try:
+        product = await fetch_product(str(payload.get("product_id")))
+    except CatalogUnavailable:
+        return JSONResponse(status_code=503, content={"detail": "catalog unavailable"})
+    if product is None:
+        return JSONResponse(status_code=404, content={"detail": "Product not found"})
+    if not product.get("is_active", True):
+        return JSONResponse(status_code=409, content={"detail": "Product not available"})
+    try:
+        qty = int(payload.get("qty", 0))
+    except Exception:
+        return JSONResponse(status_code=422, content={"detail": "Invalid qty"})
+    if qty < 0:
+        return JSONResponse(status_code=422, content={"detail": "Invalid qty"})
+    if qty > 0:
+        try:
+            stock = int(product.get("stock", 0))
+        except Exception:
+            stock = 0
+        if qty > stock:
+            return JSONResponse(status_code=409, content={"detail": "Not enough stock"})
+    cr = await upstreams.cart.post(
+        "/cart/set",
+        json=payload,
+        headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json"},
+    )
+    if cr.status_code != 200:
+        try:
+            return JSONResponse(status_code=cr.status_code, content=cr.json())
+        except Exception:
+            return JSONResponse(status_code=cr.status_code, content={"detail": cr.text})
+    return JSONResponse({"ok": True})
+
+
+@app.post("/api/cart/batch")
+async def api_cart_batch(request: Request, token: Optional[str] = Depends(get_token_from_cookie)):
+    """Several cart edits in one request: one catalog lookup, one cart transaction, the final cart back.
+
+    Body: {"ops": [{"op": "add"|"set"|"remove", "product_id": "...", "qty": 1}, ...]}, applied in order.
+    """
+    if not token:
+        return JSONResponse(status_code=401, content={"detail": "Login required"})
+    payload = await request.json()
+    ops = payload.get("ops") if isinstance(payload, dict) else None
+    if not isinstance(ops, list) or not ops:
+        return JSONResponse(status_code=422, content={"detail": "Invalid input"})
+    ids = {str(op.get("product_id")) for op in ops if isinstance(op, dict) and op.get("op") in ("add", "set")}
+    try:
+        products = await fetch_products(ids)
+    except CatalogUnavailable:
+        return JSONResponse(status_code=503, content={"detail": "catalog unavailable"})
+    forwarded = []
+    for op in ops:
+        if not isinstance(op, dict) or not op.get("product_id") or op.get("op") not in ("add", "set", "remove"):
+            return JSONResponse(status_code=422, content={"detail": "Invalid input"})
+        pid = str(op["product_id"])
+        if op["op"] == "remove":
+            forwarded.append({"op": "remove", "product_id": pid})
+            continue
+        try:
+            qty = int(op.get("qty", 1 if op["op"] == "add" else 0))
+        except Exception:
+            return JSONResponse(status_code=422, content={"detail": "Invalid qty", "product_id": pid})
+        if qty < 0 or (op["op"] == "add" and qty == 0):
+            return JSONResponse(status_code=422, content={"detail": "Invalid qty", "product_id": pid})
+        product = products.get(pid)
+        if product is None:
+            return JSONResponse(status_code=404, content={"detail": "Product not found", "product_id": pid})
         if not product.get("is_active", True):
-            return JSONResponse(status_code=409, content={"detail": "Product not available"})
+            return JSONResponse(status_code=409, content={"detail": "Product not available", "product_id": pid})
         try:
-            qty = int(payload.get("qty", 0))
+            stock = int(product.get("stock", 0))
         except Exception:
-            return JSONResponse(status_code=422, content={"detail": "Invalid qty"})
-        if qty < 0:
-            return JSONResponse(status_code=422, content={"detail": "Invalid qty"})
-        if qty > 0:
-            try:
-                stock = int(product.get("stock", 0))
-            except Exception:
-                stock = 0
+            stock = 0
+        if op["op"] == "set":
             if qty > stock:
-                return JSONResponse(status_code=409, content={"detail": "Not enough stock"})
-        cr = await client.post(
-            f"{settings.cart_url}/cart/set",
-            json=payload,
+                return JSONResponse(status_code=409, content={"detail": "Not enough stock", "product_id": pid})
+            forwarded.append({"op": "set", "product_id": pid, "qty": qty})
+        else:
+            # capped atomically in cart-service against what is already in the cart
+            forwarded.append({"op": "add", "product_id": pid, "qty": qty, "max_qty": stock})
+    try:
+        cr = await upstreams.cart.post(
+            "/cart/batch",
+            json={"ops": forwarded},
             headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json"},
         )
         if cr.status_code != 200:
@@ -558,190 +780,138 @@ async def api_cart_set(request: Request, token: Optional[str] = Depends(get_toke
                 return JSONResponse(status_code=cr.status_code, content=cr.json())
             except Exception:
                 return JSONResponse(status_code=cr.status_code, content={"detail": cr.text})
-    return JSONResponse({"ok": True})
+        data = cr.json()
+    except httpx.RequestError:
+        return JSONResponse(status_code=503, content={"detail": "cart unavailable"})
+    cart_map: Dict[str, int] = data.get("cart", {})
+    rest = [pid for pid in cart_map if pid not in products]
+    if rest:
+        try:
+            products.update(await fetch_products(rest))
+        except CatalogUnavailable:
+            return JSONResponse(status_code=503, content={"detail": "catalog unavailable"})
+    return {**cart_view(cart_map, products), "results": data.get("results", [])}
 
 
 @app.post("/api/cart/clear")
 async def api_cart_clear(token: Optional[str] = Depends(get_token_from_cookie)):
     if not token:
         return JSONResponse(status_code=401, content={"detail": "Login required"})
-    async with httpx.AsyncClient(timeout=5.0) as client:
-        cr = await client.post(
-            f"{settings.cart_url}/cart/clear",
-            headers={"Authorization": f"Bearer {token}"},
-        )
-        if cr.status_code != 200:
-            try:
-                return JSONResponse(status_code=cr.status_code, content=cr.json())
-            except Exception:
-                return JSONResponse(status_code=cr.status_code, content={"detail": cr.text})
+    cr = await upstreams.cart.post(
+        "/cart/clear",
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    if cr.status_code != 200:
+        try:
+            return JSONResponse(status_code=cr.status_code, content=cr.json())
+        except Exception:
+            return JSONResponse(status_code=cr.status_code, content={"detail": cr.text})
     return JSONResponse({"ok": True})
 
 
 @app.get("/api/orders")
-async def api_orders(token: Optional[str] = Depends(get_token_from_cookie)):
+async def api_orders(request: Request, token: Optional[str] = Depends(get_token_from_cookie)):
     if not token:
         return JSONResponse(status_code=401, content={"detail": "Login required"})
-    async with httpx.AsyncClient(timeout=10.0) as client:
-        r = await client.get(f"{settings.order_url}/orders", headers={"Authorization": f"Bearer {token}"})
-    try:
-        return JSONResponse(status_code=r.status_code, content=r.json())
-    except Exception:
-        return JSONResponse(status_code=r.status_code, content={"detail": r.text})
+    # limit, cursor, date_from, date_to go through as is; X-Next-Cursor comes back in the proxied headers
+    return await proxy(
+        upstreams.order,
+        "GET",
+        "/orders",
+        params=request.query_params.multi_items(),
+        headers={"Authorization": f"Bearer {token}"},
+        unavailable="order-service unavailable",
+    )
 
 
 @app.get("/api/orders/{oid}")
 async def api_order_detail(oid: str, token: Optional[str] = Depends(get_token_from_cookie)):
     if not token:
         return JSONResponse(status_code=401, content={"detail": "Login required"})
-    async with httpx.AsyncClient(timeout=10.0) as client:
-        r = await client.get(f"{settings.order_url}/orders/{oid}", headers={"Authorization": f"Bearer {token}"})
-    try:
-        return JSONResponse(status_code=r.status_code, content=r.json())
-    except Exception:
-        return JSONResponse(status_code=r.status_code, content={"detail": r.text})
+    return await proxy(
+        upstreams.order,
+        "GET",
+        f"/orders/{oid}",
+        headers={"Authorization": f"Bearer {token}"},
+        unavailable="order-service unavailable",
+    )
 
 
 @app.patch("/api/orders/{oid}/cancel")
-async def api_user_cancel_order(oid: str, token: Optional[str] = Depends(get_token_from_cookie)):
+async def api_user_cancel_order(request: Request, oid: str, token: Optional[str] = Depends(get_token_from_cookie)):
     if not token:
         return JSONResponse(status_code=401, content={"detail": "Login required"})
-    async with httpx.AsyncClient(timeout=10.0) as client:
-        r = await client.patch(
-            f"{settings.order_url}/orders/{oid}/cancel",
-            headers={"Authorization": f"Bearer {token}"},
-        )
-        try:
-            return JSONResponse(status_code=r.status_code, content=r.json())
-        except Exception:
-            return JSONResponse(status_code=r.status_code, content={"detail": r.text})
+    return await proxy(
+        upstreams.order,
+        "PATCH",
+        f"/orders/{oid}/cancel",
+        headers=order_headers(request, token),
+        unavailable="order-service unavailable",
+    )
 
 
 @app.get("/api/admin/orders")
 async def api_admin_orders(request: Request, token: Optional[str] = Depends(get_token_from_cookie)):
     if not is_admin(token):
         return JSONResponse(status_code=403, content={"detail": "Admin required"})
-    params = str(request.query_params) or ""
-    url = f"{settings.order_url}/admin/orders"
-    if params:
-        url = f"{url}?{params}"
-    async with httpx.AsyncClient(timeout=10.0) as client:
-        r = await client.get(url, headers={"Authorization": f"Bearer {token}"})
-        try:
-            return JSONResponse(status_code=r.status_code, content=r.json())
-        except Exception:
-            return JSONResponse(status_code=r.status_code, content={"detail": r.text})
+    # filters and limit/cursor go through as is; X-Next-Cursor comes back in the proxied headers
+    return await proxy(
+        upstreams.order,
+        "GET",
+        "/admin/orders",
+        params=request.query_params.multi_items(),
+        headers={"Authorization": f"Bearer {token}"},
+        unavailable="order-service unavailable",
+    )
 
 
 @app.patch("/api/admin/orders/{oid}/cancel")
-async def api_admin_cancel_order(oid: str, token: Optional[str] = Depends(get_token_from_cookie)):
+async def api_admin_cancel_order(request: Request, oid: str, token: Optional[str] = Depends(get_token_from_cookie)):
     if not is_admin(token):
         return JSONResponse(status_code=403, content={"detail": "Admin required"})
-    async with httpx.AsyncClient(timeout=10.0) as client:
-        r = await client.patch(
-            f"{settings.order_url}/orders/{oid}/cancel",
-            headers={"Authorization": f"Bearer {token}"},
-        )
-        try:
-            return JSONResponse(status_code=r.status_code, content=r.json())
-        except Exception:
-            return JSONResponse(status_code=r.status_code, content={"detail": r.text})
+    return await proxy(
+        upstreams.order,
+        "PATCH",
+        f"/orders/{oid}/cancel",
+        headers=order_headers(request, token),
+        unavailable="order-service unavailable",
+    )
 
 
 @app.get("/api/admin/stats")
-async def api_admin_stats(token: Optional[str] = Depends(get_token_from_cookie)):
+async def api_admin_stats(request: Request, token: Optional[str] = Depends(get_token_from_cookie)):
     if not is_admin(token):
         return JSONResponse(status_code=403, content={"detail": "Admin required"})
+    # aggregation runs in SQL on both sides; the gateway only merges the two summaries
+    params = {k: v for k, v in request.query_params.items() if k in ("date_from", "date_to", "top", "days")}
+    products: Dict[str, Any] = {"total": 0, "active": 0, "low_stock": []}
+    orders: Dict[str, Any] = {}
     try:
-        async with httpx.AsyncClient(timeout=15.0) as client:
-            # products
-            pr = await client.get(f"{settings.catalog_url}/products/")
-            products = pr.json() if pr.status_code == 200 else []
-            # orders (admin)
-            orr = await client.get(
-                f"{settings.order_url}/admin/orders",
+        pr, orr = await asyncio.gather(
+            upstreams.catalog.get(
+                "/products/summary",
+                params={"low_stock_threshold": 3, "limit": 10},
+                timeout=settings.admin_stats_timeout,
+            ),
+            upstreams.order.get(
+                "/admin/stats",
+                params=params,
                 headers={"Authorization": f"Bearer {token}"},
-            )
-            orders = orr.json() if orr.status_code == 200 else []
+                timeout=settings.admin_stats_timeout,
+            ),
+        )
+        if pr.status_code == 200:
+            products = pr.json()
+        if orr.status_code == 200:
+            orders = orr.json()
     except httpx.RequestError:
-        products, orders = [], []
-
-    # drop canceled orders from stats
-    orders = [o for o in orders if o.get("status") != "canceled"]
-
-    # products stats
-    total_products = len(products)
-    active_products = sum(1 for p in products if p.get("is_active", True))
-    low_stock_threshold = 3
-    low_stock = [
-        {"id": p.get("id"), "sku": p.get("sku"), "name": p.get("name"), "stock": int(p.get("stock", 0))}
-        for p in products
-        if int(p.get("stock", 0)) <= low_stock_threshold
-    ]
-
-    # orders stats
-    total_orders = len(orders)
-    total_revenue = 0.0
-    buyers = set()
-    by_product: Dict[str, Dict[str, object]] = {}
-    by_day: Dict[str, Dict[str, float]] = {}
-    from datetime import datetime
-    for o in orders:
-        buyers.add(o.get("user"))
-        try:
-            total_revenue += float(o.get("total", 0))
-        except Exception:
-            pass
-        for it in o.get("items", []):
-            pid = str(it.get("product_id"))
-            qty = int(it.get("qty", 0))
-            revenue = float(it.get("subtotal", 0))
-            name = it.get("name")
-            sku = it.get("sku")
-            acc = by_product.setdefault(pid, {"product_id": pid, "name": name, "sku": sku, "qty": 0, "revenue": 0.0})
-            acc["qty"] = int(acc["qty"]) + qty
-            acc["revenue"] = float(acc["revenue"]) + revenue
-        # timeseries
-        created_at = o.get("created_at")
-        if created_at:
-            try:
-                d = datetime.fromisoformat(created_at.replace("Z", "+00:00")).date().isoformat()
-                rec = by_day.setdefault(d, {"count": 0, "revenue": 0.0})
-                rec["count"] += 1
-                rec["revenue"] += float(o.get("total", 0))
-            except Exception:
-                pass
-
-    # top products by revenue
-    top_products = sorted(by_product.values(), key=lambda x: (float(x["revenue"]), int(x["qty"])), reverse=True)[:5]
-
-    # last 7 days summary
-    from datetime import timedelta, date
-    today = date.today()
-    last7 = []
-    for i in range(6, -1, -1):
-        day = (today - timedelta(days=i)).isoformat()
-        rec = by_day.get(day, {"count": 0, "revenue": 0.0})
-        last7.append({"date": day, "count": rec["count"], "revenue": rec["revenue"]})
+        pass
 
     return {
-        "products": {
-            "total": total_products,
-            "active": active_products,
-            "low_stock": low_stock[:10],
-        },
-        "total_orders": total_orders,
-        "total_revenue": round(total_revenue, 2),
-        "unique_buyers": len([b for b in buyers if b]),
-        "top_products": [
-            {
-                "product_id": p["product_id"],
-                "name": p.get("name"),
-                "sku": p.get("sku"),
-                "qty": int(p.get("qty", 0)),
-                "revenue": round(float(p.get("revenue", 0.0)), 2),
-            }
-            for p in top_products
-        ],
-        "last7": last7,
+        "products": products,
+        "total_orders": orders.get("total_orders", 0),
+        "total_revenue": orders.get("total_revenue", 0.0),
+        "unique_buyers": orders.get("unique_buyers", 0),
+        "top_products": orders.get("top_products", []),
+        "last7": orders.get("series", []),
     }
@@ -0,0 +1,39 @@
+from __future__ import annotations
+
+from typing import Any
+
+import httpx
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
+
+
+# connection-level headers that must not be forwarded (RFC 9110, 7.6.1)
+HOP_BY_HOP = {
+    "connection",
+    "keep-alive",
+    "proxy-authenticate",
+    "proxy-authorization",
+    "te",
+    "trailer",
+    "transfer-encoding",
+    "upgrade",
+}
+
+
+async def proxy(client: httpx.AsyncClient, method: str, url: str, *, unavailable: str, **kwargs: Any) -> Response:
+    """Passthrough: stream upstream status, headers and raw body bytes to the client.
+
+    The body is neither decoded nor parsed (content-encoding is forwarded as is).
+    Connection errors before the response starts become 503 ``{"detail": unavailable}``.
+    """
+    try:
+        r = await client.send(client.build_request(method, url, **kwargs), stream=True)
+    except httpx.RequestError:
+        return JSONResponse(status_code=503, content={"detail": unavailable})
+    resp = StreamingResponse(r.aiter_raw(), status_code=r.status_code, background=BackgroundTask(r.aclose))
+    resp.raw_headers = [
+        (k.encode("latin-1"), v.encode("latin-1"))
+        for k, v in r.headers.multi_items()
+        if k.lower() not in HOP_BY_HOP
+    ]
+    return resp
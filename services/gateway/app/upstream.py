@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+from typing import Any, Dict, Tuple
+
+import httpx
+
+from .config import settings
+
+
+# Upstream name -> base URL setting. One pooled client is kept per entry.
+UPSTREAMS = ("auth", "catalog", "cart", "order")
+
+
+def _base_url(name: str) -> str:
+    return getattr(settings, f"{name}_url")
+
+
+def _option(name: str, key: str, default):
+    return (settings.upstream_overrides.get(name) or {}).get(key, default)
+
+
+class CountingTransport(httpx.AsyncHTTPTransport):
+    """The default pooled transport, counting requests through the public transport API
+    (httpcore pool internals change between releases)."""
+
+    def __init__(self, limits: httpx.Limits, **kwargs: Any) -> None:
+        super().__init__(limits=limits, **kwargs)
+        self.max_connections = limits.max_connections
+        self.max_keepalive_connections = limits.max_keepalive_connections
+        self.requests = 0
+        self.in_flight = 0
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        self.in_flight += 1
+        try:
+            return await super().handle_async_request(request)
+        finally:
+            # counted until the response headers arrive
+            self.in_flight -= 1
+
+
+def _build_client(name: str) -> Tuple[httpx.AsyncClient, CountingTransport]:
+    max_connections = int(_option(name, "max_connections", settings.http_max_connections))
+    max_keepalive = int(_option(name, "max_keepalive_connections", settings.http_max_keepalive_connections))
+    limits = httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=min(max_keepalive, max_connections),
+        keepalive_expiry=float(_option(name, "keepalive_expiry", settings.http_keepalive_expiry)),
+    )
+    # handlers pass paths relative to the upstream's base URL
+    transport = CountingTransport(limits, http2=settings.http2)
+    client = httpx.AsyncClient(
+        base_url=_base_url(name),
+        transport=transport,
+        timeout=float(_option(name, "timeout", settings.http_timeout)),
+    )
+    return client, transport
+
+
+class UpstreamClients:
+    """Long-lived httpx clients (one connection pool per backend service)."""
+
+    def __init__(self) -> None:
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self._transports: Dict[str, CountingTransport] = {}
+
+    def _open(self, name: str) -> httpx.AsyncClient:
+        client, self._transports[name] = _build_client(name)
+        self._clients[name] = client
+        return client
+
+    def start(self) -> None:
+        for name in UPSTREAMS:
+            if name not in self._clients:
+                self._open(name)
+
+    async def close(self) -> None:
+        clients, self._clients, self._transports = self._clients, {}, {}
+        for client in clients.values():
+            await client.aclose()
+
+    def get(self, name: str) -> httpx.AsyncClient:
+        client = self._clients.get(name)
+        if client is None or client.is_closed:
+            # created lazily if used outside the app lifespan (e.g. scripts)
+            client = self._open(name)
+        return client
+
+    @property
+    def auth(self) -> httpx.AsyncClient:
+        return self.get("auth")
+
+    @property
+    def catalog(self) -> httpx.AsyncClient:
+        return self.get("catalog")
+
+    @property
+    def cart(self) -> httpx.AsyncClient:
+        return self.get("cart")
+
+    @property
+    def order(self) -> httpx.AsyncClient:
+        return self.get("order")
+
+    def stats(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = {}
+        for name, client in self._clients.items():
+            transport = self._transports[name]
+            out[name] = {
+                "base_url": str(client.base_url),
+                "max_connections": transport.max_connections,
+                "max_keepalive_connections": transport.max_keepalive_connections,
+                "requests": transport.requests,
+                # requests waiting for response headers; above max_connections they queue for a connection
+                "in_flight": transport.in_flight,
+                "waiting": max(0, transport.in_flight - (transport.max_connections or transport.in_flight)),
+                "http2": settings.http2,
+            }
+        return out
+
+
+upstreams = UpstreamClients()
@@ -0,0 +1,60 @@
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0003_order_indexes"
+down_revision = "0002_idempotency_keys"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction; orders stay writable meanwhile
+    with op.get_context().autocommit_block():
+        # "my orders" and admin search by email: equality and LIKE 'prefix%' (varchar_pattern_ops),
+        # newest first with id as the keyset tie-breaker
+        op.create_index(
+            "ix_orders_user_email_created_at",
+            "orders",
+            ["user_email", sa.text("created_at DESC"), sa.text("id DESC")],
+            postgresql_ops={"user_email": "varchar_pattern_ops"},
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+        # admin list filtered by status
+        op.create_index(
+            "ix_orders_status_created_at",
+            "orders",
+            ["status", sa.text("created_at DESC"), sa.text("id DESC")],
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+        # admin list without filters and date ranges
+        op.create_index(
+            "ix_orders_created_at",
+            "orders",
+            [sa.text("created_at DESC"), sa.text("id DESC")],
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+        # loading the items of a page of orders (order_id = ANY(...))
+        op.create_index(
+            "ix_order_items_order_id",
+            "order_items",
+            ["order_id"],
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table in (
+            ("ix_order_items_order_id", "order_items"),
+            ("ix_orders_created_at", "orders"),
+            ("ix_orders_status_created_at", "orders"),
+            ("ix_orders_user_email_created_at", "orders"),
+        ):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,42 @@
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+revision = "0005_checkout_jobs"
+down_revision = "0004_sales_rollups"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "checkout_jobs",
+        sa.Column("id", postgresql.UUID(as_uuid=True), primary_key=True),
+        sa.Column("user_email", sa.String(length=255), nullable=False),
+        sa.Column("status", sa.String(length=16), nullable=False, server_default="queued"),
+        sa.Column("status_code", sa.Integer(), nullable=True),
+        sa.Column("result", postgresql.JSONB(), nullable=True),
+        sa.Column("attempts", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.text("CURRENT_TIMESTAMP"), nullable=False),
+        sa.Column("started_at", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("finished_at", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("locked_until", sa.DateTime(timezone=True), nullable=True),
+    )
+    # workers pick the oldest pending job (FOR UPDATE SKIP LOCKED); finished jobs stay out of the index
+    op.create_index(
+        "ix_checkout_jobs_pending",
+        "checkout_jobs",
+        ["created_at"],
+        postgresql_where=sa.text("status IN ('queued', 'running')"),
+    )
+    # latency metrics and purge of old finished jobs
+    op.create_index("ix_checkout_jobs_finished_at", "checkout_jobs", ["finished_at"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_checkout_jobs_finished_at", table_name="checkout_jobs")
+    op.drop_index("ix_checkout_jobs_pending", table_name="checkout_jobs")
+    op.drop_table("checkout_jobs")
@@ -0,0 +1,42 @@
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+revision = "0006_stock_outbox"
+down_revision = "0005_checkout_jobs"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "stock_outbox",
+        sa.Column("id", sa.BigInteger(), primary_key=True, autoincrement=True),
+        sa.Column("order_id", postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column("token", sa.String(length=128), nullable=False, unique=True),
+        sa.Column("items", postgresql.JSONB(), nullable=False),
+        sa.Column("state", sa.String(length=16), nullable=False, server_default="pending"),
+        sa.Column("attempts", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("next_attempt_at", sa.DateTime(timezone=True), server_default=sa.text("CURRENT_TIMESTAMP"), nullable=False),
+        sa.Column("last_error", sa.Text(), nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.text("CURRENT_TIMESTAMP"), nullable=False),
+        sa.Column("sent_at", sa.DateTime(timezone=True), nullable=True),
+    )
+    # the relay picks due pending rows; sent rows stay out of the index
+    op.create_index(
+        "ix_stock_outbox_pending",
+        "stock_outbox",
+        ["next_attempt_at"],
+        postgresql_where=sa.text("state = 'pending'"),
+    )
+    # purge of old sent rows
+    op.create_index("ix_stock_outbox_sent_at", "stock_outbox", ["sent_at"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_stock_outbox_sent_at", table_name="stock_outbox")
+    op.drop_index("ix_stock_outbox_pending", table_name="stock_outbox")
+    op.drop_table("stock_outbox")
@@ -0,0 +1,231 @@
+from __future__ import annotations
+
+from datetime import date, datetime, timezone
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+revision = "0007_partition_orders"
+down_revision = "0006_stock_outbox"
+branch_labels = None
+depends_on = None
+
+
+# orders and order_items become range-partitioned by month on created_at (UTC months).
+# The conversion keeps the service writable: partitioned copies are created next to the old tables,
+# triggers mirror every write to the old tables into them, existing rows are copied in short batches
+# (each its own transaction), and a final short transaction swaps the table names.
+# Partitioned tables need the partition key in every unique key: the keys become (id, created_at),
+# and order_items gets its order's created_at so an order and its items share a partition.
+MONTHS_AHEAD = 3
+BATCH = 5000
+
+ORDER_COLUMNS = "id, user_email, status, total, created_at, updated_at"
+ITEM_COLUMNS = "id, order_id, created_at, product_id, sku, name, price, qty, subtotal"
+
+INDEXES = (
+    # (name, table, definition) as in 0003_order_indexes
+    ("ix_orders_user_email_created_at", "orders", "(user_email varchar_pattern_ops, created_at DESC, id DESC)"),
+    ("ix_orders_status_created_at", "orders", "(status, created_at DESC, id DESC)"),
+    ("ix_orders_created_at", "orders", "(created_at DESC, id DESC)"),
+    ("ix_order_items_order_id", "order_items", "(order_id)"),
+)
+
+
+def _next(month: date) -> date:
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def _months(first: date, last: date) -> list[date]:
+    out = []
+    month = first.replace(day=1)
+    while month <= last:
+        out.append(month)
+        month = _next(month)
+    return out
+
+
+def _create_partitions(parent: str, table: str, months: list[date]) -> None:
+    for month in months:
+        op.execute(
+            f"CREATE TABLE IF NOT EXISTS {table}_p{month:%Y_%m} PARTITION OF {parent} "
+            f"FOR VALUES FROM ('{month.isoformat()} 00:00:00+00') TO ('{_next(month).isoformat()} 00:00:00+00')"
+        )
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    oldest = conn.execute(sa.text("SELECT min(created_at) FROM orders")).scalar()
+    today = datetime.now(timezone.utc).date()
+    months = _months((oldest.astimezone(timezone.utc).date() if oldest else today), today)
+    for _ in range(MONTHS_AHEAD):
+        months.append(_next(months[-1]))
+
+    op.execute(
+        """
+        CREATE TABLE orders_partitioned (
+            id uuid NOT NULL,
+            user_email varchar(255) NOT NULL,
+            status varchar(32) NOT NULL DEFAULT 'paid',
+            total numeric(12, 2) NOT NULL DEFAULT 0,
+            created_at timestamptz NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            updated_at timestamptz NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at)
+        """
+    )
+    op.execute(
+        """
+        CREATE TABLE order_items_partitioned (
+            id uuid NOT NULL,
+            order_id uuid NOT NULL,
+            created_at timestamptz NOT NULL,
+            product_id uuid NOT NULL,
+            sku varchar(64) NOT NULL,
+            name varchar(255) NOT NULL,
+            price numeric(12, 2) NOT NULL,
+            qty integer NOT NULL,
+            subtotal numeric(12, 2) NOT NULL,
+            PRIMARY KEY (id, created_at),
+            FOREIGN KEY (order_id, created_at) REFERENCES orders_partitioned (id, created_at) ON DELETE CASCADE
+        ) PARTITION BY RANGE (created_at)
+        """
+    )
+    _create_partitions("orders_partitioned", "orders", months)
+    _create_partitions("order_items_partitioned", "order_items", months)
+    # the partitions are still empty: building the indexes is instant; renamed to the final names at the swap
+    for name, table, definition in INDEXES:
+        op.execute(f"CREATE INDEX {name}_p ON {table}_partitioned {definition}")
+
+    # mirror writes made to the old tables during the copy
+    op.execute(
+        f"""
+        CREATE FUNCTION orders_partition_sync() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                DELETE FROM orders_partitioned WHERE id = OLD.id AND created_at = OLD.created_at;
+                RETURN OLD;
+            END IF;
+            INSERT INTO orders_partitioned ({ORDER_COLUMNS})
+            VALUES (NEW.id, NEW.user_email, NEW.status, NEW.total, NEW.created_at, NEW.updated_at)
+            ON CONFLICT (id, created_at) DO UPDATE SET
+                user_email = EXCLUDED.user_email, status = EXCLUDED.status,
+                total = EXCLUDED.total, updated_at = EXCLUDED.updated_at;
+            RETURN NEW;
+        END $$
+        """
+    )
+    op.execute(
+        f"""
+        CREATE FUNCTION order_items_partition_sync() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                DELETE FROM order_items_partitioned WHERE id = OLD.id;
+                RETURN OLD;
+            END IF;
+            INSERT INTO order_items_partitioned ({ITEM_COLUMNS})
+            SELECT NEW.id, NEW.order_id, o.created_at, NEW.product_id, NEW.sku, NEW.name, NEW.price, NEW.qty, NEW.subtotal
+            FROM orders o WHERE o.id = NEW.order_id
+            ON CONFLICT (id, created_at) DO UPDATE SET
+                product_id = EXCLUDED.product_id, sku = EXCLUDED.sku, name = EXCLUDED.name,
+                price = EXCLUDED.price, qty = EXCLUDED.qty, subtotal = EXCLUDED.subtotal;
+            RETURN NEW;
+        END $$
+        """
+    )
+    op.execute(
+        "CREATE TRIGGER orders_partition_sync AFTER INSERT OR UPDATE OR DELETE ON orders "
+        "FOR EACH ROW EXECUTE FUNCTION orders_partition_sync()"
+    )
+    op.execute(
+        "CREATE TRIGGER order_items_partition_sync AFTER INSERT OR UPDATE OR DELETE ON order_items "
+        "FOR EACH ROW EXECUTE FUNCTION order_items_partition_sync()"
+    )
+
+    # copy in keyset order, one short transaction per batch; FOR SHARE makes a concurrent delete wait
+    # until its row is copied, so the delete trigger removes the copy instead of missing it
+    with op.get_context().autocommit_block():
+        last = (datetime.min.replace(tzinfo=timezone.utc), "00000000-0000-0000-0000-000000000000")
+        while True:
+            row = conn.execute(
+                sa.text(
+                    f"""
+                    WITH batch AS (
+                        SELECT {ORDER_COLUMNS} FROM orders
+                        WHERE (created_at, id) > (:created_at, CAST(:id AS uuid))
+                        ORDER BY created_at, id
+                        LIMIT {BATCH}
+                        FOR SHARE
+                    ),
+                    copied AS (
+                        INSERT INTO orders_partitioned ({ORDER_COLUMNS})
+                        SELECT {ORDER_COLUMNS} FROM batch
+                        ON CONFLICT (id, created_at) DO NOTHING
+                    ),
+                    copied_items AS (
+                        INSERT INTO order_items_partitioned ({ITEM_COLUMNS})
+                        SELECT i.id, i.order_id, b.created_at, i.product_id, i.sku, i.name, i.price, i.qty, i.subtotal
+                        FROM order_items i JOIN batch b ON b.id = i.order_id
+                        ON CONFLICT (id, created_at) DO NOTHING
+                    )
+                    SELECT created_at, id FROM batch ORDER BY created_at DESC, id DESC LIMIT 1
+                    """
+                ),
+                {"created_at": last[0], "id": str(last[1])},
+            ).first()
+            if row is None:
+                break
+            last = (row[0], row[1])
+
+    # swap: the copies are complete and kept current by the triggers, so this only renames
+    op.execute("LOCK TABLE orders, order_items IN ACCESS EXCLUSIVE MODE")
+    op.execute("DROP TRIGGER order_items_partition_sync ON order_items")
+    op.execute("DROP TRIGGER orders_partition_sync ON orders")
+    op.execute("DROP FUNCTION order_items_partition_sync()")
+    op.execute("DROP FUNCTION orders_partition_sync()")
+    op.execute("DROP TABLE order_items")
+    op.execute("DROP TABLE orders")
+    op.execute("ALTER TABLE orders_partitioned RENAME TO orders")
+    op.execute("ALTER TABLE order_items_partitioned RENAME TO order_items")
+    for name, _, _ in INDEXES:
+        op.execute(f"ALTER INDEX {name}_p RENAME TO {name}")
+
+
+def downgrade() -> None:
+    # offline: plain tables again, with the rows still attached (archived partitions are not restored)
+    op.execute("ALTER TABLE order_items RENAME TO order_items_partitioned")
+    op.execute("ALTER TABLE orders RENAME TO orders_partitioned")
+    for name, _, _ in INDEXES:
+        op.execute(f"ALTER INDEX {name} RENAME TO {name}_p")
+    op.create_table(
+        "orders",
+        sa.Column("id", postgresql.UUID(as_uuid=True), primary_key=True),
+        sa.Column("user_email", sa.String(length=255), nullable=False),
+        sa.Column("status", sa.String(length=32), nullable=False, server_default="paid"),
+        sa.Column("total", sa.Numeric(12, 2), nullable=False, server_default="0"),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.text("CURRENT_TIMESTAMP"), nullable=False),
+        sa.Column("updated_at", sa.DateTime(timezone=True), server_default=sa.text("CURRENT_TIMESTAMP"), nullable=False),
+    )
+    op.create_table(
+        "order_items",
+        sa.Column("id", postgresql.UUID(as_uuid=True), primary_key=True),
+        sa.Column("order_id", postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column("product_id", postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column("sku", sa.String(length=64), nullable=False),
+        sa.Column("name", sa.String(length=255), nullable=False),
+        sa.Column("price", sa.Numeric(12, 2), nullable=False),
+        sa.Column("qty", sa.Integer(), nullable=False),
+        sa.Column("subtotal", sa.Numeric(12, 2), nullable=False),
+        sa.ForeignKeyConstraint(["order_id"], ["orders.id"], ondelete="CASCADE"),
+    )
+    op.execute(f"INSERT INTO orders ({ORDER_COLUMNS}) SELECT {ORDER_COLUMNS} FROM orders_partitioned")
+    op.execute(
+        "INSERT INTO order_items (id, order_id, product_id, sku, name, price, qty, subtotal) "
+        "SELECT id, order_id, product_id, sku, name, price, qty, subtotal FROM order_items_partitioned"
+    )
+    op.execute("DROP TABLE order_items_partitioned")
+    op.execute("DROP TABLE orders_partitioned")
+    for name, table, definition in INDEXES:
+        op.execute(f"CREATE INDEX {name} ON {table} {definition}")
@@ -0,0 +1,41 @@
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+revision = "0008_order_archives"
+down_revision = "0007_partition_orders"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # one row per monthly partition exported to a file by app.scripts.partitions
+    op.create_table(
+        "order_archives",
+        sa.Column("id", sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column("month", sa.Date(), nullable=False),
+        sa.Column("partition", sa.String(length=63), nullable=False),
+        sa.Column("file", sa.String(length=255), nullable=False, unique=True),
+        sa.Column("format", sa.String(length=16), nullable=False),
+        sa.Column("orders", sa.Integer(), nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.text("CURRENT_TIMESTAMP"), nullable=False),
+    )
+    # where an archived order is: its file and the compressed block / row group holding it
+    op.create_table(
+        "archived_orders",
+        sa.Column("id", postgresql.UUID(as_uuid=True), primary_key=True),
+        sa.Column("archive_id", sa.Integer(), sa.ForeignKey("order_archives.id", ondelete="CASCADE"), nullable=False),
+        sa.Column("user_email", sa.String(length=255), nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("block", sa.BigInteger(), nullable=False),
+    )
+    op.create_index("ix_archived_orders_archive_id", "archived_orders", ["archive_id"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_archived_orders_archive_id", table_name="archived_orders")
+    op.drop_table("archived_orders")
+    op.drop_table("order_archives")
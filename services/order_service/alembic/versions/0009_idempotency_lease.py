@@ -0,0 +1,23 @@
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0009_idempotency_lease"
+down_revision = "0008_order_archives"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # lease of an in_progress claim: renewed while the request runs, taken over by a duplicate once it lapses
+    op.add_column("idempotency_keys", sa.Column("attempts", sa.Integer(), nullable=False, server_default="1"))
+    op.add_column("idempotency_keys", sa.Column("locked_until", sa.DateTime(timezone=True), nullable=True))
+    # claims left by the previous version have no holder to renew them
+    op.execute("UPDATE idempotency_keys SET locked_until = CURRENT_TIMESTAMP WHERE state = 'in_progress'")
+
+
+def downgrade() -> None:
+    op.drop_column("idempotency_keys", "locked_until")
+    op.drop_column("idempotency_keys", "attempts")
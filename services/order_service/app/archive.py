@@ -0,0 +1,184 @@
+from __future__ import annotations
+
+import asyncio
+import gzip
+import json
+import os
+import uuid
+import zlib
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import Text, cast, column, func, select, table
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+
+from .config import settings
+from .models import ArchivedOrder, OrderArchive
+from .reads import order_json
+
+
+# Archive files of monthly partitions older than ORDERS_RETENTION_MONTHS, in ARCHIVE_DIR. Every
+# order is stored as the document GET /orders/{id} serves, so archived orders stay readable by id:
+# archived_orders maps the id to its file and block, and only that block is read.
+#   ndjson:  <partition>-<time>.ndjson.gz, one gzip member per ARCHIVE_BLOCK lines (the file is still
+#            plain gzip for zcat/zgrep); the block is the byte offset of the member
+#   parquet: <partition>-<time>.parquet (needs pyarrow), one row group per ARCHIVE_BLOCK orders,
+#            items as a JSON string column; the block is the row group number
+FORMATS = ("ndjson", "parquet")
+EXTENSIONS = {"ndjson": "ndjson.gz", "parquet": "parquet"}
+
+ORDER_COLUMNS = ("id", "user_email", "status", "total", "created_at", "updated_at")
+ITEM_COLUMNS = ("order_id", "created_at", "product_id", "sku", "name", "price", "qty", "subtotal")
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as e:
+        raise RuntimeError("the parquet archive format needs pyarrow (install the order-service[parquet] extra)") from e
+    return pyarrow, pyarrow.parquet
+
+
+class NdjsonWriter:
+    def __init__(self, path: str) -> None:
+        self.f = open(path, "wb")
+
+    def write_block(self, docs: List[str]) -> int:
+        offset = self.f.tell()
+        self.f.write(gzip.compress(("\n".join(docs) + "\n").encode(), mtime=0))
+        return offset
+
+    def close(self) -> None:
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.f.close()
+
+
+class ParquetWriter:
+    def __init__(self, path: str) -> None:
+        pa, pq = _pyarrow()
+        self.pa = pa
+        self.schema = pa.schema([(name, pa.string()) for name in ("id", "user", "status", "total", "created_at", "items")])
+        self.writer = pq.ParquetWriter(path, self.schema, compression="zstd")
+        self.groups = 0
+
+    def write_block(self, docs: List[str]) -> int:
+        rows = []
+        for doc in docs:
+            row = json.loads(doc)
+            row["items"] = json.dumps(row["items"], separators=(",", ":"))
+            rows.append(row)
+        self.writer.write_table(self.pa.Table.from_pylist(rows, schema=self.schema))
+        self.groups += 1
+        return self.groups - 1
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+WRITERS = {"ndjson": NdjsonWriter, "parquet": ParquetWriter}
+
+
+def path_of(file: str) -> str:
+    return os.path.join(settings.archive_dir, file)
+
+
+def _read_ndjson(path: str, offset: int, oid: str) -> Optional[bytes]:
+    decoder = zlib.decompressobj(wbits=31)
+    data = b""
+    with open(path, "rb") as f:
+        f.seek(offset)
+        # one gzip member: the decoder stops at its end
+        while not decoder.eof:
+            chunk = f.read(65536)
+            if not chunk:
+                break
+            data += decoder.decompress(chunk)
+    for line in data.splitlines():
+        if line and json.loads(line)["id"] == oid:
+            return line
+    return None
+
+
+def _read_parquet(path: str, group: int, oid: str) -> Optional[bytes]:
+    _, pq = _pyarrow()
+    for row in pq.ParquetFile(path).read_row_group(group).to_pylist():
+        if row["id"] == oid:
+            row["items"] = json.loads(row["items"])
+            return json.dumps(row).encode()
+    return None
+
+
+READERS = {"ndjson": _read_ndjson, "parquet": _read_parquet}
+
+
+async def find(session: AsyncSession, oid: uuid.UUID, user: Optional[str] = None) -> Optional[bytes]:
+    """An archived order as JSON (None if it is not archived, or belongs to someone other than `user`)."""
+    stmt = (
+        select(ArchivedOrder.block, OrderArchive.file, OrderArchive.format)
+        .join(OrderArchive, OrderArchive.id == ArchivedOrder.archive_id)
+        .where(ArchivedOrder.id == oid)
+    )
+    if user is not None:
+        stmt = stmt.where(ArchivedOrder.user_email == user)
+    row = (await session.execute(stmt)).first()
+    if row is None:
+        return None
+    block, file, fmt = row
+    return await asyncio.to_thread(READERS[fmt], path_of(file), block, str(oid))
+
+
+async def fingerprint(conn: AsyncConnection, orders_table: str) -> Tuple[int, Optional[datetime]]:
+    """(count, last update) of a partition: tells whether it changed after an export."""
+    t = table(orders_table, column("updated_at"))
+    count, last = (await conn.execute(select(func.count(), func.max(t.c.updated_at)).select_from(t))).one()
+    return int(count), last
+
+
+async def export(conn: AsyncConnection, orders_table: str, items_table: str, fmt: str) -> Tuple[str, List[Dict[str, Any]]]:
+    """Write the orders of one partition (and its items partition) to a new file in ARCHIVE_DIR.
+
+    Returns the file name (relative to ARCHIVE_DIR) and the archived_orders rows without archive_id.
+    The file appears under its final name only once it is complete.
+    """
+    os.makedirs(settings.archive_dir, exist_ok=True)
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+    file = f"{orders_table}-{stamp}.{EXTENSIONS[fmt]}"
+    tmp = path_of(file) + ".tmp"
+    o = table(orders_table, *(column(name) for name in ORDER_COLUMNS))
+    items = table(items_table, *(column(name) for name in ITEM_COLUMNS))
+    stmt = select(o.c.id, o.c.user_email, o.c.created_at, cast(order_json(o.c, items), Text)).order_by(
+        o.c.created_at, o.c.id
+    )
+    writer = await asyncio.to_thread(WRITERS[fmt], tmp)
+    index: List[Dict[str, Any]] = []
+    docs: List[str] = []
+    pending: List[Dict[str, Any]] = []
+
+    async def flush() -> None:
+        block = await asyncio.to_thread(writer.write_block, docs)
+        index.extend({**row, "block": block} for row in pending)
+        docs.clear()
+        pending.clear()
+
+    try:
+        result = await conn.stream(stmt)
+        async for oid, user, created_at, doc in result:
+            docs.append(doc)
+            pending.append({"id": oid, "user_email": user, "created_at": created_at})
+            if len(docs) >= settings.archive_block:
+                await flush()
+        if docs:
+            await flush()
+        await asyncio.to_thread(writer.close)
+        os.replace(tmp, path_of(file))
+    except BaseException:
+        try:
+            writer.close()
+        except Exception:
+            pass
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return file, index
@@ -1,3 +1,7 @@
+from importlib.util import find_spec
+from typing import Literal
+
+from pydantic import field_validator
 from pydantic_settings import BaseSettings
 
 
@@ -11,6 +15,50 @@ class Settings(BaseSettings):
     catalog_url: str = "http://catalog:8000"
     cart_url: str = "http://cart:8000"
 
+    # GET /orders and /admin/orders page size
+    orders_page_size_default: int = 20
+    orders_page_size_max: int = 100
+
+    # monthly partitions of orders/order_items: created ahead of time; older than the retention they are
+    # exported to ARCHIVE_DIR and detached by `python -m app.scripts.partitions`
+    orders_partitions_ahead: int = 3
+    orders_retention_months: int = 24
+    archive_dir: str = "/app/archive"
+    archive_format: Literal["ndjson", "parquet"] = "ndjson"
+    archive_block: int = 500
+
+    # asynchronous checkout (Prefer: respond-async): job queue in Postgres, worker tasks in this process
+    checkout_async: bool = False
+    checkout_workers: int = 4
+    checkout_queue_max: int = 10000
+    checkout_job_lease: int = 60
+    checkout_poll_interval: float = 0.5
+    checkout_long_poll_max: float = 25.0
+    checkout_job_ttl_hours: int = 24
+
+    # stock-release outbox: cancel stores the release, the relay sends due rows in batches with backoff
+    outbox_batch_size: int = 100
+    outbox_poll_interval: float = 1.0
+    outbox_lease: int = 30
+    outbox_timeout: float = 10.0
+    outbox_backoff_base: float = 1.0
+    outbox_backoff_max: float = 300.0
+    outbox_retention_hours: int = 168
+
+    # Idempotency-Key: how long responses are replayed, how long a duplicate waits for the first call,
+    # and the lease of a running call (renewed while it runs; a duplicate takes over a lapsed one)
+    idempotency_ttl_hours: int = 24
+    idempotency_wait_timeout: float = 10.0
+    idempotency_lease: int = 30
+
+    @field_validator("archive_format")
+    @classmethod
+    def _parquet_needs_pyarrow(cls, v: str) -> str:
+        # fail at startup rather than when the first month is archived
+        if v == "parquet" and find_spec("pyarrow") is None:
+            raise ValueError("ARCHIVE_FORMAT=parquet needs pyarrow (install the order-service[parquet] extra)")
+        return v
+
     class Config:
         env_file = ".env"
         env_file_encoding = "utf-8"
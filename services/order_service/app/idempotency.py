@@ -0,0 +1,276 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Optional
+
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response
+from sqlalchemy import delete, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from .config import settings
+from .db import AsyncSessionLocal
+from .models import IdempotencyKey
+
+
+logger = logging.getLogger("order.idempotency")
+
+# Idempotency-Key handling for unsafe endpoints (checkout, cancel):
+# - the first request with a key claims a row (state in_progress) and runs the operation;
+# - its response (2xx, or 4xx raised as HTTPException) is stored and replayed for the same key until it expires;
+# - a duplicate arriving while the first call runs waits for it instead of running the operation again;
+# - 5xx and unexpected errors drop the claim, so a retry runs the operation again;
+# - the claim is leased (IDEMPOTENCY_LEASE) and renewed while the operation runs. A call that cannot renew
+#   its lease stops the operation before the lease lapses; a duplicate takes over a claim whose lease lapsed
+#   a full lease ago (its worker died), so the key is never stuck in_progress until it expires. The attempt
+#   number identifies the holder: only it can store or drop the claim.
+# Bookkeeping uses its own sessions and commits: the claim must be visible to other workers before the
+# operation starts, and must not be rolled back with the operation's transaction.
+MAX_KEY_LENGTH = 255
+REPLAY_HEADER = "Idempotent-Replayed"
+
+
+def fingerprint(method: str, path: str, body: bytes = b"") -> str:
+    return hashlib.sha256(b"\n".join([method.upper().encode(), path.encode(), body])).hexdigest()
+
+
+def validate_key(key: str) -> str:
+    key = key.strip()
+    if not key or len(key) > MAX_KEY_LENGTH or not key.isprintable():
+        raise HTTPException(status_code=400, detail=f"Idempotency-Key must be 1..{MAX_KEY_LENGTH} printable characters")
+    return key
+
+
+def replay(row: IdempotencyKey) -> JSONResponse:
+    return JSONResponse(content=row.response, status_code=row.status_code or 200, headers={REPLAY_HEADER: "true"})
+
+
+async def _claim(scope: str, key: str, fp: str) -> tuple[Optional[int], Optional[IdempotencyKey]]:
+    """Claim the key. Returns (attempt, None) when claimed, otherwise (None, the existing live row)."""
+    now = datetime.now(timezone.utc)
+    lease = timedelta(seconds=settings.idempotency_lease)
+    async with AsyncSessionLocal() as session:
+        # an expired row is as good as none
+        await session.execute(
+            delete(IdempotencyKey).where(
+                IdempotencyKey.scope == scope, IdempotencyKey.key == key, IdempotencyKey.expires_at <= now
+            )
+        )
+        res = await session.execute(
+            pg_insert(IdempotencyKey)
+            .values(
+                scope=scope,
+                key=key,
+                fingerprint=fp,
+                state="in_progress",
+                attempts=1,
+                locked_until=now + lease,
+                expires_at=now + timedelta(hours=settings.idempotency_ttl_hours),
+            )
+            .on_conflict_do_nothing(index_elements=[IdempotencyKey.scope, IdempotencyKey.key])
+            .returning(IdempotencyKey.attempts)
+        )
+        attempt = res.scalar_one_or_none()
+        if attempt is None:
+            # take over a claim whose holder died: one lease past expiry it has stopped for sure
+            res = await session.execute(
+                update(IdempotencyKey)
+                .where(
+                    IdempotencyKey.scope == scope,
+                    IdempotencyKey.key == key,
+                    IdempotencyKey.fingerprint == fp,
+                    IdempotencyKey.state == "in_progress",
+                    IdempotencyKey.locked_until < now - lease,
+                )
+                .values(attempts=IdempotencyKey.attempts + 1, locked_until=now + lease)
+                .returning(IdempotencyKey.attempts)
+            )
+            attempt = res.scalar_one_or_none()
+            if attempt is not None:
+                logger.warning("idempotency claim %s/%s lapsed; taking it over (attempt %s)", scope, key, attempt)
+        await session.commit()
+        if attempt is not None:
+            return attempt, None
+        return None, (
+            await session.execute(
+                select(IdempotencyKey).where(IdempotencyKey.scope == scope, IdempotencyKey.key == key)
+            )
+        ).scalar_one_or_none()
+
+
+async def _load(scope: str, key: str) -> Optional[IdempotencyKey]:
+    async with AsyncSessionLocal() as session:
+        return (
+            await session.execute(
+                select(IdempotencyKey).where(IdempotencyKey.scope == scope, IdempotencyKey.key == key)
+            )
+        ).scalar_one_or_none()
+
+
+def _held(scope: str, key: str, attempt: int):
+    return (
+        IdempotencyKey.scope == scope,
+        IdempotencyKey.key == key,
+        IdempotencyKey.attempts == attempt,
+        IdempotencyKey.state == "in_progress",
+    )
+
+
+async def _store(scope: str, key: str, attempt: int, status_code: int, response: Any) -> None:
+    async with AsyncSessionLocal() as session:
+        res = await session.execute(
+            update(IdempotencyKey)
+            .where(*_held(scope, key, attempt))
+            .values(state="done", status_code=status_code, response=response, locked_until=None)
+        )
+        await session.commit()
+    if not res.rowcount:
+        logger.error("idempotency claim %s/%s was taken over; response of attempt %s not stored", scope, key, attempt)
+
+
+async def _release(scope: str, key: str, attempt: int) -> None:
+    try:
+        async with AsyncSessionLocal() as session:
+            await session.execute(delete(IdempotencyKey).where(*_held(scope, key, attempt)))
+            await session.commit()
+    except Exception as e:
+        # the claim then blocks retries of this key until its lease lapses and a retry takes it over
+        logger.error("could not drop idempotency claim %s/%s: %s", scope, key, e)
+
+
+async def _heartbeat(scope: str, key: str, attempt: int, operation: asyncio.Task) -> bool:
+    """Renew the lease while the operation runs; stop the operation when the lease is lost or about to lapse.
+
+    Returns True when it cancelled the operation.
+    """
+    lease = settings.idempotency_lease
+    loop = asyncio.get_running_loop()
+    renewed = loop.time()
+    while True:
+        await asyncio.sleep(lease / 3)
+        try:
+            async with AsyncSessionLocal() as session:
+                res = await session.execute(
+                    update(IdempotencyKey)
+                    .where(*_held(scope, key, attempt))
+                    .values(locked_until=datetime.now(timezone.utc) + timedelta(seconds=lease))
+                )
+                await session.commit()
+            if res.rowcount:
+                renewed = loop.time()
+                continue
+            logger.error("idempotency claim %s/%s lost its lease; stopping the request", scope, key)
+        except Exception as e:
+            logger.warning("could not renew idempotency claim %s/%s: %s", scope, key, e)
+            if loop.time() - renewed < lease * 2 / 3:
+                continue
+            logger.error("idempotency claim %s/%s: lease about to lapse; stopping the request", scope, key)
+        operation.cancel()
+        return True
+
+
+async def _wait(scope: str, key: str) -> Optional[IdempotencyKey]:
+    """Poll until the first call finishes.
+
+    Returns the finished row, or None when the claim was dropped or its holder died (the caller claims it).
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + settings.idempotency_wait_timeout
+    delay = 0.05
+    while loop.time() < deadline:
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 0.5)
+        row = await _load(scope, key)
+        if row is None:
+            return None
+        if row.state == "done":
+            return row
+        lapsed = datetime.now(timezone.utc) - timedelta(seconds=settings.idempotency_lease)
+        if row.locked_until is not None and row.locked_until < lapsed:
+            return None
+    raise HTTPException(
+        status_code=409,
+        detail="A request with this Idempotency-Key is still in progress",
+        headers={"Retry-After": "1"},
+    )
+
+
+async def run(
+    scope: str,
+    key: Optional[str],
+    fp: str,
+    operation: Callable[[], Awaitable[Any]],
+) -> Any:
+    """Run `operation` at most once per (scope, key); requests without a key run it unconditionally."""
+    if key is None:
+        return await operation()
+    key = validate_key(key)
+    while True:
+        attempt, row = await _claim(scope, key, fp)
+        if attempt is not None:
+            break
+        if row is None:
+            # dropped between the insert and the read: claim again
+            continue
+        if row.fingerprint != fp:
+            raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+        if row.state != "done":
+            row = await _wait(scope, key)
+            if row is None:
+                # the first call failed and dropped its claim, or died: try to take it over
+                continue
+        return replay(row)
+
+    task = asyncio.create_task(operation())
+    heartbeat = asyncio.create_task(_heartbeat(scope, key, attempt, task))
+    try:
+        try:
+            result = await task
+        except asyncio.CancelledError:
+            if not (heartbeat.done() and not heartbeat.cancelled() and heartbeat.result()):
+                raise
+            # stopped by the heartbeat: the claim may belong to a retry by now
+            raise HTTPException(status_code=503, detail="Request was interrupted, please try again")
+    except HTTPException as e:
+        if e.status_code < 500:
+            await asyncio.shield(_store(scope, key, attempt, e.status_code, {"detail": jsonable_encoder(e.detail)}))
+        else:
+            await asyncio.shield(_release(scope, key, attempt))
+        raise
+    except BaseException:
+        await asyncio.shield(_release(scope, key, attempt))
+        raise
+    finally:
+        heartbeat.cancel()
+        task.cancel()
+    if isinstance(result, Response):
+        # e.g. 202 Accepted of an asynchronous checkout; JSON bodies only
+        await asyncio.shield(_store(scope, key, attempt, result.status_code, json.loads(result.body)))
+    else:
+        await asyncio.shield(_store(scope, key, attempt, 200, jsonable_encoder(result)))
+    return result
+
+
+async def purge_expired() -> int:
+    async with AsyncSessionLocal() as session:
+        res = await session.execute(
+            delete(IdempotencyKey).where(IdempotencyKey.expires_at <= datetime.now(timezone.utc))
+        )
+        await session.commit()
+        return res.rowcount or 0
+
+
+async def purge_loop(interval: float = 3600.0) -> None:
+    while True:
+        try:
+            removed = await purge_expired()
+            if removed:
+                logger.info("purged %s expired idempotency keys", removed)
+        except Exception as e:
+            logger.warning("idempotency key purge failed: %s", e)
+        await asyncio.sleep(interval)
@@ -0,0 +1,358 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import and_, delete, func, or_, select, update
+
+from .config import settings
+from .db import AsyncSessionLocal
+from .models import CheckoutJob
+
+
+logger = logging.getLogger("order.jobs")
+
+# Asynchronous checkout: the request only inserts a job row and answers 202; a pool of worker tasks
+# takes jobs oldest first with SELECT ... FOR UPDATE SKIP LOCKED (several replicas share one queue) and
+# runs the regular checkout, at most CHECKOUT_WORKERS at a time per process, so a burst of buyers waits
+# in the table instead of holding connections through the catalog fan-out.
+# A running job holds a lease (locked_until), renewed every third of CHECKOUT_JOB_LEASE while the handler
+# runs; a job whose lease expired (its worker died) is picked up again and handed to the handler with
+# attempts > 1, which must not blindly repeat side effects. The attempt number identifies the lease
+# holder: only it can store the result. A worker that cannot renew its lease stops the run before the
+# lease expires, and an expired job is handed out again only a full lease later, so by then its
+# previous run is known to be over.
+Handler = Callable[[CheckoutJob], Awaitable[Any]]
+
+FINISHED = ("done", "failed")
+
+
+def status_url(job_id: uuid.UUID) -> str:
+    return f"/orders/checkout/jobs/{job_id}"
+
+
+def describe(job: CheckoutJob, position: Optional[int] = None) -> Dict[str, Any]:
+    out: Dict[str, Any] = {"id": str(job.id), "status": job.status, "status_url": status_url(job.id)}
+    if job.status == "queued" and position is not None:
+        out["position"] = position
+    if job.status in FINISHED:
+        out["status_code"] = job.status_code
+        if job.status == "done":
+            out["order"] = job.result
+        else:
+            out["detail"] = (job.result or {}).get("detail")
+    return out
+
+
+class CheckoutQueue:
+    def __init__(self) -> None:
+        self.handler: Optional[Handler] = None
+        self._workers: List[asyncio.Task] = []
+        self._purger: Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()
+        self._finished: Dict[uuid.UUID, asyncio.Event] = {}
+        self.busy = 0
+        self.processed = 0
+        self.failed = 0
+        # (queue wait, run time) in seconds of the most recent jobs run by this process
+        self._latency: Deque[Tuple[float, float]] = deque(maxlen=1000)
+
+    # --- producer side -------------------------------------------------------------------------
+
+    async def enqueue(self, user: str) -> CheckoutJob:
+        async with AsyncSessionLocal() as session:
+            depth = await session.scalar(
+                select(func.count()).select_from(CheckoutJob).where(CheckoutJob.status == "queued")
+            )
+            if depth >= settings.checkout_queue_max:
+                raise HTTPException(status_code=503, detail="Checkout queue is full", headers={"Retry-After": "5"})
+            job = CheckoutJob(id=uuid.uuid4(), user_email=user, status="queued", created_at=datetime.now(timezone.utc))
+            session.add(job)
+            await session.commit()
+        self._wakeup.set()
+        return job
+
+    async def get(self, job_id: uuid.UUID) -> Tuple[Optional[CheckoutJob], Optional[int]]:
+        """The job and, while it is queued, the number of jobs ahead of it."""
+        async with AsyncSessionLocal() as session:
+            job = await session.get(CheckoutJob, job_id)
+            if job is None or job.status != "queued":
+                return job, None
+            ahead = await session.scalar(
+                select(func.count())
+                .select_from(CheckoutJob)
+                .where(CheckoutJob.status == "queued", CheckoutJob.created_at < job.created_at)
+            )
+            return job, int(ahead or 0)
+
+    async def wait(self, job_id: uuid.UUID, timeout: float) -> Tuple[Optional[CheckoutJob], Optional[int]]:
+        """Long poll: return as soon as the job is finished, or its current state after `timeout` seconds.
+
+        Jobs finished by this process wake the waiter at once; others are noticed by polling.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        event = self._finished.setdefault(job_id, asyncio.Event())
+        delay = 0.1
+        try:
+            while True:
+                job, position = await self.get(job_id)
+                remaining = deadline - loop.time()
+                if job is None or job.status in FINISHED or remaining <= 0:
+                    return job, position
+                try:
+                    await asyncio.wait_for(event.wait(), min(delay, remaining))
+                except asyncio.TimeoutError:
+                    pass
+                delay = min(delay * 2, 1.0)
+        finally:
+            if not event.is_set():
+                self._finished.pop(job_id, None)
+
+    # --- consumer side -------------------------------------------------------------------------
+
+    def start(self, handler: Handler, workers: int) -> None:
+        self.handler = handler
+        self._workers = [asyncio.create_task(self._worker(i)) for i in range(workers)]
+        self._purger = asyncio.create_task(self._purge_loop())
+        logger.info("checkout queue: %s workers started", workers)
+
+    async def stop(self) -> None:
+        tasks = [*self._workers, *([self._purger] if self._purger else [])]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers = []
+
+    async def _claim(self) -> Optional[CheckoutJob]:
+        now = func.now()
+        pending = (
+            select(CheckoutJob.id)
+            .where(
+                CheckoutJob.status.in_(("queued", "running")),
+                or_(
+                    CheckoutJob.status == "queued",
+                    # a full lease past expiry: its worker stopped the run at the latest when the lease expired
+                    and_(
+                        CheckoutJob.status == "running",
+                        CheckoutJob.locked_until < now - timedelta(seconds=settings.checkout_job_lease),
+                    ),
+                ),
+            )
+            .order_by(CheckoutJob.created_at)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+            .scalar_subquery()
+        )
+        async with AsyncSessionLocal() as session:
+            res = await session.execute(
+                update(CheckoutJob)
+                .where(CheckoutJob.id == pending)
+                .values(
+                    status="running",
+                    started_at=now,
+                    attempts=CheckoutJob.attempts + 1,
+                    locked_until=now + timedelta(seconds=settings.checkout_job_lease),
+                )
+                .returning(CheckoutJob)
+                .execution_options(synchronize_session=False)
+            )
+            job = res.scalar_one_or_none()
+            await session.commit()
+            return job
+
+    async def _finish(self, job: CheckoutJob, status: str, status_code: int, result: Any) -> bool:
+        """Store the outcome; False if the job was handed to another worker meanwhile (lease lost)."""
+        async with AsyncSessionLocal() as session:
+            res = await session.execute(
+                update(CheckoutJob)
+                .where(CheckoutJob.id == job.id, CheckoutJob.attempts == job.attempts, CheckoutJob.status == "running")
+                .values(status=status, status_code=status_code, result=result, finished_at=func.now(), locked_until=None)
+                .execution_options(synchronize_session=False)
+            )
+            await session.commit()
+        if not res.rowcount:
+            logger.warning("checkout job %s attempt %s lost its lease; result discarded", job.id, job.attempts)
+            return False
+        event = self._finished.pop(job.id, None)
+        if event is not None:
+            event.set()
+        return True
+
+    async def _heartbeat(self, job: CheckoutJob, handler: asyncio.Task) -> bool:
+        """Keep the lease of a running job, so a checkout slower than the lease is not handed out again.
+
+        If the lease is lost, or could not be renewed for two thirds of it (it would expire before the
+        next try), the handler is cancelled: once a job is handed out again, its previous run is over.
+        Returns True when it cancelled the handler.
+        """
+        lease = settings.checkout_job_lease
+        loop = asyncio.get_running_loop()
+        renewed = loop.time()
+        while True:
+            await asyncio.sleep(lease / 3)
+            try:
+                async with AsyncSessionLocal() as session:
+                    res = await session.execute(
+                        update(CheckoutJob)
+                        .where(CheckoutJob.id == job.id, CheckoutJob.attempts == job.attempts, CheckoutJob.status == "running")
+                        .values(locked_until=func.now() + timedelta(seconds=lease))
+                        .execution_options(synchronize_session=False)
+                    )
+                    await session.commit()
+                if res.rowcount:
+                    renewed = loop.time()
+                    continue
+                logger.error("checkout job %s lost its lease; stopping this run", job.id)
+            except Exception as e:
+                logger.warning("could not renew the lease of checkout job %s: %s", job.id, e)
+                if loop.time() - renewed < lease * 2 / 3:
+                    continue
+                logger.error("checkout job %s: lease about to expire; stopping this run", job.id)
+            handler.cancel()
+            return True
+
+    async def _worker(self, n: int) -> None:
+        while True:
+            try:
+                job = await self._claim()
+            except Exception as e:
+                logger.warning("checkout worker %s could not claim a job: %s", n, e)
+                await asyncio.sleep(settings.checkout_poll_interval)
+                continue
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), settings.checkout_poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._run(job)
+
+    async def _run(self, job: CheckoutJob) -> None:
+        started = time.perf_counter()
+        waited = max((datetime.now(timezone.utc) - job.created_at).total_seconds(), 0.0)
+        self.busy += 1
+        handler = asyncio.create_task(self.handler(job))
+        heartbeat = asyncio.create_task(self._heartbeat(job, handler))
+        try:
+            result = await handler
+            outcome = ("done", 200, jsonable_encoder(result))
+        except HTTPException as e:
+            outcome = ("failed", e.status_code, {"detail": jsonable_encoder(e.detail)})
+        except asyncio.CancelledError:
+            if heartbeat.done() and not heartbeat.cancelled() and heartbeat.result():
+                # fenced by the heartbeat: the job belongs to another worker now, which stores the result
+                return
+            # shutdown: the checkout rolled back and released its stock; the buyer may try again
+            await asyncio.shield(self._finish(job, "failed", 503, {"detail": "Checkout was interrupted, please try again"}))
+            raise
+        except Exception:
+            logger.exception("checkout job %s failed", job.id)
+            outcome = ("failed", 500, {"detail": "Checkout failed"})
+        finally:
+            heartbeat.cancel()
+            handler.cancel()
+            self.busy -= 1
+        ran = time.perf_counter() - started
+        try:
+            stored = await self._finish(job, *outcome)
+        except Exception as e:
+            # the lease expires and the job is handed out again (attempts > 1)
+            logger.error("could not store the result of checkout job %s: %s", job.id, e)
+            return
+        if not stored:
+            return
+        self.processed += 1
+        if outcome[0] == "failed":
+            self.failed += 1
+        self._latency.append((waited, ran))
+        logger.info("checkout job %s %s (%s) waited %.3fs ran %.3fs", job.id, outcome[0], outcome[1], waited, ran)
+
+    async def _purge_loop(self, interval: float = 3600.0) -> None:
+        while True:
+            try:
+                async with AsyncSessionLocal() as session:
+                    cutoff = datetime.now(timezone.utc) - timedelta(hours=settings.checkout_job_ttl_hours)
+                    await session.execute(
+                        delete(CheckoutJob).where(CheckoutJob.status.in_(FINISHED), CheckoutJob.finished_at < cutoff)
+                    )
+                    await session.commit()
+            except Exception as e:
+                logger.warning("checkout job purge failed: %s", e)
+            await asyncio.sleep(interval)
+
+    # --- metrics -------------------------------------------------------------------------------
+
+    async def metrics(self, window_minutes: int = 15) -> Dict[str, Any]:
+        """Queue depth and job latency: table-wide numbers from Postgres, plus this process's workers."""
+        since = datetime.now(timezone.utc) - timedelta(minutes=window_minutes)
+        latency = func.extract("epoch", CheckoutJob.finished_at - CheckoutJob.created_at)
+        async with AsyncSessionLocal() as session:
+            depth = dict(
+                (
+                    await session.execute(
+                        select(CheckoutJob.status, func.count())
+                        .where(CheckoutJob.status.in_(("queued", "running")))
+                        .group_by(CheckoutJob.status)
+                    )
+                ).all()
+            )
+            oldest = await session.scalar(
+                select(func.min(CheckoutJob.created_at)).where(CheckoutJob.status == "queued")
+            )
+            finished = (
+                await session.execute(
+                    select(
+                        func.count(),
+                        func.count().filter(CheckoutJob.status == "failed"),
+                        func.percentile_cont(0.5).within_group(latency),
+                        func.percentile_cont(0.95).within_group(latency),
+                        func.max(latency),
+                    ).where(CheckoutJob.finished_at >= since)
+                )
+            ).one()
+        now = datetime.now(timezone.utc)
+        recent = list(self._latency)
+        return {
+            "queued": int(depth.get("queued", 0)),
+            "running": int(depth.get("running", 0)),
+            "oldest_queued_seconds": round((now - oldest).total_seconds(), 3) if oldest else 0.0,
+            "finished": {
+                "window_minutes": window_minutes,
+                "count": int(finished[0]),
+                "failed": int(finished[1]),
+                "latency_p50_seconds": _round(finished[2]),
+                "latency_p95_seconds": _round(finished[3]),
+                "latency_max_seconds": _round(finished[4]),
+            },
+            "workers": {
+                "count": len(self._workers),
+                "busy": self.busy,
+                "processed": self.processed,
+                "failed": self.failed,
+                "wait_p95_seconds": _percentile([w for w, _ in recent], 0.95),
+                "run_p95_seconds": _percentile([r for _, r in recent], 0.95),
+            },
+        }
+
+
+def _round(value: Any) -> Optional[float]:
+    return round(float(value), 3) if value is not None else None
+
+
+def _percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(int(q * len(values)), len(values) - 1)], 3)
+
+
+queue = CheckoutQueue()
@@ -1,24 +1,31 @@
 from __future__ import annotations
 
-from typing import Dict
-from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+import asyncio
+import logging
 import uuid
 
 import httpx
-from fastapi import FastAPI, Depends, HTTPException, Query
+from fastapi import BackgroundTasks, FastAPI, Depends, Header, HTTPException, Query, Response
+from fastapi.responses import JSONResponse
 from fastapi.security import OAuth2PasswordBearer
 from jose import jwt, JWTError
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import insert, select, func, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.orm import selectinload
 
+from . import archive, idempotency, jobs, outbox, pagination, partitions, reads, rollups
 from .config import settings
-from .db import get_session, health_check
-from .models import Base, Order, OrderItem
-from .schemas import OrderOut
+from .db import AsyncSessionLocal, get_session, health_check
+from .models import ArchivedOrder, Base, CheckoutJob, Order, OrderItem, ProductSalesDaily, SalesDaily
+from .schemas import LegacyOrderImport, OrderOut
 
 
 app = FastAPI(title=settings.app_name)
+logger = logging.getLogger("order")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
 
 
@@ -35,16 +42,52 @@ def mint_admin_token() -> str:
     return jwt.encode(payload, settings.secret_key, algorithm="HS256")
 
 
+def mint_user_token(user: str) -> str:
+    """Short-lived token of a buyer, for cart calls made by checkout workers on their behalf."""
+    expire = datetime.now(timezone.utc) + timedelta(minutes=5)
+    return jwt.encode({"sub": user, "exp": expire}, settings.secret_key, algorithm="HS256")
+
+
 def require_admin(payload: dict):
     if payload.get("role") != "admin":
         raise HTTPException(status_code=403, detail="Admin required")
 
 
+@app.on_event("startup")
+async def on_startup():
+    app.state.idempotency_purger = asyncio.create_task(idempotency.purge_loop())
+    app.state.partition_keeper = asyncio.create_task(partitions.keep_ahead_loop())
+    outbox.relay.start(mint_admin_token)
+    if settings.checkout_async and settings.checkout_workers > 0:
+        jobs.queue.start(process_checkout_job, settings.checkout_workers)
+
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    app.state.idempotency_purger.cancel()
+    app.state.partition_keeper.cancel()
+    await jobs.queue.stop()
+    await outbox.relay.stop()
+
+
 @app.get("/health")
 async def health():
     return {"status": "ok", "db": await health_check()}
 
 
+def order_doc(o: Order) -> dict:
+    """Order as consumed by rollups.apply."""
+    return {
+        "created_at": o.created_at,
+        "user": o.user_email,
+        "total": o.total,
+        "items": [
+            {"product_id": it.product_id, "sku": it.sku, "name": it.name, "qty": it.qty, "subtotal": it.subtotal}
+            for it in o.items
+        ],
+    }
+
+
 def serialize_order(o: Order) -> OrderOut:
     return OrderOut(
         id=o.id,
@@ -66,56 +109,270 @@ def serialize_order(o: Order) -> OrderOut:
     )
 
 
-@app.get("/orders")
-async def list_orders(token: str = Depends(oauth2_scheme), session: AsyncSession = Depends(get_session)):
+async def order_page(session: AsyncSession, conds: list, limit: int, cursor: str | None) -> Response:
+    """One page of orders (newest first) matching `conds`, JSON built by Postgres; X-Next-Cursor when there are more."""
+    body, next_cursor = await reads.order_page(session, conds, limit, cursor)
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+@app.get("/orders", response_model=List[OrderOut])
+async def list_orders(
+    token: str = Depends(oauth2_scheme),
+    session: AsyncSession = Depends(get_session),
+    limit: int = Query(default=settings.orders_page_size_default, ge=1, le=settings.orders_page_size_max),
+    cursor: str | None = Query(default=None),
+    date_from: date | None = Query(default=None),
+    date_to: date | None = Query(default=None),
+):
+    """Orders of the current user, newest first; the next page is requested with the X-Next-Cursor value."""
     payload = decode_token(token)
     user = payload.get("sub")
     if not user:
         raise HTTPException(status_code=401, detail="Invalid token subject")
-    res = await session.execute(
-        select(Order)
-        .options(selectinload(Order.items))
-        .where(Order.user_email == user)
-        .order_by(Order.created_at.desc())
-    )
-    orders = res.scalars().unique().all()
-    return [serialize_order(o) for o in orders]
+    conds = [Order.user_email == user, *pagination.date_range(date_from, date_to)]
+    return await order_page(session, conds, limit, cursor)
 
 
-@app.get("/orders/{oid}")
+@app.get("/orders/{oid}", response_model=OrderOut)
 async def get_order(oid: uuid.UUID, token: str = Depends(oauth2_scheme), session: AsyncSession = Depends(get_session)):
     payload = decode_token(token)
     user = payload.get("sub")
     if not user:
         raise HTTPException(status_code=401, detail="Invalid token subject")
-    o = await session.get(Order, oid, options=[selectinload(Order.items)])
-    if not o or o.user_email != user:
+    body = await reads.order(session, oid, user=user)
+    if body is None:
+        # orders of archived months are read from their archive file
+        body = await archive.find(session, oid, user=user)
+    if body is None:
         raise HTTPException(status_code=404, detail="Order not found")
-    return serialize_order(o)
+    return Response(content=body, media_type="application/json")
 
 
-@app.get("/admin/orders")
+@app.get("/admin/orders", response_model=List[OrderOut])
 async def admin_list_orders(
     token: str = Depends(oauth2_scheme),
     session: AsyncSession = Depends(get_session),
     status: str | None = Query(default=None),
     email: str | None = Query(default=None),
+    email_prefix: str | None = Query(default=None, min_length=1, max_length=255),
+    date_from: date | None = Query(default=None),
+    date_to: date | None = Query(default=None),
+    limit: int = Query(default=settings.orders_page_size_default, ge=1, le=settings.orders_page_size_max),
+    cursor: str | None = Query(default=None),
 ):
+    """Order search: exact `email` or `email_prefix`, `status`, [date_from, date_to] in UTC days; keyset-paginated."""
     payload = decode_token(token)
     require_admin(payload)
-    stmt = select(Order).options(selectinload(Order.items)).order_by(Order.created_at.desc())
+    conds = pagination.date_range(date_from, date_to)
     if status:
-        stmt = stmt.where(Order.status == status)
+        conds.append(Order.status == status)
     if email:
-        stmt = stmt.where(Order.user_email == email)
-    res = await session.execute(stmt)
-    orders = res.scalars().unique().all()
-    return [serialize_order(o) for o in orders]
+        conds.append(Order.user_email == email)
+    if email_prefix:
+        conds.append(pagination.email_prefix(email_prefix))
+    return await order_page(session, conds, limit, cursor)
+
+
+# ids of legacy cart-service orders are not always UUIDs; map them deterministically
+LEGACY_NAMESPACE = uuid.UUID("6f1c1f3e-8d0a-4b5e-9a57-0c3f2d1b7a41")
+
+
+def legacy_uuid(raw: str) -> uuid.UUID:
+    try:
+        return uuid.UUID(str(raw))
+    except ValueError:
+        return uuid.uuid5(LEGACY_NAMESPACE, str(raw))
+
+
+@app.post("/admin/orders/import")
+async def admin_import_orders(
+    body: LegacyOrderImport,
+    token: str = Depends(oauth2_scheme),
+    session: AsyncSession = Depends(get_session),
+):
+    """Bulk import of legacy orders kept in cart-service Redis. Orders that already exist are skipped,
+    so an interrupted migration can simply be run again."""
+    payload = decode_token(token)
+    require_admin(payload)
+    now = datetime.now(timezone.utc)
+    ids = {}
+    rows = []
+    items = {}
+    for o in body.orders:
+        oid = legacy_uuid(o.id)
+        if oid in items:
+            continue
+        ids[o.id] = oid
+        lines = []
+        for it in o.items:
+            subtotal = it.subtotal if it.subtotal is not None else it.price * it.qty
+            lines.append({
+                "order_id": oid,
+                "product_id": legacy_uuid(it.product_id),
+                "sku": it.sku[:64],
+                "name": it.name[:255],
+                "price": it.price,
+                "qty": it.qty,
+                "subtotal": subtotal,
+            })
+        total = o.total if o.total is not None else sum((line["subtotal"] for line in lines), Decimal(0))
+        created = o.created_at or now
+        # items share the order's created_at (and so its monthly partition)
+        for line in lines:
+            line["created_at"] = created
+        items[oid] = lines
+        rows.append({
+            "id": oid,
+            "user_email": o.user,
+            "status": o.status[:32],
+            "total": total,
+            "created_at": created,
+            "updated_at": created,
+        })
+    # the table key is (id, created_at) since partitioning, and archived orders are no longer in it:
+    # known ids are looked up first, so a re-import with another created_at cannot duplicate an order
+    known = set(
+        (await session.execute(select(Order.id).where(Order.id.in_(list(items))))).scalars().all()
+    ) | set(
+        (await session.execute(select(ArchivedOrder.id).where(ArchivedOrder.id.in_(list(items))))).scalars().all()
+    )
+    rows = [row for row in rows if row["id"] not in known]
+    inserted = set()
+    if rows:
+        # old orders may fall into months without a partition yet
+        await partitions.ensure(partitions.month_of(row["created_at"]) for row in rows)
+        res = await session.execute(
+            pg_insert(Order)
+            .values(rows)
+            .on_conflict_do_nothing(index_elements=[Order.id, Order.created_at])
+            .returning(Order.id)
+        )
+        inserted = set(res.scalars().all())
+    lines = [line for oid in inserted for line in items[oid]]
+    if lines:
+        await session.execute(insert(OrderItem), lines)
+    await rollups.apply(
+        session,
+        [
+            {"created_at": row["created_at"], "user": row["user_email"], "total": row["total"], "items": items[row["id"]]}
+            for row in rows
+            if row["id"] in inserted and row["status"] != "canceled"
+        ],
+    )
+    await session.commit()
+    return {
+        "imported": len(inserted),
+        "skipped": len(items) - len(inserted),
+        "ids": {legacy: str(oid) for legacy, oid in ids.items()},
+    }
+
+
+@app.get("/admin/stats")
+async def admin_stats(
+    token: str = Depends(oauth2_scheme),
+    session: AsyncSession = Depends(get_session),
+    date_from: date | None = Query(default=None),
+    date_to: date | None = Query(default=None),
+    top: int = Query(default=5, ge=1, le=100),
+    days: int = Query(default=7, ge=1, le=366),
+):
+    payload = decode_token(token)
+    require_admin(payload)
+    # read from the daily rollups (canceled orders are already subtracted); window is [date_from, date_to] in UTC days
+    day_conds = []
+    product_conds = []
+    if date_from:
+        day_conds.append(SalesDaily.day >= date_from)
+        product_conds.append(ProductSalesDaily.day >= date_from)
+    if date_to:
+        day_conds.append(SalesDaily.day <= date_to)
+        product_conds.append(ProductSalesDaily.day <= date_to)
+
+    # totals and the union of the daily HyperLogLog sketches are aggregated in SQL, so an unbounded
+    # window returns one row (and 2**HLL_P registers) however long the shop's history is
+    total_orders, total_revenue = (
+        await session.execute(
+            select(
+                func.coalesce(func.sum(SalesDaily.order_count), 0),
+                func.coalesce(func.sum(SalesDaily.revenue), Decimal(0)),
+            ).where(*day_conds)
+        )
+    ).one()
+    registers = await rollups.buyers_union(session, day_conds)
+    unique_buyers = rollups.hll_estimate(registers) if registers else 0
+
+    revenue = func.sum(ProductSalesDaily.revenue)
+    qty = func.sum(ProductSalesDaily.qty)
+    top_rows = (
+        await session.execute(
+            select(
+                ProductSalesDaily.product_id,
+                func.max(ProductSalesDaily.name),
+                func.max(ProductSalesDaily.sku),
+                qty,
+                revenue,
+            )
+            .where(*product_conds)
+            .group_by(ProductSalesDaily.product_id)
+            .having(qty > 0)
+            .order_by(revenue.desc(), qty.desc())
+            .limit(top)
+        )
+    ).all()
+
+    # daily series for the last `days` days of the window (UTC dates)
+    end_day = date_to or datetime.now(timezone.utc).date()
+    start_day = end_day - timedelta(days=days - 1)
+    if date_from and date_from > start_day:
+        start_day = date_from
+    series_rows = (
+        await session.execute(
+            select(SalesDaily.day, SalesDaily.order_count, SalesDaily.revenue).where(
+                SalesDaily.day >= start_day, SalesDaily.day <= end_day
+            )
+        )
+    ).all()
+    by_day = {d: (int(c), float(r)) for d, c, r in series_rows}
+    series = []
+    d = start_day
+    while d <= end_day:
+        count, rev = by_day.get(d, (0, 0.0))
+        series.append({"date": d.isoformat(), "count": count, "revenue": round(rev, 2)})
+        d += timedelta(days=1)
+
+    return {
+        "date_from": date_from.isoformat() if date_from else None,
+        "date_to": date_to.isoformat() if date_to else None,
+        "total_orders": int(total_orders),
+        "total_revenue": round(float(total_revenue), 2),
+        "unique_buyers": unique_buyers,
+        "unique_buyers_approximate": True,
+        "top_products": [
+            {"product_id": str(pid), "name": name, "sku": sku, "qty": int(q), "revenue": round(float(r), 2)}
+            for pid, name, sku, q, r in top_rows
+        ],
+        "series": series,
+    }
 
 
 @app.patch("/orders/{oid}/cancel")
-async def cancel_order(oid: uuid.UUID, token: str = Depends(oauth2_scheme), session: AsyncSession = Depends(get_session)):
+async def cancel_order(
+    oid: uuid.UUID,
+    token: str = Depends(oauth2_scheme),
+    session: AsyncSession = Depends(get_session),
+    idempotency_key: Optional[str] = Header(default=None, alias="Idempotency-Key"),
+):
     payload = decode_token(token)
+    return await idempotency.run(
+        payload.get("sub") or "",
+        idempotency_key,
+        idempotency.fingerprint("PATCH", f"/orders/{oid}/cancel"),
+        lambda: _cancel_order(oid, payload, session),
+    )
+
+
+async def _cancel_order(oid: uuid.UUID, payload: dict, session: AsyncSession):
     is_admin = payload.get("role") == "admin"
     o = await session.get(Order, oid, options=[selectinload(Order.items)])
     if not o:
@@ -125,40 +382,149 @@ async def cancel_order(oid: uuid.UUID, token: str = Depends(oauth2_scheme), sess
         raise HTTPException(status_code=403, detail="Forbidden")
     if o.status == "canceled":
         return serialize_order(o)
-    # set canceled
-    o.status = "canceled"
-    session.add(o)
+    # set canceled; the condition makes a concurrent second cancel a no-op (stock and rollups change once)
+    res = await session.execute(
+        update(Order)
+        .where(Order.id == oid, Order.created_at == o.created_at, Order.status != "canceled")
+        .values(status="canceled", updated_at=datetime.now(timezone.utc))
+        .returning(Order.id)
+    )
+    if res.scalar_one_or_none() is None:
+        await session.rollback()
+        o = await session.get(Order, oid, options=[selectinload(Order.items)], populate_existing=True)
+        return serialize_order(o)
+    await rollups.apply(session, [order_doc(o)], sign=-1)
+    # the stock release is committed with the cancel and sent to the catalog by the outbox relay
+    if o.items:
+        session.add(outbox.release_row(o.id, [{"product_id": it.product_id, "qty": it.qty} for it in o.items]))
     await session.commit()
-    # restore stock back in catalog for each item (once)
-    admin_token = mint_admin_token()
-    async with httpx.AsyncClient(timeout=10.0) as client:
-        for it in o.items:
-            pid = str(it.product_id)
-            pr = await client.get(f"{settings.catalog_url}/products/{pid}")
-            if pr.status_code != 200:
-                continue
-            p = pr.json()
-            try:
-                current = int(p.get("stock", 0))
-            except Exception:
-                current = 0
-            new_stock = current + int(it.qty)
-            await client.patch(
-                f"{settings.catalog_url}/products/{pid}",
-                json={"stock": new_stock},
-                headers={"Authorization": f"Bearer {admin_token}", "Content-Type": "application/json"},
-            )
-    # reload with items
-    o = await session.get(Order, oid, options=[selectinload(Order.items)])
+    outbox.relay.notify()
     return serialize_order(o)
 
 
+async def release_reservation(client: httpx.AsyncClient, order_id: uuid.UUID, items: list, attempts: int = 3) -> bool:
+    """Give reserved stock back when the order could not be stored. The release token makes retries safe.
+
+    The reserve token is sent along: the catalog gives back the lines recorded by that reserve, or
+    nothing if it was never applied (and voids it), so this is also safe when the reserve outcome is
+    unknown; `items` may then be empty.
+    """
+    payload = {
+        "token": f"order:{order_id}:release",
+        "reserve_token": f"order:{order_id}:reserve",
+        "items": [{"product_id": it["product_id"], "qty": int(it["qty"])} for it in items],
+    }
+    for attempt in range(attempts):
+        try:
+            r = await client.post(
+                f"{settings.catalog_url}/stock/release",
+                json=payload,
+                headers={"Authorization": f"Bearer {mint_admin_token()}"},
+            )
+            if r.status_code == 200:
+                return True
+        except httpx.RequestError:
+            pass
+        await asyncio.sleep(0.2 * 2 ** attempt)
+    logger.error("stock for order %s was reserved but could not be released", order_id)
+    return False
+
+
 @app.post("/orders/checkout")
-async def checkout(token: str = Depends(oauth2_scheme), session: AsyncSession = Depends(get_session)):
+async def checkout(
+    background: BackgroundTasks,
+    token: str = Depends(oauth2_scheme),
+    session: AsyncSession = Depends(get_session),
+    idempotency_key: Optional[str] = Header(default=None, alias="Idempotency-Key"),
+    prefer: Optional[str] = Header(default=None),
+):
     payload = decode_token(token)
     user = payload.get("sub")
     if not user:
         raise HTTPException(status_code=401, detail="Invalid token subject")
+    # with CHECKOUT_ASYNC, "Prefer: respond-async" queues the checkout and answers 202 with a job handle
+    queued = settings.checkout_async and "respond-async" in (prefer or "").lower()
+    # a retried checkout with the same key replays the first order (or job handle) instead of placing a second one
+    return await idempotency.run(
+        user,
+        idempotency_key,
+        idempotency.fingerprint("POST", "/orders/checkout"),
+        (lambda: enqueue_checkout(user)) if queued else (lambda: _checkout(background, token, user, session)),
+    )
+
+
+async def enqueue_checkout(user: str) -> JSONResponse:
+    job = await jobs.queue.enqueue(user)
+    return JSONResponse(
+        status_code=202,
+        content=jobs.describe(job, position=None),
+        headers={"Location": jobs.status_url(job.id), "Preference-Applied": "respond-async"},
+    )
+
+
+async def process_checkout_job(job: CheckoutJob):
+    """Run a queued checkout; the job id becomes the order id."""
+    async with AsyncSessionLocal() as session:
+        if job.attempts > 1:
+            # the worker that took it first died: the order may exist, and running it again could reserve twice
+            o = await session.get(Order, job.id, options=[selectinload(Order.items)])
+            if o is not None:
+                return serialize_order(o)
+            # no order: give back whatever the first run reserved. The catalog releases the lines recorded
+            # under the job's reserve token, or voids the token if the reserve never went through
+            async with httpx.AsyncClient(timeout=10.0) as client:
+                await release_reservation(client, job.id, [])
+            raise HTTPException(status_code=503, detail="Checkout was interrupted, please try again")
+        background = BackgroundTasks()
+        result = await _checkout(background, mint_user_token(job.user_email), job.user_email, session, order_id=job.id)
+    await background()
+    return result
+
+
+@app.get("/orders/checkout/jobs/{job_id}")
+async def checkout_job_status(
+    job_id: uuid.UUID,
+    token: str = Depends(oauth2_scheme),
+    wait: float = Query(default=0, ge=0, description="long poll: seconds to wait for the job to finish"),
+):
+    """State of a queued checkout: queued (with position), running, done (with the order) or failed (with detail)."""
+    payload = decode_token(token)
+    user = payload.get("sub")
+    if wait > 0:
+        job, position = await jobs.queue.wait(job_id, min(wait, settings.checkout_long_poll_max))
+    else:
+        job, position = await jobs.queue.get(job_id)
+    if job is None or (job.user_email != user and payload.get("role") != "admin"):
+        raise HTTPException(status_code=404, detail="Checkout job not found")
+    return jobs.describe(job, position)
+
+
+@app.get("/admin/checkout/queue")
+async def admin_checkout_queue(
+    token: str = Depends(oauth2_scheme),
+    window: int = Query(default=15, ge=1, le=1440, description="minutes of finished jobs for latency"),
+):
+    """Queue depth and job latency (p50/p95/max from created to finished) of asynchronous checkout."""
+    payload = decode_token(token)
+    require_admin(payload)
+    return {"enabled": settings.checkout_async, **await jobs.queue.metrics(window)}
+
+
+@app.get("/admin/outbox")
+async def admin_outbox(token: str = Depends(oauth2_scheme)):
+    """Stock releases of canceled orders not yet confirmed by the catalog."""
+    payload = decode_token(token)
+    require_admin(payload)
+    return await outbox.relay.metrics()
+
+
+async def _checkout(
+    background: BackgroundTasks,
+    token: str,
+    user: str,
+    session: AsyncSession,
+    order_id: uuid.UUID | None = None,
+):
     admin_token = mint_admin_token()
     items = []
     total = 0.0
@@ -170,12 +536,16 @@ async def checkout(token: str = Depends(oauth2_scheme), session: AsyncSession =
         cart_map: Dict[str, int] = cr.json()
         if not cart_map:
             raise HTTPException(status_code=400, detail="Cart is empty")
-        # validate, build items
+        # validate all lines with one catalog read
+        pr = await client.post(f"{settings.catalog_url}/products/batch", json={"ids": list(cart_map)})
+        if pr.status_code != 200:
+            raise HTTPException(status_code=502, detail="catalog unavailable")
+        batch = pr.json()
+        products = {str(p["id"]): p for p in batch.get("items", [])}
         for pid, qty in cart_map.items():
-            pr = await client.get(f"{settings.catalog_url}/products/{pid}")
-            if pr.status_code != 200:
+            p = products.get(pid)
+            if p is None:
                 raise HTTPException(status_code=404, detail=f"Product {pid} not found")
-            p = pr.json()
             if not p.get("is_active", True):
                 raise HTTPException(status_code=409, detail=f"{p.get('name')} not available")
             price = float(p.get("price", 0))
@@ -192,45 +562,88 @@ async def checkout(token: str = Depends(oauth2_scheme), session: AsyncSession =
                 "qty": qty,
                 "subtotal": line_total,
             })
-        # decrement stock
-        for it in items:
-            pid = it["product_id"]
-            pr = await client.get(f"{settings.catalog_url}/products/{pid}")
-            p = pr.json()
-            new_stock = int(p.get("stock", 0)) - int(it["qty"]) 
-            if new_stock < 0:
-                raise HTTPException(status_code=409, detail=f"Not enough stock for {p.get('name')}")
-            rpatch = await client.patch(
-                f"{settings.catalog_url}/products/{pid}",
-                json={"stock": new_stock},
-                headers={"Authorization": f"Bearer {admin_token}", "Content-Type": "application/json"},
+        # reserve stock for the whole basket atomically (all lines or none)
+        order_id = order_id or uuid.uuid4()
+        reserve = {
+            "token": f"order:{order_id}:reserve",
+            "items": [{"product_id": it["product_id"], "qty": int(it["qty"])} for it in items],
+        }
+        try:
+            rr = await client.post(
+                f"{settings.catalog_url}/stock/reserve", json=reserve, headers={"Authorization": f"Bearer {admin_token}"}
             )
-            if rpatch.status_code not in (200, 201):
-                raise HTTPException(status_code=rpatch.status_code, detail="Stock update failed")
-        # persist order
-        order = Order(user_email=user, status="paid", total=round(total, 2))
-        session.add(order)
-        await session.flush()
-        for it in items:
-            oi = OrderItem(
-                order_id=order.id,
-                product_id=uuid.UUID(it["product_id"]),
-                sku=it["sku"],
-                name=it["name"],
-                price=it["price"],
-                qty=int(it["qty"]),
-                subtotal=it["subtotal"],
+        except httpx.RequestError:
+            # the outcome is unknown; the same token replays the first result instead of reserving twice
+            try:
+                rr = await client.post(
+                    f"{settings.catalog_url}/stock/reserve", json=reserve, headers={"Authorization": f"Bearer {admin_token}"}
+                )
+            except httpx.RequestError:
+                # still unknown: undo whatever the first attempt may have reserved
+                await asyncio.shield(release_reservation(client, order_id, items))
+                raise HTTPException(status_code=503, detail="catalog unavailable")
+        if rr.status_code == 409:
+            names = {it["product_id"]: it["name"] for it in items}
+            body = rr.json()
+            failed = [str(names.get(f.get("product_id"), f.get("product_id"))) for f in body.get("failures", [])]
+            detail = f"Not enough stock for {', '.join(failed)}" if failed else body.get("detail", "Stock update failed")
+            raise HTTPException(status_code=409, detail=detail)
+        if rr.status_code != 200:
+            raise HTTPException(status_code=rr.status_code, detail="Stock update failed")
+        reserved = rr.json()
+        if reserved.get("voided") or not reserved.get("items"):
+            # the token was voided by the release of an interrupted run: this replay took no stock
+            raise HTTPException(status_code=503, detail="Checkout was interrupted, please try again")
+        # persist order and all its lines in one transaction (one multi-row INSERT for the lines)
+        try:
+            # explicit timestamp: the rollup day must be the day the order is stored under
+            now = datetime.now(timezone.utc)
+            order = Order(id=order_id, user_email=user, status="paid", total=round(total, 2), created_at=now, updated_at=now)
+            session.add(order)
+            await session.flush()
+            await session.execute(
+                insert(OrderItem),
+                [
+                    {
+                        "order_id": order_id,
+                        "created_at": now,
+                        "product_id": uuid.UUID(it["product_id"]),
+                        "sku": it["sku"],
+                        "name": it["name"],
+                        "price": it["price"],
+                        "qty": int(it["qty"]),
+                        "subtotal": it["subtotal"],
+                    }
+                    for it in items
+                ],
             )
-            session.add(oi)
-        await session.commit()
-        # clear cart
-        await client.post(f"{settings.cart_url}/cart/clear", headers={"Authorization": f"Bearer {token}"})
-        # return order model from in-memory snapshot to avoid lazy loads
-        return {
-            "id": order.id,
-            "user": user,
-            "status": "paid",
-            "total": round(total, 2),
-            "items": items,
-            "created_at": order.created_at.isoformat() if order.created_at else datetime.now(timezone.utc).isoformat(),
-        }
+            await rollups.apply(session, [{"created_at": now, "user": user, "total": order.total, "items": items}])
+            await session.commit()
+        except BaseException:
+            # the stock is taken but there is no order: give it back before failing the request
+            await session.rollback()
+            await asyncio.shield(release_reservation(client, order_id, items))
+            raise
+    # drop the purchased lines after the response is sent; lines added meanwhile stay in the cart
+    background.add_task(remove_from_cart, token, [it["product_id"] for it in items])
+    # return order model from in-memory snapshot to avoid lazy loads
+    return {
+        "id": order.id,
+        "user": user,
+        "status": "paid",
+        "total": round(total, 2),
+        "items": items,
+        "created_at": order.created_at.isoformat(),
+    }
+
+
+async def remove_from_cart(token: str, product_ids: list) -> None:
+    try:
+        async with httpx.AsyncClient(timeout=10.0) as client:
+            await client.post(
+                f"{settings.cart_url}/cart/batch",
+                json={"ops": [{"op": "remove", "product_id": pid} for pid in product_ids]},
+                headers={"Authorization": f"Bearer {token}"},
+            )
+    except httpx.RequestError as e:
+        logger.warning("could not remove purchased lines from the cart: %s", e)
@@ -2,17 +2,23 @@ from __future__ import annotations
 
 import uuid
 from decimal import Decimal
-from datetime import datetime
+from datetime import date, datetime
 
 from sqlalchemy import (
+    BigInteger,
+    Date,
+    SmallInteger,
     String,
     Integer,
+    Text,
     DateTime,
     Numeric,
     ForeignKey,
+    ForeignKeyConstraint,
+    PrimaryKeyConstraint,
     text,
 )
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB, UUID
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 
 
@@ -22,8 +28,14 @@ class Base(DeclarativeBase):
 
 class Order(Base):
     __tablename__ = "orders"
+    # partitioned by month on created_at (0007_partition_orders), so the table key is (id, created_at);
+    # ids are random UUIDs and the ORM still identifies an order by id alone
+    __table_args__ = (
+        PrimaryKeyConstraint("id", "created_at"),
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
 
-    id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), default=uuid.uuid4)
     user_email: Mapped[str] = mapped_column(String(255), nullable=False)
     status: Mapped[str] = mapped_column(String(32), nullable=False, default="paid")
     total: Mapped[Decimal] = mapped_column(Numeric(12, 2), nullable=False, default=0)
@@ -38,12 +50,21 @@ class Order(Base):
         back_populates="order", cascade="all, delete-orphan", lazy="selectin"
     )
 
+    __mapper_args__ = {"primary_key": [id]}
+
 
 class OrderItem(Base):
     __tablename__ = "order_items"
+    # partitioned like orders; created_at is the order's, so an order and its items share a month
+    __table_args__ = (
+        PrimaryKeyConstraint("id", "created_at"),
+        ForeignKeyConstraint(["order_id", "created_at"], ["orders.id", "orders.created_at"], ondelete="CASCADE"),
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
 
-    id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    order_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), ForeignKey("orders.id", ondelete="CASCADE"), nullable=False)
+    id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), default=uuid.uuid4)
+    order_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
     product_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), nullable=False)
     sku: Mapped[str] = mapped_column(String(64), nullable=False)
     name: Mapped[str] = mapped_column(String(255), nullable=False)
@@ -52,3 +73,134 @@ class OrderItem(Base):
     subtotal: Mapped[Decimal] = mapped_column(Numeric(12, 2), nullable=False)
 
     order: Mapped[Order] = relationship(back_populates="items", lazy="selectin")
+
+    __mapper_args__ = {"primary_key": [id]}
+
+
+class IdempotencyKey(Base):
+    """Outcome of a request sent with an Idempotency-Key header, replayed for retries until it expires."""
+
+    __tablename__ = "idempotency_keys"
+
+    # keys are scoped to the caller (JWT sub), so users cannot collide or read each other's responses
+    scope: Mapped[str] = mapped_column(String(255), primary_key=True)
+    key: Mapped[str] = mapped_column(String(255), primary_key=True)
+    # method, path and body hash of the first request; the same key with another request is rejected
+    fingerprint: Mapped[str] = mapped_column(String(64), nullable=False)
+    # in_progress | done
+    state: Mapped[str] = mapped_column(String(16), nullable=False, default="in_progress")
+    status_code: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    response: Mapped[dict | None] = mapped_column(JSONB, nullable=True)
+    # an in_progress claim is leased: the attempt number identifies its holder, a lapsed lease is taken over
+    attempts: Mapped[int] = mapped_column(Integer, nullable=False, default=1)
+    locked_until: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=text("CURRENT_TIMESTAMP"), nullable=False
+    )
+    expires_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False, index=True)
+
+
+class SalesDaily(Base):
+    """Per-day totals of non-canceled orders (UTC days), kept up to date by checkout and cancel."""
+
+    __tablename__ = "sales_daily"
+
+    day: Mapped[date] = mapped_column(Date, primary_key=True)
+    order_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    revenue: Mapped[Decimal] = mapped_column(Numeric(14, 2), nullable=False, default=0)
+    # HyperLogLog registers of buyer emails (see app/rollups.py); buyers are never removed on cancel
+    buyers_hll: Mapped[list[int]] = mapped_column(ARRAY(SmallInteger), nullable=False)
+
+
+class ProductSalesDaily(Base):
+    """Per-day, per-product totals of non-canceled orders."""
+
+    __tablename__ = "product_sales_daily"
+
+    day: Mapped[date] = mapped_column(Date, primary_key=True)
+    product_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), primary_key=True)
+    sku: Mapped[str] = mapped_column(String(64), nullable=False)
+    name: Mapped[str] = mapped_column(String(255), nullable=False)
+    qty: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    revenue: Mapped[Decimal] = mapped_column(Numeric(14, 2), nullable=False, default=0)
+    order_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+
+
+class CheckoutJob(Base):
+    """Queued asynchronous checkout; its id becomes the id of the order it creates."""
+
+    __tablename__ = "checkout_jobs"
+
+    id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    user_email: Mapped[str] = mapped_column(String(255), nullable=False)
+    # queued | running | done | failed
+    status: Mapped[str] = mapped_column(String(16), nullable=False, default="queued")
+    status_code: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    # order (done) or {"detail": ...} (failed)
+    result: Mapped[dict | None] = mapped_column(JSONB, nullable=True)
+    attempts: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=text("CURRENT_TIMESTAMP"), nullable=False
+    )
+    started_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
+    finished_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
+    # a running job whose lease expired belongs to a worker that died
+    locked_until: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
+
+
+class StockOutbox(Base):
+    """Stock release owed to the catalog, written in the transaction that canceled the order."""
+
+    __tablename__ = "stock_outbox"
+
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
+    order_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), nullable=False)
+    # idempotency token of POST /stock/release(/batch) in the catalog
+    token: Mapped[str] = mapped_column(String(128), nullable=False, unique=True)
+    # [{"product_id": ..., "qty": ...}]
+    items: Mapped[list] = mapped_column(JSONB, nullable=False)
+    # pending | sent | failed (rejected by the catalog, needs a look)
+    state: Mapped[str] = mapped_column(String(16), nullable=False, default="pending")
+    attempts: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    # when the relay may (re)try; also the lease of a row being sent
+    next_attempt_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=text("CURRENT_TIMESTAMP"), nullable=False
+    )
+    last_error: Mapped[str | None] = mapped_column(Text, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=text("CURRENT_TIMESTAMP"), nullable=False
+    )
+    sent_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
+
+
+class OrderArchive(Base):
+    """A monthly partition exported to a file and detached by `python -m app.scripts.partitions`."""
+
+    __tablename__ = "order_archives"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    month: Mapped[date] = mapped_column(Date, nullable=False)
+    partition: Mapped[str] = mapped_column(String(63), nullable=False)
+    # path relative to ARCHIVE_DIR
+    file: Mapped[str] = mapped_column(String(255), nullable=False, unique=True)
+    # ndjson (gzip members of ARCHIVE_BLOCK orders) | parquet (row groups of ARCHIVE_BLOCK orders)
+    format: Mapped[str] = mapped_column(String(16), nullable=False)
+    orders: Mapped[int] = mapped_column(Integer, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=text("CURRENT_TIMESTAMP"), nullable=False
+    )
+
+
+class ArchivedOrder(Base):
+    """Where an archived order is: lets GET /orders/{id} read one block of the file instead of all of it."""
+
+    __tablename__ = "archived_orders"
+
+    id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), primary_key=True)
+    archive_id: Mapped[int] = mapped_column(
+        Integer, ForeignKey("order_archives.id", ondelete="CASCADE"), nullable=False, index=True
+    )
+    user_email: Mapped[str] = mapped_column(String(255), nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+    # byte offset of the gzip member (ndjson) or row group number (parquet)
+    block: Mapped[int] = mapped_column(BigInteger, nullable=False)
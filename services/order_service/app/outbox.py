@@ -0,0 +1,243 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import random
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+import httpx
+from sqlalchemy import delete, func, select, update
+
+from .config import settings
+from .db import AsyncSessionLocal
+from .models import StockOutbox
+
+
+logger = logging.getLogger("order.outbox")
+
+# Transactional outbox for stock releases: cancel writes the release it owes the catalog into
+# stock_outbox in the same transaction as the status change and answers right after the commit, so a
+# canceled order always gets its stock back and a slow or unavailable catalog never delays the buyer.
+# The relay takes due rows in id order with FOR UPDATE SKIP LOCKED (several replicas share the table),
+# leases them by moving next_attempt_at forward, and sends up to OUTBOX_BATCH_SIZE of them in one
+# POST /stock/release/batch. The catalog applies each token once, so a batch repeated after a crash or
+# a timeout is harmless. A failed batch is retried with exponential backoff and jitter.
+Auth = Callable[[], str]
+
+# POST /stock/release/batch takes at most this many operations (catalog schemas.StockReleaseBatch)
+CATALOG_BATCH_MAX = 200
+# answers that will not change on a retry of the same batch; auth errors and throttling are retried
+# since they are fixed by configuration or time, not by the rows
+RETRYABLE_4XX = {401, 403, 408, 429}
+
+
+def batch_size() -> int:
+    return max(1, min(settings.outbox_batch_size, CATALOG_BATCH_MAX))
+
+
+def backoff(attempts: int) -> float:
+    """Seconds before the next try after `attempts` failed ones: doubling up to OUTBOX_BACKOFF_MAX, with jitter."""
+    delay = min(settings.outbox_backoff_base * 2 ** max(attempts - 1, 0), settings.outbox_backoff_max)
+    return delay * random.uniform(0.5, 1.0)
+
+
+def release_row(order_id, items: List[dict]) -> StockOutbox:
+    """Outbox row for the caller's transaction; `items` are order items (product_id, qty)."""
+    return StockOutbox(
+        order_id=order_id,
+        token=f"order:{order_id}:release",
+        items=[{"product_id": str(it["product_id"]), "qty": int(it["qty"])} for it in items],
+        state="pending",
+        attempts=0,
+        next_attempt_at=datetime.now(timezone.utc),
+    )
+
+
+class StockReleaseRelay:
+    def __init__(self) -> None:
+        self.auth: Optional[Auth] = None
+        self._task: Optional[asyncio.Task] = None
+        self._purger: Optional[asyncio.Task] = None
+        self._client: Optional[httpx.AsyncClient] = None
+        self._wakeup = asyncio.Event()
+        self.batches = 0
+        self.sent = 0
+        self.errors = 0
+
+    def notify(self) -> None:
+        """New rows were committed: send them now instead of at the next poll."""
+        self._wakeup.set()
+
+    def start(self, auth: Auth) -> None:
+        self.auth = auth
+        self._client = httpx.AsyncClient(base_url=settings.catalog_url, timeout=settings.outbox_timeout)
+        if settings.outbox_batch_size > CATALOG_BATCH_MAX:
+            logger.warning("OUTBOX_BATCH_SIZE=%s is above the catalog limit, using %s", settings.outbox_batch_size, CATALOG_BATCH_MAX)
+        self._task = asyncio.create_task(self._loop())
+        self._purger = asyncio.create_task(self._purge_loop())
+        logger.info("stock release relay started")
+
+    async def stop(self) -> None:
+        tasks = [t for t in (self._task, self._purger) if t is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = self._purger = None
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _claim(self) -> List[StockOutbox]:
+        now = func.now()
+        due = (
+            select(StockOutbox.id)
+            .where(StockOutbox.state == "pending", StockOutbox.next_attempt_at <= now)
+            .order_by(StockOutbox.id)
+            .limit(batch_size())
+            .with_for_update(skip_locked=True)
+        )
+        async with AsyncSessionLocal() as session:
+            res = await session.execute(
+                update(StockOutbox)
+                .where(StockOutbox.id.in_(due.scalar_subquery()))
+                .values(
+                    attempts=StockOutbox.attempts + 1,
+                    next_attempt_at=now + timedelta(seconds=settings.outbox_lease),
+                )
+                .returning(StockOutbox)
+                .execution_options(synchronize_session=False)
+            )
+            rows = sorted(res.scalars().all(), key=lambda r: r.id)
+            await session.commit()
+            return rows
+
+    async def _send(self, rows: List[StockOutbox]) -> List[Dict[str, Any]]:
+        """Row updates after one batch call: sent, rejected by the catalog, or to be retried."""
+        try:
+            r = await self._client.post(
+                "/stock/release/batch",
+                json={"operations": [{"token": row.token, "items": row.items} for row in rows]},
+                headers={"Authorization": f"Bearer {self.auth()}"},
+            )
+            r.raise_for_status()
+            results = {res["token"]: res for res in r.json()["results"]}
+        except httpx.HTTPStatusError as e:
+            code = e.response.status_code
+            if 400 <= code < 500 and code not in RETRYABLE_4XX:
+                if len(rows) > 1:
+                    # one bad row must not fail the others: send them one by one to find it
+                    return [change for row in rows for change in await self._send([row])]
+                return self._reject(rows, f"catalog answered {code}: {e.response.text[:500]}")
+            return self._retry(rows, f"catalog answered {code}")
+        except (httpx.HTTPError, KeyError, ValueError) as e:
+            return self._retry(rows, f"{type(e).__name__}: {e}")
+        now = datetime.now(timezone.utc)
+        changes = []
+        for row in rows:
+            res = results.get(row.token)
+            if res is None:
+                changes.extend(self._retry([row], "missing from the catalog response"))
+            elif "error" in res:
+                logger.error("catalog rejected stock release %s: %s", row.token, res["error"])
+                changes.append({"id": row.id, "state": "failed", "last_error": str(res["error"])[:1000]})
+            else:
+                changes.append({"id": row.id, "state": "sent", "sent_at": now, "last_error": None})
+        self.sent += sum(1 for c in changes if c.get("state") == "sent")
+        return changes
+
+    def _reject(self, rows: List[StockOutbox], error: str) -> List[Dict[str, Any]]:
+        # the same batch would be refused again: fail the rows instead of backing off forever
+        self.errors += 1
+        logger.error("catalog refused stock release %s (%s); marked failed", ", ".join(r.token for r in rows), error)
+        return [{"id": row.id, "state": "failed", "last_error": error[:1000]} for row in rows]
+
+    def _retry(self, rows: List[StockOutbox], error: str) -> List[Dict[str, Any]]:
+        self.errors += 1
+        logger.warning("stock release of %s rows failed (%s), will retry", len(rows), error)
+        now = datetime.now(timezone.utc)
+        return [
+            {"id": row.id, "next_attempt_at": now + timedelta(seconds=backoff(row.attempts)), "last_error": error[:1000]}
+            for row in rows
+        ]
+
+    async def _store(self, changes: List[Dict[str, Any]]) -> None:
+        # grouped by the set of columns: one executemany UPDATE per shape
+        groups: Dict[tuple, List[Dict[str, Any]]] = {}
+        for change in changes:
+            groups.setdefault(tuple(sorted(change)), []).append(change)
+        async with AsyncSessionLocal() as session:
+            for group in groups.values():
+                await session.execute(update(StockOutbox), group)
+            await session.commit()
+
+    async def run_once(self) -> int:
+        """Send one batch of due releases; returns the number of rows taken."""
+        rows = await self._claim()
+        if not rows:
+            return 0
+        changes = await self._send(rows)
+        self.batches += 1
+        # if this fails the lease runs out and the rows are sent again; the tokens make that a no-op
+        await self._store(changes)
+        return len(rows)
+
+    async def _loop(self) -> None:
+        while True:
+            # cleared before claiming, so a cancel committed during the batch is not missed
+            self._wakeup.clear()
+            try:
+                taken = await self.run_once()
+            except Exception as e:
+                logger.warning("stock release relay: %s", e)
+                taken = 0
+            if taken >= batch_size():
+                # probably more due rows: drain without waiting
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), settings.outbox_poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _purge_loop(self, interval: float = 3600.0) -> None:
+        while True:
+            try:
+                async with AsyncSessionLocal() as session:
+                    cutoff = datetime.now(timezone.utc) - timedelta(hours=settings.outbox_retention_hours)
+                    await session.execute(
+                        delete(StockOutbox).where(StockOutbox.state == "sent", StockOutbox.sent_at < cutoff)
+                    )
+                    await session.commit()
+            except Exception as e:
+                logger.warning("stock outbox purge failed: %s", e)
+            await asyncio.sleep(interval)
+
+    async def metrics(self) -> Dict[str, Any]:
+        """Backlog from Postgres (all replicas) and the counters of this process's relay."""
+        async with AsyncSessionLocal() as session:
+            row = (
+                await session.execute(
+                    select(
+                        func.count().filter(StockOutbox.state == "pending"),
+                        func.count().filter(StockOutbox.state == "failed"),
+                        func.min(StockOutbox.created_at).filter(StockOutbox.state == "pending"),
+                        func.max(StockOutbox.attempts).filter(StockOutbox.state == "pending"),
+                    ).where(StockOutbox.state.in_(("pending", "failed")))
+                )
+            ).one()
+        oldest = row[2]
+        return {
+            "pending": int(row[0]),
+            "failed": int(row[1]),
+            "oldest_pending_seconds": round((datetime.now(timezone.utc) - oldest).total_seconds(), 3) if oldest else 0.0,
+            "max_attempts": int(row[3] or 0),
+            "relay": {
+                "running": self._task is not None,
+                "batches": self.batches,
+                "sent": self.sent,
+                "errors": self.errors,
+            },
+        }
+
+
+relay = StockReleaseRelay()
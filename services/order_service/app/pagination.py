@@ -0,0 +1,56 @@
+from __future__ import annotations
+
+import base64
+import json
+import uuid
+from datetime import date, datetime, timedelta, timezone
+from typing import List, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import tuple_
+
+from .models import Order
+
+
+# Order lists are newest first; (created_at, id) is the keyset, backed by the
+# (…, created_at DESC, id DESC) indexes of 0003_order_indexes.
+ORDER_BY = [Order.created_at.desc(), Order.id.desc()]
+
+
+def encode_cursor(created_at: datetime, oid: uuid.UUID) -> str:
+    """Opaque position of the last order of a page."""
+    raw = json.dumps([created_at.isoformat(), str(oid)], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, uuid.UUID]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, oid = json.loads(raw)
+        return datetime.fromisoformat(created_at), uuid.UUID(oid)
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status_code=400, detail="Invalid cursor") from e
+
+
+def after(cursor: Optional[str]):
+    """Keyset condition: orders strictly older than the cursor position."""
+    if not cursor:
+        return None
+    created_at, oid = decode_cursor(cursor)
+    return tuple_(Order.created_at, Order.id) < tuple_(created_at, oid)
+
+
+def date_range(date_from: Optional[date], date_to: Optional[date]) -> List:
+    """[date_from, date_to] in UTC days, as conditions on created_at."""
+    conds = []
+    if date_from:
+        conds.append(Order.created_at >= datetime.combine(date_from, datetime.min.time(), timezone.utc))
+    if date_to:
+        conds.append(Order.created_at < datetime.combine(date_to + timedelta(days=1), datetime.min.time(), timezone.utc))
+    return conds
+
+
+def email_prefix(prefix: str):
+    """user_email LIKE 'prefix%' with LIKE wildcards in the prefix taken literally."""
+    escaped = prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return Order.user_email.like(f"{escaped}%", escape="\\")
@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import re
+from datetime import date, datetime, timezone
+from typing import Dict, Iterable, List
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from .config import settings
+from .db import engine
+
+
+logger = logging.getLogger("order.partitions")
+
+# orders and order_items are range-partitioned by UTC month on created_at (0007_partition_orders):
+# orders_p2024_01 holds the orders of [2024-01-01, 2024-02-01) and order_items_p2024_01 their items.
+# Inserts into a month without a partition fail, so the service keeps ORDERS_PARTITIONS_AHEAD months
+# ready (at startup and every few hours); `python -m app.scripts.partitions` does the same and archives.
+TABLES = ("orders", "order_items")
+NAME = re.compile(r"^(?:orders|order_items)_p(\d{4})_(\d{2})(?:_\d+)?$")
+# serializes partition DDL of several replicas
+LOCK_KEY = 7_246_020_701
+
+
+def month_of(ts: datetime) -> date:
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc)
+    return date(ts.year, ts.month, 1)
+
+
+def add_months(month: date, n: int) -> date:
+    i = month.year * 12 + month.month - 1 + n
+    return date(i // 12, i % 12 + 1, 1)
+
+
+def bounds(month: date) -> str:
+    return f"FROM ('{month.isoformat()} 00:00:00+00') TO ('{add_months(month, 1).isoformat()} 00:00:00+00')"
+
+
+async def attached(conn: AsyncConnection, parent: str) -> Dict[date, str]:
+    """Partitions of `parent` by month."""
+    res = await conn.execute(
+        text(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = CAST(:parent AS regclass)"
+        ),
+        {"parent": parent},
+    )
+    out: Dict[date, str] = {}
+    for (name,) in res.all():
+        m = NAME.match(name)
+        if m:
+            out[date(int(m[1]), int(m[2]), 1)] = name
+    return out
+
+
+async def _free_name(conn: AsyncConnection, table: str, month: date) -> str:
+    # a detached (archived, not dropped) partition keeps its name; a new one for that month gets a suffix
+    base = f"{table}_p{month:%Y_%m}"
+    name, n = base, 1
+    while await conn.scalar(text("SELECT to_regclass(:name)"), {"name": name}) is not None:
+        n += 1
+        name = f"{base}_{n}"
+    return name
+
+
+async def ensure(months: Iterable[date]) -> List[str]:
+    """Create the missing partitions (of both tables) for `months`; returns the tables created.
+
+    Runs in its own short transaction, since creating a partition locks the parent table.
+    """
+    months = sorted({m.replace(day=1) for m in months})
+    created: List[str] = []
+    async with engine.connect() as conn:
+        have = {parent: await attached(conn, parent) for parent in TABLES}
+        await conn.rollback()
+        if all(m in have[parent] for m in months for parent in TABLES):
+            return created
+        async with conn.begin():
+            await conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": LOCK_KEY})
+            for parent in TABLES:
+                have = await attached(conn, parent)
+                for month in months:
+                    if month in have:
+                        continue
+                    name = await _free_name(conn, parent, month)
+                    await conn.execute(text(f"CREATE TABLE {name} PARTITION OF {parent} FOR VALUES {bounds(month)}"))
+                    created.append(name)
+    if created:
+        logger.info("created partitions %s", ", ".join(created))
+    return created
+
+
+async def ensure_ahead(ahead: int | None = None) -> List[str]:
+    """Partitions for the current month and the next `ahead` (ORDERS_PARTITIONS_AHEAD) months."""
+    ahead = settings.orders_partitions_ahead if ahead is None else ahead
+    current = month_of(datetime.now(timezone.utc))
+    return await ensure(add_months(current, i) for i in range(ahead + 1))
+
+
+async def keep_ahead_loop(interval: float = 6 * 3600.0) -> None:
+    while True:
+        try:
+            await ensure_ahead()
+        except Exception as e:
+            logger.warning("could not create upcoming partitions: %s", e)
+        await asyncio.sleep(interval)
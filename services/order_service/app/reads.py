@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+import uuid
+from typing import List, Optional, Tuple
+
+from sqlalchemy import Text, case, cast, func, literal_column, select
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import pagination
+from .models import Order, OrderItem
+
+
+# Order reads as JSON built by Postgres: one statement per request (orders, their items and the page
+# cursor), returned as bytes without ORM objects or Pydantic models. The documents match OrderOut as
+# FastAPI renders it: ids and decimals as strings, created_at as ISO 8601 in UTC.
+# `python -m app.scripts.bench_order_reads` compares this path with the ORM one.
+# created_at as datetime.isoformat() renders it: microseconds only when they are not zero
+CREATED_AT = 'YYYY-MM-DD"T"HH24:MI:SS'
+MICROSECONDS = '.US'
+
+
+def _isoformat(ts):
+    utc = func.timezone("UTC", ts)
+    fraction = case((func.date_trunc("second", utc) == utc, ""), else_=func.to_char(utc, MICROSECONDS))
+    return func.concat(func.to_char(utc, CREATED_AT), fraction, "+00:00")
+
+
+def _items_json(o, items):
+    item = func.json_build_object(
+        "product_id", cast(items.c.product_id, Text),
+        "sku", items.c.sku,
+        "name", items.c.name,
+        "price", cast(items.c.price, Text),
+        "qty", items.c.qty,
+        "subtotal", cast(items.c.subtotal, Text),
+    )
+    return (
+        select(func.coalesce(func.json_agg(item), literal_column("'[]'::json")))
+        # created_at limits the lookup to the order's monthly partition of order_items
+        .where(items.c.order_id == o.id, items.c.created_at == o.created_at)
+        .scalar_subquery()
+    )
+
+
+def order_json(o, items=OrderItem.__table__):
+    """json_build_object of one order row: `o` holds the order columns (orders, a subquery, a partition),
+    `items` is order_items or one of its partitions."""
+    return func.json_build_object(
+        "id", cast(o.id, Text),
+        "user", o.user_email,
+        "status", o.status,
+        "total", cast(o.total, Text),
+        "created_at", _isoformat(o.created_at),
+        "items", _items_json(o, items),
+    )
+
+
+async def order(session: AsyncSession, oid: uuid.UUID, user: Optional[str] = None) -> Optional[bytes]:
+    """One order as JSON; None when it does not exist (or belongs to someone other than `user`)."""
+    conds = [Order.id == oid]
+    if user is not None:
+        conds.append(Order.user_email == user)
+    doc = await session.scalar(select(cast(order_json(Order.__table__.c), Text)).where(*conds))
+    return doc.encode() if doc is not None else None
+
+
+async def order_page(session: AsyncSession, conds: List, limit: int, cursor: Optional[str]) -> Tuple[bytes, Optional[str]]:
+    """One page of orders (newest first) matching `conds` as a JSON array, and the next cursor if any."""
+    keyset = pagination.after(cursor)
+    if keyset is not None:
+        conds = [*conds, keyset]
+    # one extra row tells whether there is a next page without counting
+    page = (
+        select(
+            Order.id,
+            Order.user_email,
+            Order.status,
+            Order.total,
+            Order.created_at,
+            func.row_number().over(order_by=pagination.ORDER_BY).label("n"),
+        )
+        .where(*conds)
+        .order_by(*pagination.ORDER_BY)
+        .limit(limit + 1)
+        .subquery("page")
+    )
+    in_page = page.c.n <= limit
+    last = page.c.n == limit
+    docs, more, last_created_at, last_id = (
+        await session.execute(
+            select(
+                cast(
+                    func.coalesce(
+                        func.json_agg(aggregate_order_by(order_json(page.c), page.c.n)).filter(in_page),
+                        literal_column("'[]'::json"),
+                    ),
+                    Text,
+                ),
+                func.count() > limit,
+                func.max(page.c.created_at).filter(last),
+                func.max(cast(page.c.id, Text)).filter(last),
+            )
+        )
+    ).one()
+    next_cursor = pagination.encode_cursor(last_created_at, uuid.UUID(last_id)) if more else None
+    return docs.encode(), next_cursor
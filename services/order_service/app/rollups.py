@@ -0,0 +1,187 @@
+from __future__ import annotations
+
+import hashlib
+import math
+import uuid
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import SmallInteger, func, literal_column, select, true
+from sqlalchemy.dialects.postgresql import ARRAY, aggregate_order_by
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .models import ProductSalesDaily, SalesDaily
+
+
+# Daily sales rollups: admin stats read these few hundred rows instead of scanning order_items.
+# Checkout adds an order (sign +1) and cancel subtracts it (sign -1) in the same transaction as the
+# order itself, so the rollups match committed orders. `python -m app.scripts.rebuild_rollups`
+# recomputes them from the orders table.
+#
+# Distinct buyers per day are HyperLogLog registers (2**HLL_P small ints, ~2.3% standard error at p=11):
+# days are merged with an element-wise max, so any date range gets an estimate without rescanning.
+# A register cannot be decremented, so a canceled order's buyer stays counted until the next rebuild.
+HLL_P = 11
+HLL_M = 1 << HLL_P
+
+
+# element-wise max of the stored and the incoming registers (ON CONFLICT DO UPDATE of sales_daily)
+HLL_UNION = literal_column(
+    "(SELECT array_agg(GREATEST(u.a, u.b) ORDER BY u.i)"
+    " FROM unnest(sales_daily.buyers_hll, excluded.buyers_hll) WITH ORDINALITY AS u(a, b, i))",
+    ARRAY(SmallInteger),
+)
+
+
+def utc_day(ts: datetime) -> date:
+    if ts.tzinfo is None:
+        # naive timestamps (legacy imports) are stored and counted as UTC
+        return ts.date()
+    return ts.astimezone(timezone.utc).date()
+
+
+def hll_position(value: str) -> Tuple[int, int]:
+    """(register index, rank) of a value: top HLL_P hash bits pick the register, the rank is
+    the position of the first 1 bit in the remaining bits."""
+    h = int.from_bytes(hashlib.sha1(value.strip().lower().encode()).digest()[:8], "big")
+    index = h >> (64 - HLL_P)
+    rest = h & ((1 << (64 - HLL_P)) - 1)
+    return index, (64 - HLL_P) - rest.bit_length() + 1
+
+
+def hll_empty() -> List[int]:
+    return [0] * HLL_M
+
+
+def hll_add(registers: List[int], value: str) -> None:
+    index, rank = hll_position(value)
+    if rank > registers[index]:
+        registers[index] = rank
+
+
+def hll_merge(sketches: Iterable[Sequence[int]]) -> List[int]:
+    """Element-wise max: the sketch of the union of the sets."""
+    return [max(ranks) for ranks in zip(hll_empty(), *sketches)]
+
+
+def hll_estimate(registers: Sequence[int]) -> int:
+    m = len(registers)
+    alpha = 0.7213 / (1 + 1.079 / m)
+    raw = alpha * m * m / sum(2.0 ** -r for r in registers)
+    zeros = registers.count(0)
+    if raw <= 2.5 * m and zeros:
+        # small cardinalities: linear counting is far more accurate
+        return round(m * math.log(m / zeros))
+    return round(raw)
+
+
+async def buyers_union(session: AsyncSession, conds: list) -> Optional[List[int]]:
+    """hll_merge of the sketches of the matching sales_daily rows, computed in Postgres.
+
+    Only the 2**HLL_P merged registers come back, however many days the window covers.
+    """
+    u = func.unnest(SalesDaily.buyers_hll).table_valued("r", with_ordinality="i").render_derived(name="u")
+    per_register = (
+        select(u.c.i, func.max(u.c.r).label("r"))
+        .select_from(SalesDaily)
+        .join(u, true())
+        .where(*conds)
+        .group_by(u.c.i)
+        .subquery()
+    )
+    return (await session.execute(select(func.array_agg(aggregate_order_by(per_register.c.r, per_register.c.i))))).scalar_one()
+
+
+@dataclass
+class Delta:
+    """Changes to the rollups of one UTC day."""
+
+    order_count: int = 0
+    revenue: Decimal = Decimal(0)
+    buyers: Optional[List[int]] = None
+    # product_id -> [sku, name, qty, revenue, order_count]
+    products: Dict[uuid.UUID, list] = field(default_factory=dict)
+
+
+def collect(orders: Iterable[dict], sign: int = 1) -> Dict[date, Delta]:
+    """Group orders into per-day deltas.
+
+    Each order is a dict with `created_at`, `user`, `total` and `items`
+    (`product_id`, `sku`, `name`, `qty`, `subtotal`).
+    """
+    days: Dict[date, Delta] = defaultdict(Delta)
+    for o in orders:
+        d = days[utc_day(o["created_at"])]
+        d.order_count += sign
+        d.revenue += sign * Decimal(str(o["total"]))
+        if sign > 0:
+            if d.buyers is None:
+                d.buyers = hll_empty()
+            hll_add(d.buyers, o["user"])
+        seen = set()
+        for it in o["items"]:
+            pid = uuid.UUID(str(it["product_id"]))
+            line = d.products.setdefault(pid, [it["sku"], it["name"], 0, Decimal(0), 0])
+            line[2] += sign * int(it["qty"])
+            line[3] += sign * Decimal(str(it["subtotal"]))
+            if pid not in seen:
+                seen.add(pid)
+                line[4] += sign
+    return days
+
+
+async def apply(session: AsyncSession, orders: Iterable[dict], sign: int = 1) -> None:
+    """Add (sign=1) or subtract (sign=-1) orders in the caller's transaction.
+
+    Rows are upserted in key order, so concurrent checkouts lock them in the same order and cannot
+    deadlock; call this last before commit, since today's row stays locked until then.
+    """
+    days = collect(orders, sign)
+    if not days:
+        return
+    day_rows = [
+        {
+            "day": day,
+            "order_count": d.order_count,
+            "revenue": d.revenue,
+            "buyers_hll": d.buyers or hll_empty(),
+        }
+        for day, d in sorted(days.items())
+    ]
+    stmt = pg_insert(SalesDaily).values(day_rows)
+    set_ = {
+        "order_count": SalesDaily.order_count + stmt.excluded.order_count,
+        "revenue": SalesDaily.revenue + stmt.excluded.revenue,
+    }
+    if sign > 0:
+        set_["buyers_hll"] = HLL_UNION
+    await session.execute(stmt.on_conflict_do_update(index_elements=[SalesDaily.day], set_=set_))
+    product_rows = [
+        {
+            "day": day,
+            "product_id": pid,
+            "sku": sku,
+            "name": name,
+            "qty": qty,
+            "revenue": revenue,
+            "order_count": count,
+        }
+        for day, d in sorted(days.items())
+        for pid, (sku, name, qty, revenue, count) in sorted(d.products.items())
+    ]
+    if product_rows:
+        stmt = pg_insert(ProductSalesDaily).values(product_rows)
+        await session.execute(
+            stmt.on_conflict_do_update(
+                index_elements=[ProductSalesDaily.day, ProductSalesDaily.product_id],
+                set_={
+                    "qty": ProductSalesDaily.qty + stmt.excluded.qty,
+                    "revenue": ProductSalesDaily.revenue + stmt.excluded.revenue,
+                    "order_count": ProductSalesDaily.order_count + stmt.excluded.order_count,
+                },
+            )
+        )
@@ -1,9 +1,10 @@
 from __future__ import annotations
 
 import uuid
+from datetime import datetime
 from decimal import Decimal
-from pydantic import BaseModel
-from typing import List
+from pydantic import BaseModel, Field
+from typing import List, Optional
 
 
 class OrderItemOut(BaseModel):
@@ -23,3 +24,26 @@ class OrderOut(BaseModel):
     items: List[OrderItemOut]
     created_at: str
 
+
+class LegacyOrderItemIn(BaseModel):
+    product_id: str
+    sku: str = ""
+    name: str = ""
+    price: Decimal = Decimal("0")
+    qty: int = 1
+    subtotal: Optional[Decimal] = None
+
+
+class LegacyOrderIn(BaseModel):
+    """Order document as stored by cart-service under order:{id} (unknown fields are ignored)."""
+
+    id: str
+    user: str
+    status: str = "paid"
+    total: Optional[Decimal] = None
+    created_at: Optional[datetime] = None
+    items: List[LegacyOrderItemIn] = []
+
+
+class LegacyOrderImport(BaseModel):
+    orders: List[LegacyOrderIn] = Field(..., min_length=1, max_length=500)
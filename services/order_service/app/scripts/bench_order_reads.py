@@ -0,0 +1,121 @@
+"""Compare order reads built by Postgres (json_agg) with the ORM + Pydantic path.
+
+    python -m app.scripts.bench_order_reads [--email buyer@example.com] [--limit 20] [--runs 200]
+
+Times a page of GET /orders (the buyer's orders, or the newest orders when --email is not given)
+and GET /orders/{id} for the first order of the page, both ways, on the configured database:
+the ORM path loads Order objects with selectinload(Order.items), builds OrderOut models and
+encodes them as FastAPI does; the JSON path runs the single statement of app.reads.
+Both outputs are parsed and compared, so the report also says whether they are the same.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import statistics
+import time
+import uuid
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import select
+from sqlalchemy.orm import selectinload
+
+from .. import pagination, reads
+from ..db import AsyncSessionLocal
+from ..main import serialize_order
+from ..models import Order
+
+
+async def orm_page(session, conds: List, limit: int) -> bytes:
+    res = await session.execute(
+        select(Order).options(selectinload(Order.items)).where(*conds).order_by(*pagination.ORDER_BY).limit(limit + 1)
+    )
+    orders = list(res.scalars().unique().all())[:limit]
+    return json.dumps(jsonable_encoder([serialize_order(o) for o in orders])).encode()
+
+
+async def orm_order(session, oid) -> bytes:
+    o = await session.get(Order, oid, options=[selectinload(Order.items)])
+    return json.dumps(jsonable_encoder(serialize_order(o))).encode()
+
+
+async def json_page(session, conds: List, limit: int) -> bytes:
+    body, _ = await reads.order_page(session, conds, limit, None)
+    return body
+
+
+async def json_order(session, oid) -> bytes:
+    return await reads.order(session, oid)
+
+
+def normalized(body: bytes):
+    """Parsed documents with timestamps as datetimes and items in a stable order."""
+    docs = json.loads(body)
+    for doc in docs if isinstance(docs, list) else [docs]:
+        doc["created_at"] = datetime.fromisoformat(doc["created_at"])
+        doc["items"] = sorted(doc["items"], key=lambda it: (it["product_id"], it["qty"]))
+    return docs
+
+
+async def timed(read: Callable[..., Awaitable[bytes]], runs: int, *args) -> Dict[str, float]:
+    timings = []
+    size = 0
+    for _ in range(runs):
+        # a fresh session per call, like a request handler: no identity map carried over
+        async with AsyncSessionLocal() as session:
+            started = time.perf_counter()
+            body = await read(session, *args)
+            timings.append((time.perf_counter() - started) * 1000)
+            size = len(body)
+    timings.sort()
+    return {
+        "p50_ms": round(statistics.median(timings), 3),
+        "p95_ms": round(timings[min(int(0.95 * len(timings)), len(timings) - 1)], 3),
+        "mean_ms": round(statistics.fmean(timings), 3),
+        "bytes": size,
+    }
+
+
+async def bench(email: Optional[str], limit: int, runs: int) -> Dict:
+    conds = [Order.user_email == email] if email else []
+    async with AsyncSessionLocal() as session:
+        orm_body = await orm_page(session, conds, limit)
+    async with AsyncSessionLocal() as session:
+        json_body = await json_page(session, conds, limit)
+    page = json.loads(json_body)
+    report: Dict = {"orders": len(page), "runs": runs, "detail": {}}
+    report["list"] = {
+        "orm": await timed(orm_page, runs, conds, limit),
+        "json_agg": await timed(json_page, runs, conds, limit),
+        "same_output": normalized(orm_body) == normalized(json_body),
+    }
+    if page:
+        oid = uuid.UUID(page[0]["id"])
+        async with AsyncSessionLocal() as session:
+            same = normalized(await orm_order(session, oid)) == normalized(await json_order(session, oid))
+        report["detail"] = {
+            "orm": await timed(orm_order, runs, oid),
+            "json_agg": await timed(json_order, runs, oid),
+            "same_output": same,
+        }
+    for part in ("list", "detail"):
+        if report[part]:
+            report[part]["speedup_p50"] = round(report[part]["orm"]["p50_ms"] / max(report[part]["json_agg"]["p50_ms"], 1e-6), 2)
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--email", default=None, help="buyer whose orders are listed (default: all orders)")
+    parser.add_argument("--limit", type=int, default=20, help="page size")
+    parser.add_argument("--runs", type=int, default=200, help="timed calls per path")
+    args = parser.parse_args()
+    report = asyncio.run(bench(args.email, args.limit, args.runs))
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
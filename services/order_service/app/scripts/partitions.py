@@ -0,0 +1,181 @@
+"""Create upcoming monthly partitions of the orders tables and archive the old ones.
+
+    python -m app.scripts.partitions [--ahead 3] [--retention-months 24] [--format ndjson|parquet] [--drop] [--dry-run]
+
+Meant to run from cron (e.g. daily). It makes sure partitions exist for the current month and the
+next --ahead months, then for every month older than --retention-months:
+  1. exports the orders of the partition with their items to ARCHIVE_DIR (gzip NDJSON or Parquet)
+     and records every order in archived_orders, so GET /orders/{id} keeps finding it;
+  2. detaches the orders and order_items partitions in one short transaction;
+  3. exports again from the detached tables if the partition changed after the first export;
+  4. with --drop, drops the detached tables (otherwise they stay in the database, outside the orders tables).
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+from datetime import date, datetime, timezone
+from typing import Any, Dict, List
+
+from sqlalchemy import delete, exists, insert, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from .. import archive, partitions
+from ..config import settings
+from ..db import engine
+from ..models import ArchivedOrder, OrderArchive
+
+
+CHUNK = 1000
+DETACH_ATTEMPTS = 5
+
+
+async def register(month: date, partition: str, file: str, fmt: str, index: List[Dict[str, Any]]) -> List[str]:
+    """Record an archive file and its orders.
+
+    An order exported again (a rerun after a failure, or a re-export) points to the new file; earlier
+    archives of the partition left without orders are deleted, and their files are returned.
+    """
+    async with engine.begin() as conn:
+        archive_id = (
+            await conn.execute(
+                insert(OrderArchive)
+                .values(month=month, partition=partition, file=file, format=fmt, orders=len(index))
+                .returning(OrderArchive.id)
+            )
+        ).scalar_one()
+        rows = [{**row, "archive_id": archive_id} for row in index]
+        stmt = pg_insert(ArchivedOrder)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[ArchivedOrder.id],
+            set_={"archive_id": stmt.excluded.archive_id, "block": stmt.excluded.block},
+        )
+        for start in range(0, len(rows), CHUNK):
+            await conn.execute(stmt, rows[start:start + CHUNK])
+        res = await conn.execute(
+            delete(OrderArchive)
+            .where(
+                OrderArchive.partition == partition,
+                OrderArchive.id != archive_id,
+                ~exists().where(ArchivedOrder.archive_id == OrderArchive.id),
+            )
+            .returning(OrderArchive.file)
+        )
+        return list(res.scalars().all())
+
+
+def remove_files(files: List[str]) -> None:
+    for file in files:
+        try:
+            os.remove(archive.path_of(file))
+        except FileNotFoundError:
+            pass
+
+
+async def export(orders_table: str, items_table: str, fmt: str):
+    # one snapshot for the rows and their fingerprint
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="REPEATABLE READ")
+        async with conn.begin():
+            before = await archive.fingerprint(conn, orders_table)
+            file, index = await archive.export(conn, orders_table, items_table, fmt)
+    return before, file, index
+
+
+async def detach(orders_table: str, items_table: str) -> None:
+    """Detach both partitions atomically, so an order is never visible without its items."""
+    for attempt in range(DETACH_ATTEMPTS):
+        try:
+            async with engine.begin() as conn:
+                # a short wait for the locks; on timeout retry later instead of queueing every request behind us
+                await conn.execute(text("SET LOCAL lock_timeout = '5s'"))
+                await conn.execute(text("LOCK TABLE orders, order_items IN ACCESS EXCLUSIVE MODE"))
+                await conn.execute(text(f"ALTER TABLE order_items DETACH PARTITION {items_table}"))
+                # the detached items keep a foreign key to orders, which would forbid detaching their orders
+                fks = await conn.execute(
+                    text("SELECT conname FROM pg_constraint WHERE conrelid = CAST(:t AS regclass) AND contype = 'f'"),
+                    {"t": items_table},
+                )
+                for (name,) in fks.all():
+                    await conn.execute(text(f'ALTER TABLE {items_table} DROP CONSTRAINT "{name}"'))
+                await conn.execute(text(f"ALTER TABLE orders DETACH PARTITION {orders_table}"))
+            return
+        except Exception as e:
+            if "lock timeout" not in str(e) or attempt == DETACH_ATTEMPTS - 1:
+                raise
+            await asyncio.sleep(2 ** attempt)
+
+
+async def archive_month(month: date, orders_table: str, items_table: str, fmt: str, drop: bool) -> Dict[str, Any]:
+    before, file, index = await export(orders_table, items_table, fmt)
+    remove_files(await register(month, orders_table, file, fmt, index))
+    await detach(orders_table, items_table)
+    async with engine.connect() as conn:
+        after = await archive.fingerprint(conn, orders_table)
+    reexported = after != before
+    if reexported:
+        # written between the export and the detach (e.g. a late cancel): the detached tables are final now
+        _, file, index = await export(orders_table, items_table, fmt)
+        remove_files(await register(month, orders_table, file, fmt, index))
+    if drop:
+        async with engine.begin() as conn:
+            await conn.execute(text(f"DROP TABLE {items_table}"))
+            await conn.execute(text(f"DROP TABLE {orders_table}"))
+    return {
+        "month": month.isoformat(),
+        "partition": orders_table,
+        "file": file,
+        "orders": len(index),
+        "reexported": reexported,
+        "dropped": drop,
+    }
+
+
+async def run(ahead: int, retention_months: int, fmt: str, drop: bool, dry_run: bool) -> Dict[str, Any]:
+    current = partitions.month_of(datetime.now(timezone.utc))
+    cutoff = partitions.add_months(current, -retention_months)
+    report: Dict[str, Any] = {"cutoff": cutoff.isoformat(), "created": [], "archived": []}
+    async with engine.connect() as conn:
+        orders_parts = await partitions.attached(conn, "orders")
+        items_parts = await partitions.attached(conn, "order_items")
+    old = sorted(m for m in orders_parts if m < cutoff)
+    if dry_run:
+        upcoming = [partitions.add_months(current, i) for i in range(ahead + 1)]
+        report["created"] = [m.isoformat() for m in upcoming if m not in orders_parts or m not in items_parts]
+        report["archived"] = [{"month": m.isoformat(), "partition": orders_parts[m]} for m in old]
+        report["dry_run"] = True
+        return report
+    report["created"] = await partitions.ensure_ahead(ahead)
+    for month in old:
+        if month not in items_parts:
+            raise RuntimeError(f"{orders_parts[month]} has no order_items partition for {month}")
+        report["archived"].append(await archive_month(month, orders_parts[month], items_parts[month], fmt, drop))
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--ahead", type=int, default=settings.orders_partitions_ahead, help="months to create ahead")
+    parser.add_argument(
+        "--retention-months", type=int, default=settings.orders_retention_months,
+        help="months kept in the database before archiving",
+    )
+    parser.add_argument("--format", choices=archive.FORMATS, default=settings.archive_format, help="archive file format")
+    parser.add_argument("--drop", action="store_true", help="drop the detached tables after archiving")
+    parser.add_argument("--dry-run", action="store_true", help="only report what would be done")
+    args = parser.parse_args()
+    if args.retention_months < 1:
+        parser.error("--retention-months must be at least 1")
+    if args.format == "parquet":
+        try:
+            archive._pyarrow()
+        except RuntimeError as e:
+            parser.error(str(e))
+    report = asyncio.run(run(args.ahead, args.retention_months, args.format, args.drop, args.dry_run))
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""Recompute the daily sales rollups from the orders table.
+
+    python -m app.scripts.rebuild_rollups [--from 2024-01-01] [--to 2024-12-31]
+
+Used once after migration 0004_sales_rollups to load existing history, and whenever the
+rollups should be made exact again (distinct-buyer sketches keep buyers of canceled orders).
+Checkouts and cancels wait while the rollup tables are locked, so the rebuilt range is
+consistent with the orders committed before and after it.
+
+Months archived by `python -m app.scripts.partitions` are no longer in the orders table: their
+rollups are kept, and the rebuild starts after the latest archived month whatever --from says.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+from collections import defaultdict
+from datetime import date
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import and_, delete, func, insert, select, text
+
+from .. import partitions, rollups
+from ..db import AsyncSessionLocal
+from ..models import Order, OrderArchive, OrderItem, ProductSalesDaily, SalesDaily
+from ..pagination import date_range
+
+
+CHUNK = 500
+
+
+async def first_live_day() -> Optional[date]:
+    """First day after the latest archived month (None if nothing is archived)."""
+    async with AsyncSessionLocal() as session:
+        archived = await session.scalar(select(func.max(OrderArchive.month)))
+    return partitions.add_months(archived, 1) if archived else None
+
+
+async def rebuild(date_from: Optional[date] = None, date_to: Optional[date] = None) -> Dict[str, Any]:
+    report: Dict[str, Any] = {}
+    live = await first_live_day()
+    if live is not None and (date_from is None or date_from < live):
+        # the orders of archived months are gone: rebuilding them would wipe their rollups
+        date_from = live
+        report["kept_archived_before"] = live.isoformat()
+    if date_to is not None and date_from is not None and date_to < date_from:
+        return {**report, "days": 0, "product_rows": 0}
+    day = func.date(func.timezone("UTC", Order.created_at))
+    conds = [Order.status != "canceled", *date_range(date_from, date_to)]
+    day_conds = []
+    product_conds = []
+    if date_from:
+        day_conds.append(SalesDaily.day >= date_from)
+        product_conds.append(ProductSalesDaily.day >= date_from)
+    if date_to:
+        day_conds.append(SalesDaily.day <= date_to)
+        product_conds.append(ProductSalesDaily.day <= date_to)
+
+    async with AsyncSessionLocal() as session:
+        # SHARE ROW EXCLUSIVE conflicts with the row locks of checkout/cancel upserts: they wait for the commit
+        await session.execute(text("LOCK TABLE sales_daily, product_sales_daily IN SHARE ROW EXCLUSIVE MODE"))
+        await session.execute(delete(ProductSalesDaily).where(*product_conds))
+        await session.execute(delete(SalesDaily).where(*day_conds))
+
+        # per-product rows are pure sums: computed and inserted by Postgres
+        res = await session.execute(
+            insert(ProductSalesDaily).from_select(
+                ["day", "product_id", "sku", "name", "qty", "revenue", "order_count"],
+                select(
+                    day,
+                    OrderItem.product_id,
+                    func.max(OrderItem.sku),
+                    func.max(OrderItem.name),
+                    func.sum(OrderItem.qty),
+                    func.sum(OrderItem.subtotal),
+                    func.count(func.distinct(OrderItem.order_id)),
+                )
+                .join(Order, and_(Order.id == OrderItem.order_id, Order.created_at == OrderItem.created_at))
+                .where(*conds)
+                .group_by(day, OrderItem.product_id),
+            )
+        )
+        product_rows = res.rowcount or 0
+
+        # buyer sketches are built here from the distinct (day, buyer) pairs
+        sketches: Dict[date, List[int]] = defaultdict(rollups.hll_empty)
+        pairs = await session.stream(select(day, Order.user_email).where(*conds).distinct())
+        async for d, email in pairs:
+            rollups.hll_add(sketches[d], email)
+
+        totals = (
+            await session.execute(
+                select(day, func.count(Order.id), func.coalesce(func.sum(Order.total), 0)).where(*conds).group_by(day)
+            )
+        ).all()
+        rows = [
+            {"day": d, "order_count": int(c), "revenue": r, "buyers_hll": sketches.get(d) or rollups.hll_empty()}
+            for d, c, r in sorted(totals)
+        ]
+        for start in range(0, len(rows), CHUNK):
+            await session.execute(insert(SalesDaily), rows[start:start + CHUNK])
+        await session.commit()
+    return {**report, "days": len(rows), "product_rows": product_rows}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--from", dest="date_from", type=date.fromisoformat, default=None, help="first UTC day (inclusive)")
+    parser.add_argument("--to", dest="date_to", type=date.fromisoformat, default=None, help="last UTC day (inclusive)")
+    args = parser.parse_args()
+    report = asyncio.run(rebuild(args.date_from, args.date_to))
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()